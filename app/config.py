@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -9,13 +9,108 @@ class Settings(BaseSettings):
     
     # Telegram
     BOT_TOKEN: Optional[str] = None
+    # Срок действия initData по auth_date в секундах (0 - не проверять)
+    INIT_DATA_MAX_AGE: int = 0
+    # Кеш проверенных initData (0 - выключен)
+    INIT_DATA_CACHE_SIZE: int = 10000
+    INIT_DATA_CACHE_TTL: int = 3600
+    # Сессионные токены (POST /api/auth/session): секрет подписи (по умолчанию выводится из BOT_TOKEN)
+    SESSION_SECRET: Optional[str] = None
+    SESSION_TOKEN_TTL: int = 3600
     
     # Webhook for file uploads
     ANALYSIS_WEBHOOK_URL: Optional[str] = None
+    # Как файл уходит в webhook: "json" - base64 в поле file, "multipart" - бинарной частью
+    # multipart/form-data (на треть меньше и без декодирования base64 в n8n)
+    ANALYSIS_WEBHOOK_TRANSPORT: str = "json"
     
     # Webhook for recommendations (AI processing)
     RECOMMENDATIONS_WEBHOOK_URL: Optional[str] = None
     
+    # Исходящие HTTP-запросы к webhook (общий пул keep-alive соединений)
+    HTTP_MAX_CONNECTIONS: int = 20
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    HTTP_KEEPALIVE_EXPIRY: float = 30  # секунд держать простаивающее соединение
+    HTTP_CONNECT_TIMEOUT: float = 5
+    HTTP_POOL_TIMEOUT: float = 10  # ожидание свободного соединения / слота получателя
+    HTTP2_ENABLED: bool = True  # используется, если установлен h2
+    # Лимиты по получателям: таймаут ответа и число одновременных запросов (0 - без лимита)
+    ANALYSIS_WEBHOOK_TIMEOUT: float = 60
+    ANALYSIS_WEBHOOK_MAX_CONCURRENCY: int = 4
+    RECOMMENDATIONS_WEBHOOK_TIMEOUT: float = 10
+    RECOMMENDATIONS_WEBHOOK_MAX_CONCURRENCY: int = 10
+    # Сжатие тела исходящих запросов по получателям: none | gzip | zstd (zstd - если установлен zstandard).
+    # Включать, только если получатель понимает Content-Encoding запроса
+    ANALYSIS_WEBHOOK_COMPRESSION: str = "none"
+    RECOMMENDATIONS_WEBHOOK_COMPRESSION: str = "none"
+    WEBHOOK_COMPRESSION_MIN_BYTES: int = 1024  # тела меньше отправляются без сжатия
+    # Входящие callback (/api/analyses/result, /api/recommendations/result) со сжатым телом:
+    # предел размера после распаковки
+    WEBHOOK_CALLBACK_MAX_BYTES: int = 16 * 1024 * 1024
+    
+    # Извлечение текста из PDF (пул процессов)
+    PDF_BACKEND: str = "pypdf2"  # pypdf2 | pypdf | pdfminer | pypdfium2 (см. benchmarks/pdf_backends.py)
+    PDF_WORKERS: int = 0  # 0 - по числу ядер
+    PDF_MAX_QUEUE: int = 16  # больше PDF в обработке - файл уходит в webhook без extractedText
+    PDF_TIMEOUT_SECONDS: float = 20  # на один документ
+    PDF_MAX_PAGES: int = 50  # страницы сверх лимита не обрабатываются (0 - все)
+    PDF_MAX_CHARS: int = 0  # извлечение останавливается, набрав столько символов (0 - без лимита)
+    PDF_PAGE_BATCH_SIZE: int = 4  # страниц на задачу воркера; диапазоны идут параллельно (0 - документ целиком)
+    # Кеш извлеченного текста по SHA-256 документа (сжатые файлы на диске, LRU)
+    PDF_TEXT_CACHE_DIR: Optional[str] = None  # по умолчанию - во временном каталоге системы
+    PDF_TEXT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024  # 0 - выключен
+    
+    # Нормализация фото перед отправкой в webhook (пул процессов, нужен Pillow; HEIC - еще pillow-heif):
+    # поворот по EXIF, уменьшение до IMAGE_MAX_SIDE по длинной стороне, пересжатие в JPEG
+    IMAGE_NORMALIZE_ENABLED: bool = True
+    IMAGE_MAX_SIDE: int = 2048  # px; достаточно для OCR/vision-моделей (0 - без уменьшения)
+    IMAGE_JPEG_QUALITY: int = 85
+    IMAGE_NORMALIZE_MIN_BYTES: int = 256 * 1024  # файлы меньше отправляются как есть
+    IMAGE_WORKERS: int = 0  # 0 - по числу ядер
+    IMAGE_MAX_QUEUE: int = 16  # больше фото в обработке - файл уходит как есть
+    IMAGE_TIMEOUT_SECONDS: float = 20  # на один снимок
+    
+    # Повторная загрузка того же файла (по SHA-256): запись "processing" старше N секунд
+    # считается зависшей, и файл отправляется снова
+    UPLOAD_DEDUP_PROCESSING_TIMEOUT: int = 600
+    
+    # Лимиты загрузок: размер тела запроса (проверяется по Content-Length и при чтении; 0 - без лимита),
+    # ключ - "METHOD /путь запроса" (с префиксом /api), остальные маршруты с лимитами - UPLOAD_MAX_BYTES
+    UPLOAD_MAX_BYTES: int = 20 * 1024 * 1024
+    UPLOAD_ROUTE_MAX_BYTES: Dict[str, int] = {
+        "POST /api/upload-file": 20 * 1024 * 1024,
+    }
+    # Допустимые типы файлов по маршрутам ("image/*" - любой image/); маршрута нет в списке - любой тип
+    UPLOAD_ALLOWED_MIME_TYPES: Dict[str, List[str]] = {
+        "POST /api/upload-file": [
+            "application/pdf",
+            "image/jpeg",
+            "image/png",
+            "image/webp",
+            "image/heic",
+            "image/heif",
+        ],
+    }
+    # Файлы из multipart до этого размера держатся в памяти, больше - во временном файле на диске
+    UPLOAD_SPOOL_MAX_BYTES: int = 1024 * 1024
+    
+    # Очередь вызовов webhook (таблица webhook_jobs): API отвечает 202 сразу после постановки
+    WEBHOOK_QUEUE_ENABLED: bool = True  # false - отправка прямо из запроса, как раньше
+    WEBHOOK_WORKER_IN_PROCESS: bool = True  # воркер в процессе API (false - только python -m app.worker)
+    WEBHOOK_WORKER_CONCURRENCY: int = 4  # задач одновременно на один воркер
+    WEBHOOK_WORKER_POLL_INTERVAL: float = 1  # секунд между проверками очереди
+    WEBHOOK_JOB_MAX_ATTEMPTS: int = 8  # после этого задача - dead
+    WEBHOOK_JOB_BACKOFF_SECONDS: float = 5  # 5, 10, 20, ... секунд между попытками
+    WEBHOOK_JOB_BACKOFF_MAX_SECONDS: float = 600
+    WEBHOOK_JOB_LEASE_SECONDS: int = 300  # задача "running" дольше - воркер считается упавшим
+    WEBHOOK_JOB_SWEEP_INTERVAL_SECONDS: float = 60  # как часто воркер ищет брошенные и старые задачи
+    WEBHOOK_JOB_RETENTION_HOURS: float = 168  # done/dead старше удаляются вместе с файлами (0 - хранить)
+    # Файл загрузки в очереди: "db" - кусками по WEBHOOK_FILE_CHUNK_BYTES в webhook_job_chunks,
+    # "dir" - файлом в WEBHOOK_FILE_DIR (общий том API и воркеров), в задаче только путь
+    WEBHOOK_FILE_STORAGE: str = "db"
+    WEBHOOK_FILE_DIR: Optional[str] = None
+    WEBHOOK_FILE_CHUNK_BYTES: int = 1024 * 1024
+    
     # Database - можно использовать либо DATABASE_URL (проще), либо отдельные параметры
     DATABASE_URL: Optional[str] = None  # Supabase connection string (предпочтительно)
     
@@ -26,6 +121,43 @@ class Settings(BaseSettings):
     PGUSER: Optional[str] = None
     PGPASSWORD: Optional[str] = None
     
+    # Реплика для чтения (GET-эндпоинты); не задана - все идет на primary
+    DATABASE_REPLICA_URL: Optional[str] = None
+    # Сколько секунд после записи пользователь читает с primary (read-your-writes)
+    DB_READ_YOUR_WRITES_SECONDS: int = 10
+    
+    # Пул соединений
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30  # секунд ожидания свободного соединения
+    DB_POOL_RECYCLE: int = 1800  # пересоздавать соединения старше N секунд (Supabase рвет простаивающие)
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_SLOW_CHECKOUT_MS: int = 200  # логировать ожидание соединения дольше N мс (0 - не логировать)
+    # Режим pgbouncer (Supabase pooler): "auto" - включать для порта 6543 (transaction mode),
+    # "transaction" - всегда, "off" - никогда
+    DB_PGBOUNCER_MODE: str = "auto"
+    # Не держать свой пул поверх pgbouncer (NullPool): каждое соединение закрывается после запроса
+    DB_USE_NULLPOOL: bool = False
+    
+    # Бюджет SQL-запросов на один HTTP-запрос (X-DB-Statements в ответе).
+    # Ключ - "METHOD /path" как в роутере; маршруты без записи используют DB_STATEMENT_BUDGET (0 - без лимита)
+    DB_STATEMENT_BUDGET: int = 0
+    DB_ROUTE_BUDGETS: Dict[str, int] = {
+        "GET /api/me": 1,
+        "POST /api/me": 1,
+        "GET /api/analyses/history": 1,
+        "GET /api/opros/history": 1,
+        "POST /api/opros/anemia": 1,
+        "POST /api/analyses/summary": 2,
+        "POST /api/analyses/result": 2,
+        "POST /api/recommendations/get": 6,  # + INSERT в webhook_jobs
+        "POST /api/recommendations/result": 2,
+        "GET /api/recommendations/last": 1,
+        "GET /api/recommendations/{analysis_id}": 1,
+    }
+    # Превышение бюджета: None - ошибка 500 только при NODE_ENV=test, иначе предупреждение в лог
+    DB_BUDGET_STRICT: Optional[bool] = None
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -1,15 +1,35 @@
-from sqlalchemy import create_engine, Column, BigInteger, Text, JSON, DateTime, func
+from sqlalchemy import create_engine, Column, BigInteger, Integer, LargeBinary, Text, JSON, DateTime, ForeignKey, Index, func, text
 from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from app.config import settings
+from app.db.pool import PoolCheckoutStats, make_timed_pool_class
+from app.db.stats import install_query_counters
+from app.middleware.auth import get_tgid_from_header
+from collections import OrderedDict
+from fastapi import Depends
 import os
-from typing import Optional
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
 
 Base = declarative_base()
 
 # Lazy initialization of database engine
 _engine = None
 _SessionLocal = None
+_async_engine = None
+_AsyncSessionLocal = None
+_replica_engine = None
+_ReplicaSessionLocal = None
+
+# Время ожидания соединений из пула - для подбора DB_POOL_SIZE (см. /health/metrics)
+pool_checkout_stats = PoolCheckoutStats()
+async_pool_checkout_stats = PoolCheckoutStats()
+replica_pool_checkout_stats = PoolCheckoutStats()
 
 
 def get_database_url() -> str:
@@ -51,10 +71,108 @@ def get_engine():
             if settings.NODE_ENV == "production" or "supabase" in database_url.lower():
                 connect_args["sslmode"] = "require"
         
-        _engine = create_engine(database_url, connect_args=connect_args)
+        _engine = create_engine(
+            database_url,
+            connect_args=connect_args,
+            **get_pool_kwargs(QueuePool, pool_checkout_stats),
+        )
+        install_query_counters(_engine)
     return _engine
 
 
+def is_pgbouncer_transaction_mode(database_url) -> bool:
+    """Check whether connections go through pgbouncer in transaction mode
+
+    В режиме "auto" ориентируемся на порт: Supabase pooler отдает
+    transaction mode на 6543 и session mode на 5432.
+    """
+    mode = settings.DB_PGBOUNCER_MODE.lower()
+    if mode == "transaction":
+        return True
+    if mode == "off":
+        return False
+    return make_url(database_url).port == 6543
+
+
+def get_pool_kwargs(queue_pool_class: type, stats: PoolCheckoutStats) -> Dict[str, Any]:
+    """Pool settings for create_engine/create_async_engine from Settings"""
+    if settings.DB_USE_NULLPOOL:
+        # Пулом управляет pgbouncer - свой пул не держим
+        return {
+            "poolclass": make_timed_pool_class(NullPool, stats, settings.DB_POOL_SLOW_CHECKOUT_MS),
+            "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        }
+
+    return {
+        "poolclass": make_timed_pool_class(queue_pool_class, stats, settings.DB_POOL_SLOW_CHECKOUT_MS),
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def get_async_database_url(database_url: Optional[str] = None):
+    """Get database URL for the asyncpg driver
+
+    asyncpg не понимает параметр sslmode из libpq, поэтому он вырезается из URL
+    и возвращается отдельно для передачи в connect_args.
+    """
+    url = make_url(database_url or get_database_url())
+    url = url.set(drivername="postgresql+asyncpg")
+
+    query = dict(url.query)
+    sslmode = query.pop("sslmode", None)
+    url = url.set(query=query)
+
+    return url, sslmode
+
+
+def create_asyncpg_engine(raw_database_url: str, stats: PoolCheckoutStats):
+    """Create async engine (asyncpg) with SSL, pgbouncer and pool settings applied"""
+    database_url, sslmode = get_async_database_url(raw_database_url)
+
+    # Та же логика SSL, что и в get_engine(), но в терминах asyncpg
+    connect_args = {}
+    if sslmode:
+        connect_args["ssl"] = sslmode
+    elif "ssl" not in str(database_url).lower():
+        if settings.NODE_ENV == "production" or "supabase" in str(database_url).lower():
+            connect_args["ssl"] = "require"
+
+    if is_pgbouncer_transaction_mode(database_url):
+        # pgbouncer в transaction mode не сохраняет prepared statements между
+        # транзакциями: отключаем кеши asyncpg и SQLAlchemy и делаем имена уникальными
+        database_url = database_url.update_query_dict({"prepared_statement_cache_size": "0"})
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+
+    engine = create_async_engine(
+        database_url,
+        connect_args=connect_args,
+        **get_pool_kwargs(AsyncAdaptedQueuePool, stats),
+    )
+    install_query_counters(engine)
+    return engine
+
+
+def get_async_engine():
+    """Get or create async database engine (asyncpg)"""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_asyncpg_engine(get_database_url(), async_pool_checkout_stats)
+    return _async_engine
+
+
+def get_replica_engine():
+    """Get or create async engine for the read replica (None if DATABASE_REPLICA_URL is not set)"""
+    global _replica_engine
+    if _replica_engine is None and settings.DATABASE_REPLICA_URL:
+        _replica_engine = create_asyncpg_engine(settings.DATABASE_REPLICA_URL, replica_pool_checkout_stats)
+    return _replica_engine
+
+
 def get_session_local():
     """Get or create session maker"""
     global _SessionLocal
@@ -64,6 +182,70 @@ def get_session_local():
     return _SessionLocal
 
 
+def get_async_session_local():
+    """Get or create async session maker"""
+    global _AsyncSessionLocal
+    if _AsyncSessionLocal is None:
+        engine = get_async_engine()
+        # expire_on_commit=False: после commit атрибуты остаются доступными
+        # без ленивой догрузки (в async режиме она невозможна)
+        _AsyncSessionLocal = async_sessionmaker(
+            bind=engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+    return _AsyncSessionLocal
+
+
+def get_replica_session_local():
+    """Get or create session maker for the read replica (None if not configured)"""
+    global _ReplicaSessionLocal
+    if _ReplicaSessionLocal is None:
+        engine = get_replica_engine()
+        if engine is None:
+            return None
+        # read_only в info: queries не пытаются создавать строки на реплике
+        _ReplicaSessionLocal = async_sessionmaker(
+            bind=engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False,
+            info={"read_only": True},
+        )
+    return _ReplicaSessionLocal
+
+
+# Read-your-writes: после записи пользователь DB_READ_YOUR_WRITES_SECONDS читает с primary,
+# чтобы не увидеть на реплике состояние до своей записи. Учет в памяти процесса
+# (при нескольких воркерах uvicorn - у каждого свой).
+_recent_writes: "OrderedDict[str, float]" = OrderedDict()
+_recent_writes_lock = threading.Lock()
+_RECENT_WRITES_MAX = 10000
+
+
+def note_write(tgid: str) -> None:
+    """Remember that tgid has just written to the primary"""
+    if not settings.DATABASE_REPLICA_URL:
+        return
+    with _recent_writes_lock:
+        _recent_writes[tgid] = time.monotonic()
+        _recent_writes.move_to_end(tgid)
+        while len(_recent_writes) > _RECENT_WRITES_MAX:
+            _recent_writes.popitem(last=False)
+
+
+def wrote_recently(tgid: str) -> bool:
+    with _recent_writes_lock:
+        written_at = _recent_writes.get(tgid)
+        if written_at is None:
+            return False
+        if time.monotonic() - written_at < settings.DB_READ_YOUR_WRITES_SECONDS:
+            return True
+        del _recent_writes[tgid]
+        return False
+
+
 class HealthApp(Base):
     __tablename__ = "health_app"
     
@@ -80,6 +262,123 @@ class HealthApp(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 
+class AnalysisReport(Base):
+    """Отчет ИИ по одному анализу (заменяет массив allanalize в health_app)
+
+    Новый отчет - это один INSERT, а не перезапись всей истории пользователя.
+    """
+    __tablename__ = "analysis_reports"
+    __table_args__ = (
+        # История пользователя читается диапазоном по времени (keyset по created_at, id)
+        Index("idx_analysis_reports_tgid_created_at_id", "tgid", "created_at", "id"),
+        # Повторный callback от n8n с тем же отчетом не создает дубликат
+        Index("uq_analysis_reports_tgid_file_created", "tgid", "file_name", "client_created_at", unique=True),
+    )
+    
+    id = Column(BigInteger, primary_key=True)
+    tgid = Column(Text, ForeignKey("health_app.tgid", ondelete="CASCADE"), nullable=False)
+    file_name = Column(Text, nullable=False, default="unknown")
+    text = Column(Text, nullable=False)
+    client_created_at = Column(Text, nullable=False)  # createdAt в том виде, в котором его видит клиент
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())  # для сортировки
+    
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "text": self.text,
+            "fileName": self.file_name,
+            "createdAt": self.client_created_at,
+        }
+
+
+class AnalysisRecommendation(Base):
+    """Рекомендация ИИ по добавкам для одного analysis_id (заменяет JSONB-словарь health_app.rekom)
+
+    Поиск, сохранение и сброс (force_new) затрагивают одну строку по первичному ключу.
+    """
+    __tablename__ = "analysis_recommendations"
+    __table_args__ = (
+        # GET /api/recommendations/last - последняя готовая рекомендация пользователя
+        Index("idx_analysis_recommendations_tgid_updated_at", "tgid", "updated_at"),
+    )
+    
+    tgid = Column(Text, ForeignKey("health_app.tgid", ondelete="CASCADE"), primary_key=True)
+    analysis_id = Column(Text, primary_key=True)
+    status = Column(Text, nullable=False, default="processing")  # processing | ready
+    text = Column(Text)  # NULL, пока рекомендация не пришла от ИИ
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class AnalysisUpload(Base):
+    """Загруженный файл по хешу содержимого (SHA-256) - для дедупликации повторных загрузок
+
+    Повторная загрузка того же файла не отправляется в n8n снова (платный прогон ИИ),
+    а возвращает уже готовый отчет или статус "в обработке".
+    """
+    __tablename__ = "analysis_uploads"
+    __table_args__ = (
+        # Привязка отчета из /api/analyses/result без fileHash - по имени файла и clientTime
+        Index(
+            "idx_analysis_uploads_tgid_file_client_time", "tgid", "file_name", "client_time",
+            postgresql_where=text("report_id IS NULL")
+        ),
+    )
+    
+    tgid = Column(Text, ForeignKey("health_app.tgid", ondelete="CASCADE"), primary_key=True)
+    sha256 = Column(Text, primary_key=True)  # hex
+    file_name = Column(Text, nullable=False)
+    mime_type = Column(Text)
+    size = Column(BigInteger)
+    client_time = Column(Text)  # clientTime, отправленный в n8n (по нему связывается отчет)
+    status = Column(Text, nullable=False, default="processing")  # processing | sent | failed
+    report_id = Column(BigInteger, ForeignKey("analysis_reports.id", ondelete="SET NULL"))
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class WebhookJob(Base):
+    """Отложенный вызов webhook n8n (очередь в Postgres)
+
+    API ставит задачу и сразу отвечает 202; задачи забирают воркеры
+    (python -m app.worker или WEBHOOK_WORKER_IN_PROCESS) через FOR UPDATE SKIP LOCKED,
+    с повторами и backoff. Исчерпавшая попытки задача остается со status="dead".
+    """
+    __tablename__ = "webhook_jobs"
+    __table_args__ = (
+        # Выборка готовых к отправке задач (и зависших у упавшего воркера)
+        Index("idx_webhook_jobs_run_at", "run_at", postgresql_where=text("status IN ('pending', 'running')")),
+    )
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    destination = Column(Text, nullable=False)  # analysis | recommendations (URL берется из настроек при отправке)
+    tgid = Column(Text)
+    payload = Column(JSONB, nullable=False)  # поля JSON-тела
+    file_size = Column(BigInteger)  # размер файла загрузки (None - задача без файла)
+    file_path = Column(Text)  # файл в WEBHOOK_FILE_DIR; None - файл в webhook_job_chunks
+    upload_sha256 = Column(Text)  # запись analysis_uploads, статус которой обновляется по итогу
+    status = Column(Text, nullable=False, default="pending")  # pending | running | done | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    run_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())  # следующая попытка
+    locked_at = Column(DateTime(timezone=True))  # когда воркер забрал задачу
+    last_error = Column(Text)
+    response_status = Column(Integer)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class WebhookJobChunk(Base):
+    """Файл загрузки задачи webhook_jobs, по куску WEBHOOK_FILE_CHUNK_BYTES в строке
+
+    Файл не лежит в строке задачи: выборка задач не тянет его из БД, а запись
+    и чтение идут по одному куску, без всего файла в памяти.
+    """
+    __tablename__ = "webhook_job_chunks"
+    
+    job_id = Column(BigInteger, ForeignKey("webhook_jobs.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(Integer, primary_key=True)  # порядковый номер куска с 0
+    data = Column(LargeBinary, nullable=False)
+
 def get_db():
     """Get database session"""
     try:
@@ -94,6 +393,36 @@ def get_db():
         raise Exception(f"Database not configured: {str(e)}") from e
 
 
+async def get_async_db():
+    """Get async database session"""
+    try:
+        AsyncSessionLocal = get_async_session_local()
+    except ValueError as e:
+        # Database not configured
+        raise Exception(f"Database not configured: {str(e)}") from e
+
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_db(tgid: str = Depends(get_tgid_from_header)):
+    """Get async session for read-only endpoints
+
+    Идет на реплику, если она настроена и пользователь недавно ничего не записывал,
+    иначе - на primary (как get_async_db).
+    """
+    SessionLocal = get_replica_session_local()
+    if SessionLocal is None or wrote_recently(tgid):
+        try:
+            SessionLocal = get_async_session_local()
+        except ValueError as e:
+            # Database not configured
+            raise Exception(f"Database not configured: {str(e)}") from e
+
+    async with SessionLocal() as db:
+        yield db
+
+
 def init_db():
     """Initialize database - create tables"""
     try:
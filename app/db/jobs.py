@@ -0,0 +1,291 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from app.config import settings
+from app.database import WebhookJob, WebhookJobChunk
+from datetime import timedelta
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+
+
+class WebhookJobFileMissing(Exception):
+    """File of a queued upload is gone (удален из WEBHOOK_FILE_DIR или неполон в БД) - повтор не поможет"""
+
+
+def _copy_to_file_dir(fileobj: BinaryIO) -> Tuple[str, int]:
+    if not settings.WEBHOOK_FILE_DIR:
+        raise RuntimeError("WEBHOOK_FILE_STORAGE=dir requires WEBHOOK_FILE_DIR")
+    os.makedirs(settings.WEBHOOK_FILE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="job_", dir=settings.WEBHOOK_FILE_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            fileobj.seek(0)
+            shutil.copyfileobj(fileobj, out, settings.WEBHOOK_FILE_CHUNK_BYTES)
+            size = out.tell()
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, size
+
+
+async def enqueue_webhook_job(
+    db: AsyncSession,
+    destination: str,
+    payload: Dict[str, Any],
+    tgid: Optional[str] = None,
+    fileobj: Optional[BinaryIO] = None,
+    upload_sha256: Optional[str] = None
+) -> int:
+    """Queue a webhook call; returns the job id
+
+    Args:
+        destination: "analysis" или "recommendations" (URL берется из настроек при отправке)
+        payload: Поля JSON-тела
+        fileobj: Файл загрузки - воркер добавит его в тело как "file". Копируется кусками
+            (в webhook_job_chunks или в WEBHOOK_FILE_DIR - по WEBHOOK_FILE_STORAGE),
+            целиком в память не читается
+        upload_sha256: Запись analysis_uploads, которой выставить sent/failed по итогу
+    """
+    job = WebhookJob(
+        destination=destination,
+        tgid=tgid,
+        payload=payload,
+        upload_sha256=upload_sha256,
+        status="pending",
+        attempts=0
+    )
+    if fileobj is not None and settings.WEBHOOK_FILE_STORAGE == "dir":
+        job.file_path, job.file_size = await asyncio.to_thread(_copy_to_file_dir, fileobj)
+    try:
+        db.add(job)
+        if fileobj is not None and job.file_path is None:
+            job.file_size = await asyncio.to_thread(fileobj.seek, 0, os.SEEK_END)
+            await asyncio.to_thread(fileobj.seek, 0)
+            await db.flush()
+            seq = 0
+            while True:
+                data = await asyncio.to_thread(fileobj.read, settings.WEBHOOK_FILE_CHUNK_BYTES)
+                if not data:
+                    break
+                await db.execute(insert(WebhookJobChunk).values(job_id=job.id, seq=seq, data=data))
+                seq += 1
+        await db.commit()
+    except BaseException:
+        if job.file_path:
+            os.unlink(job.file_path)
+        raise
+    return job.id
+
+
+async def open_webhook_job_file(db: AsyncSession, job: WebhookJob) -> BinaryIO:
+    """Open the file of a queued upload for reading (вызывающий код закрывает его)
+
+    Файл из webhook_job_chunks собирается по одному куску во временный файл
+    (до UPLOAD_SPOOL_MAX_BYTES - в памяти, больше - на диске).
+
+    Raises:
+        WebhookJobFileMissing
+    """
+    if job.file_path:
+        try:
+            return await asyncio.to_thread(open, job.file_path, "rb")
+        except FileNotFoundError:
+            raise WebhookJobFileMissing(f"Queued file {job.file_path} does not exist")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.UPLOAD_SPOOL_MAX_BYTES)
+    try:
+        size = 0
+        seq = 0
+        while size < job.file_size:
+            data = (await db.execute(
+                select(WebhookJobChunk.data).where(WebhookJobChunk.job_id == job.id, WebhookJobChunk.seq == seq)
+            )).scalar_one_or_none()
+            if data is None:
+                break
+            await asyncio.to_thread(spool.write, data)
+            size += len(data)
+            seq += 1
+        if size != job.file_size:
+            raise WebhookJobFileMissing(f"Queued file of job {job.id} has {size} of {job.file_size} bytes")
+        spool.seek(0)
+        return spool
+    except BaseException:
+        spool.close()
+        raise
+
+
+def remove_webhook_job_file(file_path: Optional[str]) -> None:
+    """Delete a job's file from WEBHOOK_FILE_DIR (куски в БД удаляются вместе с задачей или complete_webhook_job)"""
+    if file_path:
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            pass
+
+
+def _lease_expired():
+    # Задача "running", которую воркер не завершил за WEBHOOK_JOB_LEASE_SECONDS
+    return and_(
+        WebhookJob.status == "running",
+        WebhookJob.locked_at < func.now() - timedelta(seconds=settings.WEBHOOK_JOB_LEASE_SECONDS)
+    )
+
+
+async def claim_webhook_jobs(db: AsyncSession, limit: int) -> List[WebhookJob]:
+    """Take up to limit due jobs for this worker
+
+    SELECT ... FOR UPDATE SKIP LOCKED внутри UPDATE: параллельные воркеры
+    не ждут друг друга и не получают одну задачу дважды. Задачи "running"
+    старше WEBHOOK_JOB_LEASE_SECONDS (воркер упал посреди отправки) забираются снова,
+    пока не исчерпаны WEBHOOK_JOB_MAX_ATTEMPTS (дальше - dead_letter_lost_webhook_jobs).
+    """
+    due = (
+        select(WebhookJob.id)
+        .where(or_(
+            and_(WebhookJob.status == "pending", WebhookJob.run_at <= func.now()),
+            and_(_lease_expired(), WebhookJob.attempts < settings.WEBHOOK_JOB_MAX_ATTEMPTS)
+        ))
+        .order_by(WebhookJob.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(WebhookJob)
+        .where(WebhookJob.id.in_(due.scalar_subquery()))
+        .values(status="running", attempts=WebhookJob.attempts + 1, locked_at=func.now(), updated_at=func.now())
+        .returning(WebhookJob)
+        .execution_options(synchronize_session=False)
+    )
+    jobs = list(result.scalars().all())
+    await db.commit()
+    return jobs
+
+
+async def complete_webhook_job(db: AsyncSession, job_id: int, response_status: Optional[int]) -> None:
+    """Mark job done; the uploaded file is no longer needed"""
+    await db.execute(
+        update(WebhookJob)
+        .where(WebhookJob.id == job_id)
+        .values(
+            status="done",
+            response_status=response_status,
+            last_error=None,
+            locked_at=None,
+            updated_at=func.now()
+        )
+    )
+    await db.execute(delete(WebhookJobChunk).where(WebhookJobChunk.job_id == job_id))
+    await db.commit()
+
+
+async def dead_letter_lost_webhook_jobs(db: AsyncSession) -> List[WebhookJob]:
+    """Dead-letter jobs whose last allowed attempt never finished
+
+    Задача, на которой воркер падает, зависает или получает OOM, до fail_webhook_job
+    не доходит; без этого она забиралась бы снова бесконечно.
+
+    Returns:
+        Задачи, переведенные в "dead"
+    """
+    result = await db.execute(
+        update(WebhookJob)
+        .where(_lease_expired(), WebhookJob.attempts >= settings.WEBHOOK_JOB_MAX_ATTEMPTS)
+        .values(
+            status="dead",
+            last_error=f"Worker did not finish the job within {settings.WEBHOOK_JOB_LEASE_SECONDS} s",
+            locked_at=None,
+            updated_at=func.now()
+        )
+        .returning(WebhookJob)
+        .execution_options(synchronize_session=False)
+    )
+    jobs = list(result.scalars().all())
+    await db.commit()
+    return jobs
+
+
+async def prune_webhook_jobs(db: AsyncSession, batch_size: int = 1000) -> List[str]:
+    """Delete done and dead jobs older than WEBHOOK_JOB_RETENTION_HOURS
+
+    Куски файлов в webhook_job_chunks удаляются каскадно. Удаление - пачками,
+    чтобы не держать блокировки на всей таблице.
+
+    Returns:
+        Пути файлов удаленных задач в WEBHOOK_FILE_DIR (их удаляет вызывающий код)
+    """
+    if not settings.WEBHOOK_JOB_RETENTION_HOURS:
+        return []
+    paths = []
+    while True:
+        expired = (
+            select(WebhookJob.id)
+            .where(
+                WebhookJob.status.in_(("done", "dead")),
+                WebhookJob.updated_at < func.now() - timedelta(hours=settings.WEBHOOK_JOB_RETENTION_HOURS)
+            )
+            .limit(batch_size)
+        )
+        result = await db.execute(
+            delete(WebhookJob)
+            .where(WebhookJob.id.in_(expired.scalar_subquery()))
+            .returning(WebhookJob.file_path)
+        )
+        deleted = result.scalars().all()
+        await db.commit()
+        paths.extend(path for path in deleted if path)
+        if len(deleted) < batch_size:
+            return paths
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter: WEBHOOK_JOB_BACKOFF_SECONDS * 2^(attempts-1), capped"""
+    delay = min(
+        settings.WEBHOOK_JOB_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0),
+        settings.WEBHOOK_JOB_BACKOFF_MAX_SECONDS
+    )
+    # Разброс - чтобы задачи, упавшие вместе (n8n недоступен), не возвращались все разом
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def fail_webhook_job(
+    db: AsyncSession,
+    job_id: int,
+    attempts: int,
+    error: str,
+    response_status: Optional[int] = None,
+    retryable: bool = True
+) -> str:
+    """Schedule a retry with backoff, or dead-letter the job
+
+    Returns:
+        New status: "pending" (будет повтор) или "dead"
+    """
+    if retryable and attempts < settings.WEBHOOK_JOB_MAX_ATTEMPTS:
+        new_status = "pending"
+        run_at = func.now() + timedelta(seconds=retry_delay(attempts))
+    else:
+        new_status = "dead"
+        run_at = WebhookJob.run_at
+    await db.execute(
+        update(WebhookJob)
+        .where(WebhookJob.id == job_id)
+        .values(
+            status=new_status,
+            run_at=run_at,
+            last_error=error[:2000],
+            response_status=response_status,
+            locked_at=None,
+            updated_at=func.now()
+        )
+    )
+    await db.commit()
+    return new_status
+
+
+async def count_webhook_jobs(db: AsyncSession) -> Dict[str, int]:
+    """Number of jobs by status (dead - не доставленные после всех попыток)"""
+    result = await db.execute(select(WebhookJob.status, func.count()).group_by(WebhookJob.status))
+    return {job_status: count for job_status, count in result.all()}
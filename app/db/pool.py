@@ -0,0 +1,97 @@
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy.pool import QueuePool
+
+
+class PoolCheckoutStats:
+    """Счетчики времени ожидания соединения из пула (для подбора размера пула)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.slow_checkouts = 0
+        self.timeouts = 0
+
+    def record(self, wait: float, slow_threshold: float, failed: bool = False):
+        with self._lock:
+            if failed:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait += wait
+            if wait > self.max_wait:
+                self.max_wait = wait
+            if slow_threshold and wait >= slow_threshold:
+                self.slow_checkouts += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            avg_wait = self.total_wait / self.checkouts if self.checkouts else 0.0
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "slow_checkouts": self.slow_checkouts,
+                "avg_wait_ms": round(avg_wait * 1000, 3),
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+
+class _CheckoutTimingMixin:
+    """Замеряет, сколько запрос ждал соединение (включая установку нового)"""
+
+    checkout_stats: PoolCheckoutStats = None
+    slow_checkout_seconds: float = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except Exception:
+            self.checkout_stats.record(time.perf_counter() - start, self.slow_checkout_seconds, failed=True)
+            raise
+
+        wait = time.perf_counter() - start
+        self.checkout_stats.record(wait, self.slow_checkout_seconds)
+        if self.slow_checkout_seconds and wait >= self.slow_checkout_seconds:
+            print(f"[db_pool] Slow connection checkout: {wait * 1000:.1f} ms ({self.status()})")
+        return connection
+
+
+def make_timed_pool_class(base: type, stats: PoolCheckoutStats, slow_checkout_ms: int) -> type:
+    """Создает класс пула на основе base (QueuePool, NullPool, ...), пишущий время ожидания в stats
+
+    Stats хранятся в атрибутах класса, а не экземпляра: SQLAlchemy пересоздает
+    пул через self.__class__ при dispose().
+    """
+    return type(
+        f"Timed{base.__name__}",
+        (_CheckoutTimingMixin, base),
+        {
+            "checkout_stats": stats,
+            "slow_checkout_seconds": slow_checkout_ms / 1000 if slow_checkout_ms else 0.0,
+        },
+    )
+
+
+def pool_status(engine) -> Dict[str, Any]:
+    """Текущее состояние пула движка (для /health/metrics)"""
+    pool = getattr(engine, "sync_engine", engine).pool
+    status = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        })
+    stats = getattr(pool, "checkout_stats", None)
+    if stats is not None:
+        status["checkout"] = stats.snapshot()
+    return status
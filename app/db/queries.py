@@ -1,262 +1,557 @@
-from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy import text
-from app.database import HealthApp
-from datetime import datetime
-from typing import Dict, Any
-import copy
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Text, and_, case, cast, exists, func, literal, or_, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from app.config import settings
+from app.database import AnalysisRecommendation, AnalysisReport, AnalysisUpload, HealthApp, note_write
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional, Tuple
+import base64
+import binascii
 import json
 import os
 
 
-def get_or_create_user(db: Session, tgid: str) -> HealthApp:
-    """Get or create user record by tgid"""
-    user = db.query(HealthApp).filter(HealthApp.tgid == tgid).first()
+def _upsert_user_statement(tgid: str, *columns):
+    """SELECT существующей строки, а INSERT ... ON CONFLICT (tgid) DO NOTHING - только если ее нет
+
+    Один statement: существующая строка берется из CTE "existing" (никаких UPDATE
+    на чтении). INSERT ... SELECT ... WHERE NOT EXISTS для нее не выбирает ни одной
+    строки, поэтому nextval() для health_app.id не вызывается и чтения не тратят
+    значения последовательности. Новый пользователь создается и возвращается из "inserted".
+    """
+    existing = select(*columns).where(HealthApp.tgid == tgid).cte("existing")
+    empty = cast({}, JSONB)
+    inserted = (
+        pg_insert(HealthApp)
+        .from_select(
+            ["tgid", "profile", "analyses", "recommendations", "allanalize", "rekom", "opros_anemia"],
+            select(literal(tgid, Text), empty, empty, empty, empty, empty, empty)
+            .where(~exists(select(existing)))
+        )
+        .on_conflict_do_nothing(index_elements=[HealthApp.tgid])
+        .returning(*columns)
+        .cte("inserted")
+    )
+    return select(existing).union_all(select(inserted)).limit(1)
+
+
+async def get_or_create_user(db: AsyncSession, tgid: str) -> HealthApp:
+    """Get or create user record by tgid (single round trip)"""
+    stmt = _upsert_user_statement(tgid, *HealthApp.__table__.columns)
+    result = await db.execute(select(HealthApp).from_statement(stmt))
+    user = result.scalars().first()
     
     if not user:
-        user = HealthApp(
-            tgid=tgid,
-            profile={},
-            analyses={},
-            recommendations={},
-            allanalize={},
-            rekom={}
-        )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+        # Параллельный первый запрос вставил строку после снимка нашего statement:
+        # ON CONFLICT ее уже видит, а SELECT в том же statement - еще нет
+        result = await db.execute(select(HealthApp).where(HealthApp.tgid == tgid))
+        user = result.scalars().first()
+    
+    # Фиксируем возможную вставку; для существующего пользователя транзакция только читала
+    await db.commit()
     
     return user
 
 
-def update_profile(db: Session, tgid: str, profile: Dict[str, Any]) -> HealthApp:
-    """Update user profile (merge with existing)
+async def get_user_fields(db: AsyncSession, tgid: str, *fields: str):
+    """Get or create user and load only the requested columns
+
+    Args:
+        db: Database session
+        tgid: Telegram user ID
+        fields: Column names to load (e.g. "profile", "opros_anemia")
+
+    On a read-only (replica) session the user is not created: a missing
+    user is returned with empty JSONB fields.
+
+    Returns:
+        Row with the requested attributes
+    """
+    columns = [HealthApp.__table__.c[field] for field in fields]
+    
+    if db.info.get("read_only"):
+        # Реплика: только SELECT; нового пользователя создаст первая запись на primary
+        result = await db.execute(select(*columns).where(HealthApp.tgid == tgid))
+        row = result.first()
+        if row is None:
+            row = SimpleNamespace(**{field: tgid if field == "tgid" else {} for field in fields})
+        return row
+    
+    result = await db.execute(_upsert_user_statement(tgid, *columns))
+    row = result.first()
+    
+    if row is None:
+        # См. get_or_create_user: строка вставлена параллельным запросом
+        result = await db.execute(select(*columns).where(HealthApp.tgid == tgid))
+        row = result.first()
+    
+    await db.commit()
+    return row
+
+
+def _ensure_user_statement(tgid: str):
+    """INSERT пользователя, если его еще нет (для внешних ключей); существующая строка не трогается
+
+    Как _upsert_user_statement (только tgid): для существующего пользователя INSERT
+    не выбирает строк и не тратит значение последовательности health_app.id.
+    """
+    return _upsert_user_statement(tgid, HealthApp.tgid)
+
+
+async def get_analysis_recommendation(db: AsyncSession, tgid: str, analysis_id: str) -> Optional[AnalysisRecommendation]:
+    """Get recommendation row for one analysis (single primary key lookup)"""
+    result = await db.execute(
+        select(AnalysisRecommendation).where(
+            AnalysisRecommendation.tgid == tgid,
+            AnalysisRecommendation.analysis_id == analysis_id
+        )
+    )
+    return result.scalars().first()
+
+
+async def get_last_recommendation(db: AsyncSession, tgid: str) -> Optional[AnalysisRecommendation]:
+    """Get the most recently saved ready recommendation"""
+    result = await db.execute(
+        select(AnalysisRecommendation)
+        .where(AnalysisRecommendation.tgid == tgid, AnalysisRecommendation.status == "ready")
+        .order_by(AnalysisRecommendation.updated_at.desc())
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+async def mark_recommendation_processing(db: AsyncSession, tgid: str, analysis_id: str) -> None:
+    """Mark recommendation as being generated (also drops the old text for force_new)"""
+    await db.execute(_ensure_user_statement(tgid))
+    await db.execute(
+        pg_insert(AnalysisRecommendation)
+        .values(tgid=tgid, analysis_id=analysis_id, status="processing", text=None)
+        .on_conflict_do_update(
+            index_elements=[AnalysisRecommendation.tgid, AnalysisRecommendation.analysis_id],
+            set_={"status": "processing", "text": None, "updated_at": func.now()}
+        )
+    )
+    await db.commit()
+    note_write(tgid)
+
+
+async def save_recommendation(db: AsyncSession, tgid: str, analysis_id: str, recommendation: str) -> None:
+    """Save ready recommendation text for one analysis"""
+    await db.execute(_ensure_user_statement(tgid))
+    await db.execute(
+        pg_insert(AnalysisRecommendation)
+        .values(tgid=tgid, analysis_id=analysis_id, status="ready", text=recommendation)
+        .on_conflict_do_update(
+            index_elements=[AnalysisRecommendation.tgid, AnalysisRecommendation.analysis_id],
+            set_={"status": "ready", "text": recommendation, "updated_at": func.now()}
+        )
+    )
+    await db.commit()
+    note_write(tgid)
+
+
+def _merge_jsonb_statement(tgid: str, field: str, patch: Dict[str, Any], merge_patch: bool):
+    """Single-statement upsert that merges patch into a JSONB column on the server
+
+    merge_patch=False: column || patch (как dict.update - ключи верхнего уровня заменяются)
+    merge_patch=True: jsonb_merge_patch(column, patch) - RFC 7396, вложенные объекты
+        сливаются рекурсивно, ключ со значением null удаляется
+        (функция из migrations/add_jsonb_merge_patch.sql)
+    """
+    column = HealthApp.__table__.c[field]
+    patch_value = cast(patch, JSONB)
+    
+    # Если в колонке лежит не объект (старые данные), начинаем с пустого объекта
+    current = case(
+        (func.jsonb_typeof(column) == "object", column),
+        else_=cast({}, JSONB)
+    )
+    if merge_patch:
+        merged = func.jsonb_merge_patch(current, patch_value)
+        initial = func.jsonb_merge_patch(cast({}, JSONB), patch_value)
+    else:
+        merged = current.op("||")(patch_value)
+        initial = patch_value
+    
+    return (
+        pg_insert(HealthApp)
+        .values(tgid=tgid, **{field: initial})
+        .on_conflict_do_update(
+            index_elements=[HealthApp.tgid],
+            set_={field: merged, "updated_at": func.now()}
+        )
+        .returning(HealthApp.tgid, column)
+    )
+
+
+async def update_profile(db: AsyncSession, tgid: str, profile: Dict[str, Any], merge_patch: bool = False):
+    """Update user profile (merge with existing) in a single atomic statement
     
     Args:
         db: Database session
         tgid: Telegram user ID
         profile: Dictionary with profile data to update (will be merged with existing)
+        merge_patch: Use JSON merge patch semantics (nested merge, null deletes a key)
     
     Returns:
-        Updated HealthApp user record
+        Row with tgid and the updated profile
     """
     print(f"[update_profile] Starting update for tgid: {tgid}")
     print(f"[update_profile] Received profile data: {profile}")
     
-    user = get_or_create_user(db, tgid)
+    result = await db.execute(_merge_jsonb_statement(tgid, "profile", profile, merge_patch))
+    user = result.one()
+    await db.commit()
+    note_write(tgid)
     
-    # Get current profile and create a copy to avoid mutation issues
-    current_profile = user.profile or {}
-    if not isinstance(current_profile, dict):
-        current_profile = {}
-        print(f"[update_profile] Warning: profile was not a dict, resetting to empty dict")
-    
-    print(f"[update_profile] Current profile before merge: {current_profile}")
-    
-    # Create a new dict by copying current and updating with new data
-    # This ensures we create a new object reference for SQLAlchemy
-    updated_profile = copy.deepcopy(current_profile)
-    updated_profile.update(profile)
+    print(f"[update_profile] Final profile keys: {list(user.profile.keys()) if user.profile else 'None'}")
     
-    print(f"[update_profile] Updated profile after merge: {updated_profile}")
-    print(f"[update_profile] Profile keys: {list(updated_profile.keys())}")
+    return user
+
+
+def parse_client_time(value: Optional[str]) -> Optional[datetime]:
+    """Parse client/n8n ISO timestamp into an aware datetime (None if it can't be parsed)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def add_analysis_report(db: AsyncSession, tgid: str, report: str, file_name: Optional[str], client_time: Optional[str], file_hash: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+    """Save a new AI report: O(1) append to analysis_reports + last_report in analyses
     
-    # Method 1: Try direct assignment with flag_modified
-    # Create a completely new dict object to ensure SQLAlchemy detects the change
-    new_profile = dict(updated_profile)
-    user.profile = new_profile
-    user.updated_at = datetime.utcnow()
+    Args:
+        db: Database session
+        tgid: Telegram user ID
+        report: Report text
+        file_name: Original file name
+        client_time: Client's local time (ISO format with timezone), if n8n passed it back
+        file_hash: SHA-256 of the uploaded file, if n8n passed it back (fileHash) -
+            links the report to analysis_uploads for deduplication
     
-    # Explicitly mark the JSONB column as modified so SQLAlchemy saves it
-    # This is critical for JSON/JSONB columns in PostgreSQL
-    flag_modified(user, "profile")
+    Returns:
+        (новый отчет в формате API {"text", "fileName", "createdAt"}, сохранен ли он) -
+        False, если отчет с тем же fileName и createdAt уже есть (повторный callback);
+        тогда ни история, ни last_report не меняются
+    """
+    # Use client's local time if provided, otherwise use UTC server time
+    created_at_label = client_time if client_time else datetime.utcnow().isoformat()
+    new_report = {
+        "text": report,
+        "fileName": file_name or "unknown",
+        "createdAt": created_at_label,
+    }
     
-    # Flush to ensure changes are sent to database
-    db.flush()
+    # Пользователь должен существовать (внешний ключ)
+    await db.execute(_ensure_user_statement(tgid))
     
-    print(f"[update_profile] Profile after flush: {user.profile}")
-    print(f"[update_profile] Committing to database...")
+    report_values = {
+        "tgid": tgid,
+        "file_name": new_report["fileName"],
+        "text": report,
+        "client_created_at": created_at_label,
+    }
+    created_at = parse_client_time(client_time)
+    if created_at is not None:
+        report_values["created_at"] = created_at
+    
+    # Повторный callback с тем же fileName и createdAt - не дубликат
+    inserted = (
+        pg_insert(AnalysisReport)
+        .values(**report_values)
+        .on_conflict_do_nothing(
+            index_elements=[AnalysisReport.tgid, AnalysisReport.file_name, AnalysisReport.client_created_at]
+        )
+        .returning(AnalysisReport.id)
+        .cte("new_report")
+    )
+    
+    # В том же statement - только если отчет вставлен: привязка к загрузке
+    # (по хешу или по имени файла и clientTime) и last_report (analyses хранит только его)
+    if file_hash:
+        upload_match = AnalysisUpload.sha256 == file_hash
+    else:
+        upload_match = and_(
+            AnalysisUpload.file_name == new_report["fileName"],
+            AnalysisUpload.client_time == created_at_label
+        )
+    linked_upload = (
+        update(AnalysisUpload)
+        .where(
+            AnalysisUpload.tgid == tgid,
+            AnalysisUpload.report_id.is_(None),
+            upload_match,
+            select(inserted.c.id).exists()
+        )
+        .values(report_id=select(inserted.c.id).scalar_subquery(), updated_at=func.now())
+        .cte("linked_upload")
+    )
+    last_report = (
+        update(HealthApp)
+        .where(HealthApp.tgid == tgid, select(inserted.c.id).exists())
+        .values(analyses=cast({"last_report": new_report}, JSONB), updated_at=func.now())
+        .cte("last_report")
+    )
+    result = await db.execute(select(inserted.c.id).add_cte(linked_upload, last_report))
+    saved = result.first() is not None
+    await db.commit()
+    note_write(tgid)
+    
+    return new_report, saved
+
+
+async def claim_upload(
+    db: AsyncSession,
+    tgid: str,
+    sha256: str,
+    file_name: str,
+    mime_type: Optional[str],
+    size: Optional[int],
+    client_time: Optional[str],
+    force: bool = False
+) -> bool:
+    """Register an upload by content hash before sending it to n8n
+    
+    Один INSERT ... ON CONFLICT: параллельные загрузки одного файла (двойное нажатие)
+    не пройдут обе. Существующая запись перезахватывается, только если прошлая
+    отправка не удалась, зависла дольше UPLOAD_DEDUP_PROCESSING_TIMEOUT или force=True.
     
-    db.commit()
-    db.refresh(user)
+    Returns:
+        True - upload should be processed, False - it is a duplicate (see get_upload)
+    """
+    await db.execute(_ensure_user_statement(tgid))
+    
+    stmt = pg_insert(AnalysisUpload).values(
+        tgid=tgid,
+        sha256=sha256,
+        file_name=file_name,
+        mime_type=mime_type,
+        size=size,
+        client_time=client_time,
+        status="processing"
+    )
+    reclaim = None
+    if not force:
+        reclaim = or_(
+            AnalysisUpload.status == "failed",
+            and_(
+                AnalysisUpload.status == "processing",
+                AnalysisUpload.updated_at < func.now() - timedelta(seconds=settings.UPLOAD_DEDUP_PROCESSING_TIMEOUT)
+            )
+        )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AnalysisUpload.tgid, AnalysisUpload.sha256],
+        set_={
+            "file_name": stmt.excluded.file_name,
+            "mime_type": stmt.excluded.mime_type,
+            "size": stmt.excluded.size,
+            "client_time": stmt.excluded.client_time,
+            "status": "processing",
+            "report_id": None,
+            "updated_at": func.now()
+        },
+        where=reclaim
+    ).returning(AnalysisUpload.sha256)
+    
+    result = await db.execute(stmt)
+    claimed = result.first() is not None
+    await db.commit()
+    note_write(tgid)
+    return claimed
+
+
+async def get_upload(db: AsyncSession, tgid: str, sha256: str) -> Tuple[Optional[AnalysisUpload], Optional[AnalysisReport]]:
+    """Get upload by content hash together with its report (if it has arrived)"""
+    result = await db.execute(
+        select(AnalysisUpload, AnalysisReport)
+        .outerjoin(AnalysisReport, AnalysisReport.id == AnalysisUpload.report_id)
+        .where(AnalysisUpload.tgid == tgid, AnalysisUpload.sha256 == sha256)
+    )
+    row = result.first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+async def finish_upload(db: AsyncSession, tgid: str, sha256: str, upload_status: str) -> None:
+    """Set upload status after the webhook call ("sent" or "failed")"""
+    await db.execute(
+        update(AnalysisUpload)
+        .where(AnalysisUpload.tgid == tgid, AnalysisUpload.sha256 == sha256)
+        .values(status=upload_status, updated_at=func.now())
+    )
+    await db.commit()
+    note_write(tgid)
+
+
+def encode_history_cursor(created_at: datetime, report_id: int) -> str:
+    """Opaque cursor for /analyses/history: position of the last returned report"""
+    raw = f"{created_at.isoformat()}|{report_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode cursor produced by encode_history_cursor (ValueError if malformed)
+
+    Значения проверяются до запроса: подделанный курсор (id вне BIGINT, время
+    без часового пояса) дает 400, а не ошибку asyncpg (500).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, report_id = raw.rsplit("|", 1)
+        created_at, report_id = datetime.fromisoformat(created_at), int(report_id)
+        if not 1 <= report_id <= 2**63 - 1 or created_at.tzinfo is None:
+            raise ValueError("id or time out of range")
+        # UTC, как его передаст asyncpg (0001-01-01 с положительным смещением здесь переполняется)
+        created_at = created_at.astimezone(timezone.utc)
+    except (ValueError, OverflowError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return created_at, report_id
+
+
+async def get_analysis_reports_page(db: AsyncSession, tgid: str, limit: int, before: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Get one page of user's analyses history (newest first)
     
-    print(f"[update_profile] Profile after commit and refresh: {user.profile}")
-    print(f"[update_profile] Profile type: {type(user.profile)}")
-    print(f"[update_profile] Final profile keys: {list(user.profile.keys()) if user.profile else 'None'}")
+    Keyset pagination по (created_at, id): стоимость страницы не зависит
+    от длины истории и от того, насколько далеко пролистали.
     
-    # Double-check: Query directly from database to verify
-    verify_user = db.query(HealthApp).filter(HealthApp.tgid == tgid).first()
-    if verify_user:
-        print(f"[update_profile] Verification query - profile: {verify_user.profile}")
-        print(f"[update_profile] Verification query - profile keys: {list(verify_user.profile.keys()) if verify_user.profile else 'None'}")
+    Args:
+        db: Database session
+        tgid: Telegram user ID
+        limit: Page size
+        before: Cursor from the previous page (next_cursor), None for the first page
     
-    return user
+    Returns:
+        (reports, next_cursor) - next_cursor is None on the last page
+    """
+    stmt = select(AnalysisReport).where(AnalysisReport.tgid == tgid)
+    if before:
+        created_at, report_id = decode_history_cursor(before)
+        stmt = stmt.where(tuple_(AnalysisReport.created_at, AnalysisReport.id) < tuple_(created_at, report_id))
+    
+    # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+    result = await db.execute(
+        stmt
+        .order_by(AnalysisReport.created_at.desc(), AnalysisReport.id.desc())
+        .limit(limit + 1)
+    )
+    reports = list(result.scalars())
+    
+    next_cursor = None
+    if len(reports) > limit:
+        reports = reports[:limit]
+        next_cursor = encode_history_cursor(reports[-1].created_at, reports[-1].id)
+    
+    return [report.to_dict() for report in reports], next_cursor
+
 
+async def get_latest_analysis_reports(db: AsyncSession, tgid: str, limit: int) -> List[Dict[str, Any]]:
+    """Get the newest non-empty reports (newest first)"""
+    result = await db.execute(
+        select(AnalysisReport)
+        .where(AnalysisReport.tgid == tgid, AnalysisReport.text != "")
+        .order_by(AnalysisReport.created_at.desc(), AnalysisReport.id.desc())
+        .limit(limit)
+    )
+    return [report.to_dict() for report in result.scalars()]
 
-def update_analyses(db: Session, tgid: str, analyses: Dict[str, Any]) -> HealthApp:
-    """Update analyses and also update corresponding report in allanalize"""
+
+async def update_analyses(db: AsyncSession, tgid: str, analyses: Dict[str, Any]):
+    """Update analyses and also update corresponding report in analysis_reports"""
     print(f"[update_analyses] Starting update for tgid: {tgid}")
     print(f"[update_analyses] Received analyses data keys: {list(analyses.keys()) if isinstance(analyses, dict) else 'not a dict'}")
     
-    user = get_or_create_user(db, tgid)
-    
-    # Get current analyses
-    current_analyses = user.analyses or {}
-    if not isinstance(current_analyses, dict):
-        current_analyses = {}
-    
-    print(f"[update_analyses] Current analyses keys: {list(current_analyses.keys())}")
-    
     # Get the updated last_report if it exists
     updated_last_report = None
     if "last_report" in analyses and isinstance(analyses["last_report"], dict):
         updated_last_report = analyses["last_report"]
         print(f"[update_analyses] Found updated last_report with text length: {len(updated_last_report.get('text', '')) if isinstance(updated_last_report.get('text'), str) else 0}")
     
-    # Merge new data with current data to preserve structure
-    # Create a completely new dict object to ensure SQLAlchemy detects the change
-    updated_analyses = copy.deepcopy(current_analyses)
-    updated_analyses.update(analyses)
-    
-    # Ensure nested objects are also new dicts
-    if "last_report" in updated_analyses and isinstance(updated_analyses["last_report"], dict):
-        updated_analyses["last_report"] = dict(updated_analyses["last_report"])
-    if "reports" in updated_analyses and isinstance(updated_analyses["reports"], list):
-        updated_analyses["reports"] = [dict(r) if isinstance(r, dict) else r for r in updated_analyses["reports"]]
-    
-    # Update allanalize if we have an updated last_report
-    if updated_last_report:
-        current_allanalize = user.allanalize or {}
-        all_analyses_list = []
+    # Update the corresponding report in analysis_reports (before analyses is overwritten:
+    # the fallback match uses the text of the current last_report)
+    report_text = updated_last_report.get("text") if updated_last_report else None
+    if isinstance(report_text, str):
+        report_file_name = updated_last_report.get("fileName")
+        report_created_at = updated_last_report.get("createdAt")
         
-        # Handle different allanalize formats
-        if isinstance(current_allanalize, list):
-            all_analyses_list = current_allanalize.copy()
-        elif isinstance(current_allanalize, dict):
-            if "analyses" in current_allanalize and isinstance(current_allanalize["analyses"], list):
-                all_analyses_list = current_allanalize["analyses"].copy()
-            elif "history" in current_allanalize and isinstance(current_allanalize["history"], list):
-                all_analyses_list = current_allanalize["history"].copy()
+        conditions = []
+        # Match by fileName and createdAt
+        if report_file_name and report_created_at:
+            conditions.append(and_(
+                AnalysisReport.file_name == report_file_name,
+                AnalysisReport.client_created_at == report_created_at
+            ))
+        # Or match by the text of the current last_report
+        current_last_report_text = (
+            select(HealthApp.analyses.op("->")("last_report").op("->>", return_type=Text)("text"))
+            .where(HealthApp.tgid == tgid)
+            .scalar_subquery()
+        )
+        conditions.append(AnalysisReport.text == current_last_report_text)
         
-        # Update the corresponding report in allanalize
-        if all_analyses_list and isinstance(updated_last_report, dict):
-            report_file_name = updated_last_report.get("fileName")
-            report_created_at = updated_last_report.get("createdAt")
-            report_text = updated_last_report.get("text")
-            
-            print(f"[update_analyses] Looking for report in allanalize: fileName={report_file_name}, createdAt={report_created_at}")
-            
-            # Find and update the matching report
-            updated_count = 0
-            for i, item in enumerate(all_analyses_list):
-                if isinstance(item, dict):
-                    # Match by fileName and createdAt
-                    if (report_file_name and report_created_at and
-                        item.get("fileName") == report_file_name and
-                        item.get("createdAt") == report_created_at):
-                        # Update this report
-                        all_analyses_list[i] = dict(updated_last_report)
-                        updated_count += 1
-                        print(f"[update_analyses] Updated report at index {i} in allanalize")
-                    # Or match by text if fileName/createdAt not available
-                    elif report_text and item.get("text") == current_analyses.get("last_report", {}).get("text"):
-                        all_analyses_list[i] = dict(updated_last_report)
-                        updated_count += 1
-                        print(f"[update_analyses] Updated report at index {i} in allanalize (matched by text)")
-            
-            if updated_count > 0:
-                print(f"[update_analyses] Updated {updated_count} report(s) in allanalize")
-                user.allanalize = all_analyses_list
-                flag_modified(user, "allanalize")
-            else:
-                print(f"[update_analyses] No matching report found in allanalize to update")
-    
-    # Create a completely new dict to ensure SQLAlchemy detects the change
-    new_analyses = dict(updated_analyses)
-    user.analyses = new_analyses
-    user.updated_at = datetime.utcnow()
-    
-    # Explicitly mark the JSONB column as modified
-    flag_modified(user, "analyses")
-    
-    db.flush()
-    print(f"[update_analyses] After flush, user.analyses keys: {list(user.analyses.keys()) if isinstance(user.analyses, dict) else 'not a dict'}")
+        result = await db.execute(
+            update(AnalysisReport)
+            .where(AnalysisReport.tgid == tgid, or_(*conditions))
+            .values(text=report_text)
+        )
+        print(f"[update_analyses] Updated {result.rowcount} report(s) in analysis_reports")
     
-    db.commit()
-    db.refresh(user)
+    # Merge new data with current data on the server (top-level keys are replaced)
+    result = await db.execute(_merge_jsonb_statement(tgid, "analyses", analyses, merge_patch=False))
+    user = result.one()
+    await db.commit()
+    note_write(tgid)
     
-    # Verify what was saved
     print(f"[update_analyses] After commit, user.analyses keys: {list(user.analyses.keys()) if isinstance(user.analyses, dict) else 'not a dict'}")
-    if isinstance(user.analyses, dict) and "last_report" in user.analyses:
-        saved_last_report = user.analyses["last_report"]
-        if isinstance(saved_last_report, dict) and "text" in saved_last_report:
-            saved_text_length = len(saved_last_report["text"]) if isinstance(saved_last_report["text"], str) else 0
-            print(f"[update_analyses] Saved last_report.text length: {saved_text_length}")
-            print(f"[update_analyses] Saved last_report.text first 200 chars: {saved_last_report['text'][:200] if isinstance(saved_last_report['text'], str) else 'not a string'}")
     
     return user
 
 
-def update_recommendations(db: Session, tgid: str, recommendations: Dict[str, Any]) -> HealthApp:
+async def update_recommendations(db: AsyncSession, tgid: str, recommendations: Dict[str, Any]) -> HealthApp:
     """Update recommendations"""
-    user = get_or_create_user(db, tgid)
+    user = await get_or_create_user(db, tgid)
     user.recommendations = recommendations
     user.updated_at = datetime.utcnow()
     
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    note_write(tgid)
+    await db.refresh(user)
     return user
 
 
-def update_opros_anemia(db: Session, tgid: str, opros_data: Dict[str, Any]) -> HealthApp:
-    """Update opros_anemia (iron deficiency questionnaire)"""
+async def update_opros_anemia(db: AsyncSession, tgid: str, opros_data: Dict[str, Any], merge_patch: bool = False):
+    """Update opros_anemia (iron deficiency questionnaire) in a single atomic statement"""
     print(f"[update_opros_anemia] Starting update for tgid: {tgid}")
     print(f"[update_opros_anemia] Received opros data: {opros_data}")
     
-    user = get_or_create_user(db, tgid)
-    
-    # Get current opros_anemia and create a copy
-    current_opros = user.opros_anemia or {}
-    if not isinstance(current_opros, dict):
-        current_opros = {}
-        print(f"[update_opros_anemia] Warning: opros_anemia was not a dict, resetting to empty dict")
-    
-    # Create a new dict by copying current and updating with new data
-    updated_opros = copy.deepcopy(current_opros)
-    updated_opros.update(opros_data)
-    
     # Add timestamp
-    updated_opros['updated_at'] = datetime.utcnow().isoformat()
-    
-    # Create a completely new dict object to ensure SQLAlchemy detects the change
-    new_opros = dict(updated_opros)
-    user.opros_anemia = new_opros
-    user.updated_at = datetime.utcnow()
+    patch = dict(opros_data)
+    patch['updated_at'] = datetime.utcnow().isoformat()
     
-    # Explicitly mark the JSONB column as modified
-    flag_modified(user, "opros_anemia")
-    
-    db.flush()
-    print(f"[update_opros_anemia] After flush, user.opros_anemia keys: {list(user.opros_anemia.keys()) if isinstance(user.opros_anemia, dict) else 'not a dict'}")
-    
-    db.commit()
-    db.refresh(user)
+    result = await db.execute(_merge_jsonb_statement(tgid, "opros_anemia", patch, merge_patch))
+    user = result.one()
+    await db.commit()
+    note_write(tgid)
     
     print(f"[update_opros_anemia] After commit, user.opros_anemia keys: {list(user.opros_anemia.keys()) if isinstance(user.opros_anemia, dict) else 'not a dict'}")
     
     return user
 
 
-def get_rekom_for_analysis(db: Session, tgid: str, analysis_id: str) -> Dict[str, Any]:
-    """Get recommendation for specific analysis from rekom column or base.txt"""
-    user = get_or_create_user(db, tgid)
-    
-    # Check if recommendation exists in rekom column
-    rekom_data = user.rekom or {}
-    if isinstance(rekom_data, dict) and analysis_id in rekom_data:
+async def get_rekom_for_analysis(db: AsyncSession, tgid: str, analysis_id: str) -> Dict[str, Any]:
+    """Get recommendation for specific analysis from analysis_recommendations or base.txt"""
+    # Check if recommendation exists
+    existing = await get_analysis_recommendation(db, tgid, analysis_id)
+    if existing is not None and existing.status == "ready":
         return {
             "analysis_id": analysis_id,
-            "recommendation": rekom_data[analysis_id]
+            "recommendation": existing.text
         }
     
     # If not found, load from base.txt
@@ -279,15 +574,8 @@ def get_rekom_for_analysis(db: Session, tgid: str, analysis_id: str) -> Dict[str
             with open(base_path, 'r', encoding='utf-8') as f:
                 base_content = f.read()
             
-            # Save to rekom column for future use
-            if not isinstance(rekom_data, dict):
-                rekom_data = {}
-            rekom_data[analysis_id] = base_content
-            user.rekom = rekom_data
-            flag_modified(user, "rekom")
-            user.updated_at = datetime.utcnow()
-            db.commit()
-            db.refresh(user)
+            # Save for future use
+            await save_recommendation(db, tgid, analysis_id, base_content)
             
             return {
                 "analysis_id": analysis_id,
@@ -303,52 +591,38 @@ def get_rekom_for_analysis(db: Session, tgid: str, analysis_id: str) -> Dict[str
     }
 
 
-def notify_upload(db: Session, tgid: str, file_name: str, mime: str, size: int) -> HealthApp:
-    """Update analyses with upload notification
+async def notify_upload(db: AsyncSession, tgid: str, file_name: str, mime: str, size: int):
+    """Record an upload notification for the user
     
-    NOTE: This function is kept for backward compatibility but should not be used
-    if analyses should only contain reports from HTTP Request.
-    Upload data should be stored separately or not stored in analyses field.
-    """
-    user = get_or_create_user(db, tgid)
-    
-    # Get current analyses (preserve existing reports)
-    current_analyses = user.analyses or {}
-    
-    # Preserve existing reports if they exist
-    reports = current_analyses.get("reports", [])
-    last_report = current_analyses.get("last_report")
-    
-    # Update last_upload and history (but preserve reports)
-    upload_info = {
-        "fileName": file_name,
-        "mime": mime,
-        "size": size,
-        "uploadedAt": datetime.utcnow().isoformat(),
-    }
-    
-    # Only add upload data if we're not using analyses for reports only
-    # For now, we'll preserve both, but the user wants analyses to contain only reports
-    # So we'll skip adding upload data here
-    # current_analyses["last_upload"] = upload_info
-    # upload_history = current_analyses.get("upload_history", [])
-    # upload_history.append(upload_info)
-    # current_analyses["upload_history"] = upload_history
-    
-    # Keep only reports in analyses
-    if reports or last_report:
-        current_analyses = {
-            "reports": reports,
-            "last_report": last_report
-        }
-    else:
-        # If no reports, keep empty
-        current_analyses = {}
-    
-    user.analyses = current_analyses
-    user.updated_at = datetime.utcnow()
+    NOTE: Upload data is not stored in analyses (it should contain only the
+    last report; отчеты - в analysis_reports, загрузки - в analysis_uploads).
+    Один UPDATE только колонки analyses: в ней остается лишь last_report,
+    остальные колонки не читаются. Новый пользователь создается как в get_user_fields.
     
-    db.commit()
-    db.refresh(user)
-    return user
+    Returns:
+        Row with analyses and updated_at
+    """
+    result = await db.execute(
+        update(HealthApp)
+        .where(HealthApp.tgid == tgid)
+        .values(
+            analyses=case(
+                (
+                    HealthApp.analyses.has_key("last_report"),
+                    func.jsonb_build_object("last_report", HealthApp.analyses["last_report"])
+                ),
+                else_=cast({}, JSONB)
+            ),
+            updated_at=func.now()
+        )
+        .returning(HealthApp.analyses, HealthApp.updated_at)
+    )
+    row = result.first()
+    if row is None:
+        # Пользователя еще нет - создаем с пустым analyses
+        return await get_user_fields(db, tgid, "analyses", "updated_at")
+    
+    await db.commit()
+    note_write(tgid)
+    return row
 
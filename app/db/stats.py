@@ -0,0 +1,51 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+
+class QueryStats:
+    """SQL statements and DB time of one HTTP request"""
+
+    __slots__ = ("statements", "db_time", "_started")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self._started = []
+
+
+# Текущий запрос; ContextVar доходит и до greenlet, в котором SQLAlchemy выполняет async-запросы
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def start_request_stats() -> QueryStats:
+    """Start counting statements for the current request"""
+    stats = QueryStats()
+    _current_stats.set(stats)
+    return stats
+
+
+def get_request_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats._started.append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    if stats is not None and stats._started:
+        stats.statements += 1
+        stats.db_time += time.perf_counter() - stats._started.pop()
+
+
+def install_query_counters(engine) -> None:
+    """Count statements and DB time per request on engine (sync or async)"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -6,8 +7,29 @@ import os
 load_dotenv()
 
 from app.routes import health, api
+from app.middleware.db_stats import db_stats_middleware
+from app.utils.http_client import close_http_client, get_http_client
+from app.utils.image_pool import image_pool
+from app.utils.pdf_pool import pdf_pool
+from app.config import settings
+from app.worker import webhook_dispatcher
 
-app = FastAPI(title="Health App Backend")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Один HTTP-клиент с пулом keep-alive соединений на все webhook-запросы
+    get_http_client()
+    # Отправка задач из очереди webhook_jobs прямо в процессе API (без отдельного воркера)
+    if settings.WEBHOOK_QUEUE_ENABLED and settings.WEBHOOK_WORKER_IN_PROCESS:
+        webhook_dispatcher.start()
+    yield
+    await webhook_dispatcher.stop()
+    await close_http_client()
+    pdf_pool.shutdown()
+    image_pool.shutdown()
+
+
+app = FastAPI(title="Health App Backend", lifespan=lifespan)
 
 # CORS configuration - allow all Firebase domains and localhost
 app.add_middleware(
@@ -24,9 +46,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# SQL statements / DB time per request (X-DB-Statements, X-DB-Time-Ms)
+app.middleware("http")(db_stats_middleware)
+
 # Routes
 app.include_router(health.router)
 app.include_router(api.router, prefix="/api")
+app.include_router(api.callback_router, prefix="/api")
+app.include_router(api.upload_router, prefix="/api")
 
 
 @app.get("/")
@@ -1,39 +1,123 @@
 from fastapi import Header, HTTPException, status
-from typing import Optional
-from app.telegram.verify import verify_init_data
-from app.telegram.parse import parse_init_data
+from typing import Optional, Tuple
+import time
+from app.telegram.cache import InitDataCache
+from app.telegram.decode import InitData, decode_init_data
+from app.telegram.session_token import derive_session_secret, issue_session_token, verify_session_token
 from app.config import settings
 
 
-def get_tgid_from_header(x_telegram_initdata: Optional[str] = Header(None)) -> str:
-    """Extract and verify Telegram user ID from initData header"""
-    if not x_telegram_initdata:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Missing x-telegram-initdata header"
-        )
-    
+# Проверенные initData -> tgid (статистика в /health/metrics)
+init_data_cache = InitDataCache(settings.INIT_DATA_CACHE_SIZE, settings.INIT_DATA_CACHE_TTL)
+
+
+def _require_bot_token() -> str:
     if not settings.BOT_TOKEN:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="BOT_TOKEN is not configured"
         )
-    
-    # Verify signature
-    if not verify_init_data(x_telegram_initdata, settings.BOT_TOKEN):
+    return settings.BOT_TOKEN
+
+
+def _session_key() -> bytes:
+    # Один и тот же секрет на всех воркерах - токен не требует общего кеша
+    return derive_session_secret(settings.SESSION_SECRET or _require_bot_token())
+
+
+def _verify_init_data(x_telegram_initdata: str) -> InitData:
+    """Verify initData signature, auth_date and user (raises 401)"""
+    # Verify signature and parse initData (single pass)
+    init_data = decode_init_data(x_telegram_initdata, _require_bot_token())
+    if init_data is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid Telegram initData signature"
         )
     
-    # Parse initData and extract user ID
-    parsed = parse_init_data(x_telegram_initdata)
+    auth_date = init_data.auth_date
+    if settings.INIT_DATA_MAX_AGE and (auth_date is None or time.time() - auth_date > settings.INIT_DATA_MAX_AGE):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Telegram initData has expired"
+        )
     
-    if not parsed.get("parsed_user") or not parsed["parsed_user"].id:
+    if not init_data.user or not init_data.user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid user data in initData"
         )
     
-    return str(parsed["parsed_user"].id)
+    return init_data
 
+
+def _bearer_token(authorization: Optional[str]) -> Optional[str]:
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+def resolve_tgid(x_telegram_initdata: Optional[str], authorization: Optional[str] = None) -> str:
+    """Telegram user ID from a session token (Authorization: Bearer) or from initData"""
+    token = _bearer_token(authorization)
+    if token:
+        tgid = verify_session_token(token, _session_key())
+        if tgid is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired session token"
+            )
+        return tgid
+    
+    if not x_telegram_initdata:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing x-telegram-initdata header"
+        )
+    
+    _require_bot_token()
+    
+    # Same initData string as in a previous request - already verified
+    cached_tgid = init_data_cache.get(x_telegram_initdata)
+    if cached_tgid is not None:
+        return cached_tgid
+    
+    init_data = _verify_init_data(x_telegram_initdata)
+    tgid = str(init_data.user.id)
+    init_data_cache.put(x_telegram_initdata, tgid, init_data.auth_date, settings.INIT_DATA_MAX_AGE)
+    return tgid
+
+
+def get_tgid_from_header(
+    x_telegram_initdata: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+) -> str:
+    """Extract and verify Telegram user ID from session token or initData header"""
+    return resolve_tgid(x_telegram_initdata, authorization)
+
+
+def create_session_token(x_telegram_initdata: Optional[str]) -> Tuple[str, int]:
+    """
+    Exchange verified initData for a session token
+    
+    Returns:
+        (token, expires_at) - срок не больше SESSION_TOKEN_TTL и не дальше
+        окна действия initData (auth_date + INIT_DATA_MAX_AGE), если оно задано
+    """
+    if not x_telegram_initdata:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing x-telegram-initdata header"
+        )
+    
+    init_data = _verify_init_data(x_telegram_initdata)
+    
+    expires_at = int(time.time()) + settings.SESSION_TOKEN_TTL
+    if settings.INIT_DATA_MAX_AGE and init_data.auth_date:
+        expires_at = min(expires_at, init_data.auth_date + settings.INIT_DATA_MAX_AGE)
+    
+    token = issue_session_token(str(init_data.user.id), expires_at, _session_key())
+    return token, expires_at
@@ -0,0 +1,46 @@
+from typing import Callable
+
+from fastapi import HTTPException, Request, Response, status
+from fastapi.routing import APIRoute
+
+from app.config import settings
+from app.utils.compression import DecompressedTooLarge, UnsupportedEncoding, decompress_bytes
+
+
+class DecompressedRequest(Request):
+    """Request whose body() is decoded according to Content-Encoding (gzip, deflate, zstd)"""
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            raw = await super().body()
+            encoding = self.headers.get("content-encoding", "")
+            try:
+                self._body = decompress_bytes(raw, encoding, settings.WEBHOOK_CALLBACK_MAX_BYTES)
+            except UnsupportedEncoding as e:
+                raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+            except DecompressedTooLarge as e:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        return self._body
+
+
+class DecompressingRoute(APIRoute):
+    """
+    Route that accepts Content-Encoding-compressed request bodies (callbacks from n8n)
+
+    Тело распаковывается до разбора JSON/формы: Starlette читает форму через
+    stream(), который отдает уже сохраненное _body. Запросы без Content-Encoding
+    обрабатываются как обычно.
+    """
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            if request.headers.get("content-encoding"):
+                request = DecompressedRequest(request.scope, request.receive)
+                await request.body()
+            return await original_route_handler(request)
+
+        return route_handler
@@ -0,0 +1,71 @@
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from app.config import settings
+from app.db.stats import start_request_stats
+
+
+def get_statement_budget(method: str, route_path: str) -> int:
+    """Statement budget for a route ("METHOD /path"), 0 means unlimited"""
+    return settings.DB_ROUTE_BUDGETS.get(f"{method} {route_path}", settings.DB_STATEMENT_BUDGET)
+
+
+def get_route_path(request: Request) -> str:
+    """Route template with the router prefix ("/api/recommendations/{analysis_id}")
+
+    В новых версиях FastAPI scope["route"] подключенного роутера - исходный маршрут
+    без префикса include_router; префикс восстанавливается по фактическому пути.
+    """
+    path = request.scope["path"]
+    route = request.scope.get("route")
+    route_path = getattr(route, "path", None)
+    path_regex = getattr(route, "path_regex", None)
+    if route_path is None or path_regex is None:
+        return path
+    if path_regex.match(path):
+        return route_path
+    for index, char in enumerate(path):
+        if char == "/" and index and path_regex.match(path[index:]):
+            return path[:index] + route_path
+    return route_path
+
+
+def is_budget_strict() -> bool:
+    if settings.DB_BUDGET_STRICT is not None:
+        return settings.DB_BUDGET_STRICT
+    return settings.NODE_ENV == "test"
+
+
+async def db_stats_middleware(request: Request, call_next):
+    """Count SQL statements and DB time per request and enforce per-route budgets
+
+    Adds X-DB-Statements, X-DB-Time-Ms and Server-Timing headers to responses of
+    requests that ran at least one SQL statement (без запросов к БД - без заголовков и лога).
+    """
+    stats = start_request_stats()
+    response = await call_next(request)
+    
+    if stats.statements == 0:
+        return response
+    
+    db_time_ms = stats.db_time * 1000
+    route_path = get_route_path(request)
+    route_key = f"{request.method} {route_path}"
+    
+    print(f"[db] {route_key}: {stats.statements} statements, {db_time_ms:.1f} ms")
+    
+    budget = get_statement_budget(request.method, route_path)
+    if budget and stats.statements > budget:
+        message = f"{route_key} ran {stats.statements} SQL statements, budget is {budget}"
+        if is_budget_strict():
+            print(f"[db] ERROR: {message}")
+            response = JSONResponse(
+                status_code=500,
+                content={"detail": f"SQL statement budget exceeded: {message}"}
+            )
+        else:
+            print(f"[db] WARNING: {message}")
+    
+    response.headers["X-DB-Statements"] = str(stats.statements)
+    response.headers["X-DB-Time-Ms"] = f"{db_time_ms:.1f}"
+    response.headers["Server-Timing"] = f"db;dur={db_time_ms:.1f}"
+    return response
@@ -0,0 +1,146 @@
+from typing import AsyncGenerator, Callable, List, Optional
+
+from fastapi import HTTPException, Request, Response, UploadFile, status
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from app.config import settings
+
+# Начало файла для проверки, что содержимое соответствует заявленному типу
+FILE_SIGNATURES = {
+    "application/pdf": (b"%PDF-",),
+    "image/png": (b"\x89PNG\r\n\x1a\n",),
+    "image/jpeg": (b"\xff\xd8\xff",),
+    "image/gif": (b"GIF87a", b"GIF89a"),
+}
+
+
+def get_upload_limit(method: str, route_path: str) -> int:
+    """Max request body size for a route ("METHOD /path"), 0 means unlimited"""
+    return settings.UPLOAD_ROUTE_MAX_BYTES.get(f"{method} {route_path}", settings.UPLOAD_MAX_BYTES)
+
+
+def get_allowed_mime_types(method: str, route_path: str) -> Optional[List[str]]:
+    """MIME allowlist for a route, None - любой тип"""
+    return settings.UPLOAD_ALLOWED_MIME_TYPES.get(f"{method} {route_path}")
+
+
+def is_mime_type_allowed(mime_type: Optional[str], allowed: Optional[List[str]]) -> bool:
+    if allowed is None:
+        return True
+    mime_type = (mime_type or "").split(";")[0].strip().lower()
+    return any(
+        mime_type == pattern or (pattern.endswith("/*") and mime_type.startswith(pattern[:-1]))
+        for pattern in allowed
+    )
+
+
+async def file_matches_type(upload: UploadFile, mime_type: str) -> bool:
+    """Check the file's leading bytes against the declared type (типы без сигнатуры не проверяются)"""
+    signatures = FILE_SIGNATURES.get(mime_type.split(";")[0].strip().lower())
+    if not signatures:
+        return True
+    await upload.seek(0)
+    head = await upload.read(16)
+    await upload.seek(0)
+    return head.startswith(signatures)
+
+
+class UnsupportedUploadType(MultiPartException):
+    """File part with a MIME type outside the route's allowlist"""
+
+
+class UploadTooLarge(MultiPartException):
+    """Request body exceeds the route's size limit
+
+    MultiPartException: MultiPartParser.parse закрывает уже записанные временные
+    файлы формы и передает исключение дальше (обработчик маршрута отвечает 413).
+    """
+
+
+class _UploadParser(MultiPartParser):
+    # Проверка типа файла по заголовкам части - до приема ее содержимого
+    def __init__(self, headers: Headers, stream: AsyncGenerator[bytes, None], allowed_types: Optional[List[str]], **kwargs):
+        super().__init__(headers, stream, **kwargs)
+        self.allowed_types = allowed_types
+        self.spool_max_size = settings.UPLOAD_SPOOL_MAX_BYTES
+
+    def on_headers_finished(self) -> None:
+        super().on_headers_finished()
+        upload = self._current_part.file
+        if upload is not None and not is_mime_type_allowed(upload.content_type, self.allowed_types):
+            raise UnsupportedUploadType(f"File type {upload.content_type or 'unknown'} is not allowed")
+
+
+class LimitedRequest(Request):
+    """Request whose body stream raises UploadTooLarge once it exceeds max_bytes"""
+
+    def __init__(self, scope, receive, max_bytes: int):
+        super().__init__(scope, receive)
+        self.max_bytes = max_bytes
+
+    async def stream(self) -> AsyncGenerator[bytes, None]:
+        received = 0
+        async for chunk in super().stream():
+            received += len(chunk)
+            if self.max_bytes and received > self.max_bytes:
+                raise UploadTooLarge(f"Request body exceeds {self.max_bytes} bytes")
+            yield chunk
+
+
+class UploadLimitRoute(APIRoute):
+    """
+    Route with an enforced body size limit, MIME allowlist and multipart spool size
+
+    Лимит (UPLOAD_ROUTE_MAX_BYTES / UPLOAD_MAX_BYTES) проверяется по Content-Length
+    до чтения тела и еще раз по мере чтения (chunked или неверный Content-Length).
+    Тип файла из заголовков multipart-части сверяется с UPLOAD_ALLOWED_MIME_TYPES
+    до приема содержимого файла (список доступен обработчику как
+    request.state.upload_allowed_types); файлы больше UPLOAD_SPOOL_MAX_BYTES пишутся на диск.
+    """
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            # Ключ настроек - путь запроса с префиксом роутера ("POST /api/upload-file")
+            route_path = request.url.path
+            max_bytes = get_upload_limit(request.method, route_path)
+            allowed_types = get_allowed_mime_types(request.method, route_path)
+            request.state.upload_allowed_types = allowed_types
+
+            content_length = request.headers.get("content-length")
+            if max_bytes and content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Request body exceeds {max_bytes} bytes"
+                )
+
+            request = LimitedRequest(request.scope, request.receive, max_bytes)
+            if request.headers.get("content-type", "").startswith("multipart/form-data"):
+                # Форма разбирается здесь (а не в FastAPI), чтобы задать свои лимиты;
+                # FastAPI возьмет уже разобранную форму из request._form
+                parser = _UploadParser(
+                    request.headers,
+                    request.stream(),
+                    allowed_types,
+                )
+                try:
+                    request._form = await parser.parse()
+                except UploadTooLarge as e:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=e.message)
+                except UnsupportedUploadType as e:
+                    raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=e.message)
+                except MultiPartException as e:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+            else:
+                # Остальные тела читаются тоже здесь: в FastAPI исключение при чтении
+                # тела превратилось бы в 400; request.body() кэширует прочитанное
+                try:
+                    await request.body()
+                except UploadTooLarge as e:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=e.message)
+            return await original_route_handler(request)
+
+        return route_handler
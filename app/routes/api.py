@@ -1,6 +1,8 @@
-from fastapi import APIRouter, Depends, Header, HTTPException, status, UploadFile, File, Form, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status, UploadFile, File, Form, Request
 
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from typing import Dict, Any, Optional
 
@@ -8,21 +10,37 @@ from pydantic import BaseModel
 
 from datetime import datetime
 
-import requests
+import httpx
 
 import os
 
+import hashlib
+
+import time
+
+
 
+from app.database import get_async_db, get_async_read_db
 
-from app.database import get_db
+from app.db import jobs, queries
 
-from app.db import queries
+from app.middleware.auth import create_session_token, get_tgid_from_header, resolve_tgid
 
-from app.middleware.auth import get_tgid_from_header
+from app.middleware.content_encoding import DecompressingRoute
+
+from app.middleware.upload_limits import UploadLimitRoute, file_matches_type, is_mime_type_allowed
 
 from app.config import settings
 
-from app.utils.pdf_extractor import extract_text_from_pdf
+from app.utils.image_pool import image_pool
+
+from app.utils.pdf_pool import PdfExtractionCancelled, PdfExtractionTimeout, PdfQueueFull, pdf_pool
+
+from app.utils.streaming import build_upload_body, hash_upload, spool_upload_to_temp_file
+
+from app.utils.http_client import post_webhook
+
+from app.worker import webhook_dispatcher
 
 import traceback
 
@@ -30,6 +48,14 @@ import traceback
 
 router = APIRouter()
 
+# Callback от n8n: тело может прийти сжатым (Content-Encoding: gzip / deflate / zstd)
+
+callback_router = APIRouter(route_class=DecompressingRoute)
+
+# Загрузка файлов: лимит размера тела, допустимые типы, порог сброса на диск (UploadLimitRoute)
+
+upload_router = APIRouter(route_class=UploadLimitRoute)
+
 
 
 # Test endpoint to verify routing works
@@ -66,6 +92,8 @@ class UpdateProfileRequest(BaseModel):
 
     profile: Dict[str, Any]
 
+    merge_patch: Optional[bool] = False  # JSON merge patch: вложенные объекты сливаются, null удаляет ключ
+
 
 
 
@@ -85,6 +113,7 @@ class UpdateRecommendationsRequest(BaseModel):
 
 class UpdateOprosAnemiaRequest(BaseModel):
     opros_anemia: Dict[str, Any]
+    merge_patch: Optional[bool] = False  # JSON merge patch: вложенные объекты сливаются, null удаляет ключ
 
 
 
@@ -118,53 +147,74 @@ class RecommendationResultRequest(BaseModel):
 
 
 
-# GET /api/analyses/history - Get all analyses history from allanalize column
-
-@router.get("/analyses/history")
+# POST /api/auth/session - Exchange initData for a short-lived session token
 
-async def get_analyses_history(
+@router.post("/auth/session")
 
-    tgid: str = Depends(get_tgid_from_header),
+async def create_session(
 
-    db: Session = Depends(get_db)
+    x_telegram_initdata: Optional[str] = Header(None)
 
 ):
 
-    """Get all analyses history from allanalize column"""
+    """Verify initData once and issue a signed session token
 
-    user = queries.get_or_create_user(db, tgid)
+    Send it as "Authorization: Bearer <token>" instead of x-telegram-initdata;
+    request a new token when it expires (401).
+    """
 
-    all_analyses = user.allanalize or {}
+    token, expires_at = create_session_token(x_telegram_initdata)
 
-    
-    
-    # Return as list if it's a list, or wrap in object if it's a dict
+    return {
+
+        "token": token,
+
+        "token_type": "Bearer",
 
-    if isinstance(all_analyses, list):
+        "expires_at": expires_at,
 
-        return {"analyses": all_analyses}
+        "expires_in": max(expires_at - int(time.time()), 0)
 
-    elif isinstance(all_analyses, dict):
+    }
 
-        # If it's a dict, try to extract list from common keys
 
-        if "analyses" in all_analyses:
+# GET /api/analyses/history - Get analyses history from analysis_reports table (newest first, paginated)
 
-            return {"analyses": all_analyses["analyses"]}
+@router.get("/analyses/history")
 
-        elif "history" in all_analyses:
+async def get_analyses_history(
 
-            return {"analyses": all_analyses["history"]}
+    limit: int = Query(20, ge=1, le=100),
 
-        else:
+    before: Optional[str] = Query(None),
 
-            # Convert dict to list of items
+    tgid: str = Depends(get_tgid_from_header),
 
-            return {"analyses": [all_analyses] if all_analyses else []}
+    db: AsyncSession = Depends(get_async_read_db)
 
-    else:
+):
+
+    """Get one page of analyses history
 
-        return {"analyses": []}
+    Pass next_cursor from the previous response as ?before= to get the next (older) page.
+    next_cursor is null on the last page.
+    """
+
+    try:
+
+        analyses, next_cursor = await queries.get_analysis_reports_page(db, tgid, limit, before)
+
+    except ValueError as e:
+
+        raise HTTPException(
+
+            status_code=status.HTTP_400_BAD_REQUEST,
+
+            detail=str(e)
+
+        )
+
+    return {"analyses": analyses, "next_cursor": next_cursor}
 
 
 # GET /api/opros/history - Get questionnaires history from opros_anemia column
@@ -175,13 +225,13 @@ async def get_opros_history(
 
     tgid: str = Depends(get_tgid_from_header),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 
 ):
 
     """Get questionnaires history from opros_anemia column"""
 
-    user = queries.get_or_create_user(db, tgid)
+    user = await queries.get_user_fields(db, tgid, "opros_anemia")
 
     opros_data = user.opros_anemia or {}
 
@@ -203,17 +253,11 @@ async def get_me(
 
     tgid: str = Depends(get_tgid_from_header),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 
 ):
 
-    user = queries.get_or_create_user(db, tgid)
-
-    
-    
-    # Явно обновляем данные из базы перед возвратом
-
-    db.refresh(user)
+    user = await queries.get_user_fields(db, tgid, "tgid", "profile", "analyses")
 
     
     
@@ -285,7 +329,7 @@ async def update_profile(
 
     tgid: str = Depends(get_tgid_from_header),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
@@ -309,7 +353,7 @@ async def update_profile(
 
     # Update profile (this function already handles getting/creating user)
 
-    user = queries.update_profile(db, tgid, request.profile)
+    user = await queries.update_profile(db, tgid, request.profile, merge_patch=request.merge_patch)
 
     
     
@@ -353,11 +397,11 @@ async def update_analyses(
 
     tgid: str = Depends(get_tgid_from_header),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
-    user = queries.update_analyses(db, tgid, request.analyses)
+    user = await queries.update_analyses(db, tgid, request.analyses)
 
     return {
 
@@ -379,11 +423,11 @@ async def update_recommendations(
 
     tgid: str = Depends(get_tgid_from_header),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
-    user = queries.update_recommendations(db, tgid, request.recommendations)
+    user = await queries.update_recommendations(db, tgid, request.recommendations)
 
     return {
 
@@ -402,11 +446,11 @@ async def update_opros_anemia(
 
     tgid: str = Depends(get_tgid_from_header),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
-    user = queries.update_opros_anemia(db, tgid, request.opros_anemia)
+    user = await queries.update_opros_anemia(db, tgid, request.opros_anemia, merge_patch=request.merge_patch)
 
     return {
 
@@ -420,7 +464,7 @@ async def update_opros_anemia(
 async def get_recommendation(
     request: GetRecommendationByTextRequest,
     tgid: str = Depends(get_tgid_from_header),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get recommendation by sending analysis text to AI webhook.
     If analysis_text is not provided, will get all analyses from database and combine them.
@@ -433,102 +477,47 @@ async def get_recommendation(
             detail="Recommendations webhook URL not configured"
         )
     
-    user = queries.get_or_create_user(db, tgid)
+    # Use fixed analysis_id for all analyses to allow saving and loading recommendations
+    if not request.analysis_text:
+        analysis_id = request.analysis_id or f"all_analyses_{tgid}"
+    else:
+        analysis_id = request.analysis_id or f"analysis_{tgid}_{int(datetime.utcnow().timestamp())}"
     
-    # If analysis_text is not provided, get all analyses from database
+    # Load only what this endpoint needs: profile and the recommendation row for analysis_id
+    user = await queries.get_user_fields(db, tgid, "profile")
+    existing = await queries.get_analysis_recommendation(db, tgid, analysis_id)
+    
+    # If analysis_text is not provided, get last 5 analyses from database
     if not request.analysis_text:
-        # Get all analyses from allanalize
-        all_analyses = user.allanalize or {}
-        analyses_list = []
-        
-        # Handle different allanalize formats
-        if isinstance(all_analyses, list):
-            analyses_list = all_analyses
-        elif isinstance(all_analyses, dict):
-            if "analyses" in all_analyses and isinstance(all_analyses["analyses"], list):
-                analyses_list = all_analyses["analyses"]
-            elif "history" in all_analyses and isinstance(all_analyses["history"], list):
-                analyses_list = all_analyses["history"]
-        
-        # Prepare analyses with their dates for sorting
-        analyses_with_dates = []
-        for analysis in analyses_list:
-            if isinstance(analysis, dict):
-                text = analysis.get("text") or analysis.get("report") or ""
-                if text and text.strip():
-                    file_name = analysis.get("fileName") or analysis.get("file_name") or "Анализ"
-                    created_at = analysis.get("createdAt") or analysis.get("created_at") or ""
-                    
-                    # Try to parse date for sorting
-                    sort_date = None
-                    if created_at:
-                        try:
-                            # Try ISO format first
-                            sort_date = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                        except:
-                            try:
-                                # Try other common formats
-                                sort_date = datetime.strptime(created_at, "%Y-%m-%dT%H:%M:%S.%f%z")
-                            except:
-                                try:
-                                    sort_date = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
-                                except:
-                                    # If parsing fails, use current time (will be sorted last)
-                                    sort_date = datetime.min
-                    else:
-                        sort_date = datetime.min
-                    
-                    analyses_with_dates.append({
-                        "file_name": file_name,
-                        "created_at": created_at,
-                        "text": text,
-                        "sort_date": sort_date
-                    })
+        last_5_analyses = await queries.get_latest_analysis_reports(db, tgid, limit=5)
         
-        if not analyses_with_dates:
+        if not last_5_analyses:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Нет загруженных анализов. Загрузите анализы, чтобы получить рекомендации."
             )
         
-        # Sort by date (newest first) and take only last 5
-        analyses_with_dates.sort(key=lambda x: x["sort_date"], reverse=True)
-        last_5_analyses = analyses_with_dates[:5]
-        
-        # Combine last 5 analysis texts
+        # Combine last 5 analysis texts (newest first)
         analysis_texts = []
         for analysis in last_5_analyses:
-            analysis_texts.append(f"\n\n=== {analysis['file_name']} {analysis['created_at']} ===\n{analysis['text']}")
+            analysis_texts.append(f"\n\n=== {analysis['fileName']} {analysis['createdAt']} ===\n{analysis['text']}")
         
         combined_analysis_text = "\n".join(analysis_texts)
-        # Use fixed analysis_id for all analyses to allow saving and loading recommendations
-        analysis_id = request.analysis_id or f"all_analyses_{tgid}"
     else:
         combined_analysis_text = request.analysis_text
-        analysis_id = request.analysis_id or f"analysis_{tgid}_{int(datetime.utcnow().timestamp())}"
     
-    # Check if recommendation exists in rekom (skip if force_new is True)
-    if not request.force_new:
-        rekom_data = user.rekom or {}
-        
-        # Check if recommendation already exists in rekom
-        if isinstance(rekom_data, dict) and analysis_id in rekom_data:
-            return {
-                "analysis_id": analysis_id,
-                "recommendation": rekom_data[analysis_id],
-                "cached": True
-            }
-    else:
-        # force_new=True - удаляем старую рекомендацию из rekom, чтобы она не возвращалась
-        rekom_data = user.rekom or {}
-        if isinstance(rekom_data, dict) and analysis_id in rekom_data:
-            print(f"🔄 force_new=True: удаляем старую рекомендацию для analysis_id={analysis_id}")
-            del rekom_data[analysis_id]
-            user.rekom = rekom_data
-            from sqlalchemy.orm.attributes import flag_modified
-            flag_modified(user, "rekom")
-            db.commit()
-            db.refresh(user)
+    # Check if recommendation already exists (skip if force_new is True)
+    if not request.force_new and existing is not None and existing.status == "ready":
+        return {
+            "analysis_id": analysis_id,
+            "recommendation": existing.text,
+            "cached": True
+        }
+    
+    # Mark as processing; for force_new=True this also drops the old text so it is not returned
+    if request.force_new and existing is not None:
+        print(f"🔄 force_new=True: сбрасываем старую рекомендацию для analysis_id={analysis_id}")
+    await queries.mark_recommendation_processing(db, tgid, analysis_id)
     
     # Get user profile data
     profile = user.profile or {}
@@ -551,19 +540,39 @@ async def get_recommendation(
         print(f"Analysis text length: {len(combined_analysis_text)} characters")
         print(f"Webhook will send result back via HTTP Request to /api/recommendations/result")
         
+        # Очередь webhook_jobs: воркер отправит с повторами, даже если n8n сейчас недоступен
+        if settings.WEBHOOK_QUEUE_ENABLED:
+            try:
+                job_id = await jobs.enqueue_webhook_job(db, "recommendations", webhook_payload, tgid=tgid)
+                webhook_dispatcher.wake()
+                print(f"📬 Recommendation request queued (job {job_id})")
+                return JSONResponse(
+                    status_code=status.HTTP_202_ACCEPTED,
+                    content={
+                        "analysis_id": analysis_id,
+                        "status": "processing",
+                        "jobId": job_id,
+                        "message": "Analysis sent to AI for processing. Please wait..."
+                    }
+                )
+            except Exception as queue_err:
+                # Таблицы нет / БД недоступна - отправляем прямо из запроса, как раньше
+                await db.rollback()
+                print(f"⚠️ Could not queue recommendation request, sending directly: {queue_err}")
+        
         # Send to webhook (don't wait for response - webhook will send result via HTTP Request)
         try:
-            requests.post(
+            await post_webhook(
+                "recommendations",
                 webhook_url,
                 json=webhook_payload,
-                headers={"Content-Type": "application/json"},
-                timeout=10  # Short timeout just to send the request
+                headers={"Content-Type": "application/json"}
             )
         except Exception as e:
             print(f"Warning: Could not send to webhook: {e}")
             # Continue anyway - webhook might still process
         
-        # Return status - recommendation will be saved in rekom by webhook
+        # Return status - recommendation will be saved by webhook via /api/recommendations/result
         return {
             "analysis_id": analysis_id,
             "status": "processing",
@@ -579,12 +588,12 @@ async def get_recommendation(
 
 
 # POST /api/recommendations/result - Receive recommendation result from webhook (no auth required)
-@router.post("/recommendations/result")
+@callback_router.post("/recommendations/result")
 async def receive_recommendation_result(
     request: RecommendationResultRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Receive recommendation result from webhook and save to rekom column
+    """Receive recommendation result from webhook and save to analysis_recommendations
     
     This endpoint is called by n8n webhook via HTTP Request to send back
     the AI-generated recommendation.
@@ -602,43 +611,14 @@ async def receive_recommendation_result(
     print(f"Recommendation length: {len(request.recommendation)} characters")
     
     try:
-        # Get or create user
-        user = queries.get_or_create_user(db, request.tgid)
-        rekom_data = user.rekom or {}
-        
-        # Save recommendation to rekom column
-        if not isinstance(rekom_data, dict):
-            rekom_data = {}
-        rekom_data[request.analysis_id] = request.recommendation
-        user.rekom = rekom_data
-        from sqlalchemy.orm.attributes import flag_modified
-        flag_modified(user, "rekom")
+        await queries.save_recommendation(db, request.tgid, request.analysis_id, request.recommendation)
         
-        # Also save to recommendations column with timestamp
-        recommendations_data = user.recommendations or {}
-        if not isinstance(recommendations_data, dict):
-            recommendations_data = {}
-        
-        # Save recommendation with timestamp
-        recommendations_data["last_recommendation"] = {
-            "text": request.recommendation,
-            "analysis_id": request.analysis_id,
-            "created_at": datetime.utcnow().isoformat()
-        }
-        user.recommendations = recommendations_data
-        flag_modified(user, "recommendations")
-        
-        user.updated_at = datetime.utcnow()
-        
-        db.commit()
-        db.refresh(user)
-        
-        print(f"✅ Recommendation saved to rekom and recommendations for user {request.tgid}")
+        print(f"✅ Recommendation saved for user {request.tgid}")
         print(f"Analysis ID: {request.analysis_id}")
         
         return {
             "success": True,
-            "message": "Recommendation saved to rekom and recommendations",
+            "message": "Recommendation saved",
             "tgid": request.tgid,
             "analysis_id": request.analysis_id,
             "recommendation_length": len(request.recommendation)
@@ -652,53 +632,51 @@ async def receive_recommendation_result(
         )
 
 
-# GET /api/recommendations/{analysis_id} - Get recommendation from rekom by analysis_id
-@router.get("/recommendations/{analysis_id}")
-async def get_recommendation_by_id(
-    analysis_id: str,
+# GET /api/recommendations/last - Get last ready recommendation
+# (declared before /recommendations/{analysis_id}, otherwise "last" is matched as an analysis_id)
+@router.get("/recommendations/last")
+async def get_last_recommendation(
     tgid: str = Depends(get_tgid_from_header),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    """Get recommendation from rekom by analysis_id"""
-    user = queries.get_or_create_user(db, tgid)
-    rekom_data = user.rekom or {}
+    """Get last ready recommendation"""
+    last_rec = await queries.get_last_recommendation(db, tgid)
     
-    if isinstance(rekom_data, dict) and analysis_id in rekom_data:
+    if last_rec is not None:
         return {
-            "analysis_id": analysis_id,
-            "recommendation": rekom_data[analysis_id],
+            "recommendation": last_rec.text or "",
+            "analysis_id": last_rec.analysis_id,
+            "created_at": last_rec.updated_at.isoformat() if last_rec.updated_at else "",
             "status": "ready"
         }
     
     return {
-        "analysis_id": analysis_id,
-        "status": "processing",
-        "message": "Recommendation is being processed"
+        "status": "not_found",
+        "message": "No recommendation found"
     }
 
 
-# GET /api/recommendations/last - Get last recommendation from recommendations column
-@router.get("/recommendations/last")
-async def get_last_recommendation(
+# GET /api/recommendations/{analysis_id} - Get recommendation by analysis_id
+@router.get("/recommendations/{analysis_id}")
+async def get_recommendation_by_id(
+    analysis_id: str,
     tgid: str = Depends(get_tgid_from_header),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
-    """Get last recommendation from recommendations column"""
-    user = queries.get_or_create_user(db, tgid)
-    recommendations_data = user.recommendations or {}
+    """Get recommendation by analysis_id"""
+    recommendation = await queries.get_analysis_recommendation(db, tgid, analysis_id)
     
-    if isinstance(recommendations_data, dict) and "last_recommendation" in recommendations_data:
-        last_rec = recommendations_data["last_recommendation"]
+    if recommendation is not None and recommendation.status == "ready":
         return {
-            "recommendation": last_rec.get("text", ""),
-            "analysis_id": last_rec.get("analysis_id", ""),
-            "created_at": last_rec.get("created_at", ""),
+            "analysis_id": analysis_id,
+            "recommendation": recommendation.text,
             "status": "ready"
         }
     
     return {
-        "status": "not_found",
-        "message": "No recommendation found"
+        "analysis_id": analysis_id,
+        "status": "processing",
+        "message": "Recommendation is being processed"
     }
 
 
@@ -712,11 +690,11 @@ async def notify_upload(
 
     tgid: str = Depends(get_tgid_from_header),
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
-    user = queries.notify_upload(db, tgid, request.fileName, request.mime, request.size)
+    user = await queries.notify_upload(db, tgid, request.fileName, request.mime, request.size)
 
     
     
@@ -742,9 +720,11 @@ async def notify_upload(
 
             }
 
-            # Send to webhook asynchronously (don't block response)
+            # Short timeout - only notify the webhook (shared client, doesn't block the event loop)
 
-            requests.post(
+            await post_webhook(
+
+                "analysis",
 
                 webhook_url,
 
@@ -792,6 +772,8 @@ class AnalysisResultRequest(BaseModel):
 
     clientTime: Optional[str] = None  # Client's local time (ISO format with timezone)
 
+    fileHash: Optional[str] = None  # SHA-256 of the uploaded file (sent to n8n with the file)
+
 
 
 
@@ -800,7 +782,7 @@ class AnalysisResultRequest(BaseModel):
 
 # Accepts both JSON and Form-Data for flexibility
 
-@router.post("/analyses/result")
+@callback_router.post("/analyses/result")
 
 async def receive_analysis_result(
 
@@ -816,7 +798,9 @@ async def receive_analysis_result(
 
     clientTime: Optional[str] = Form(None),
 
-    db: Session = Depends(get_db)
+    fileHash: Optional[str] = Form(None),
+
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
@@ -850,6 +834,8 @@ async def receive_analysis_result(
 
     client_time_value = None
 
+    file_hash_value = None
+
     
     
     # Try to get data from JSON first (Pydantic model)
@@ -864,6 +850,8 @@ async def receive_analysis_result(
 
         client_time_value = request_data.clientTime
 
+        file_hash_value = request_data.fileHash
+
         print("Received as JSON (Pydantic model)")
 
     # Try Form-Data
@@ -878,6 +866,8 @@ async def receive_analysis_result(
 
         client_time_value = clientTime  # Get from Form if available
 
+        file_hash_value = fileHash
+
         print("Received as Form-Data")
 
     # Try to parse raw request body (for nested JSON from n8n)
@@ -916,6 +906,8 @@ async def receive_analysis_result(
 
                     client_time_value = json_data.get("clientTime")
 
+                    file_hash_value = json_data.get("fileHash")
+
                     print("Received as nested JSON from raw request")
 
         except Exception as e:
@@ -950,246 +942,37 @@ async def receive_analysis_result(
     
     try:
 
-        # Get or create user
-
-        user = queries.get_or_create_user(db, tgid_value)
-
-        
-        
-        # Get existing reports only (ignore last_upload, upload_history - they are not part of analyses)
-
-        current_analyses = user.analyses or {}
-
-        reports = current_analyses.get("reports", [])
-
-        
-        
         # Use client's local time if provided, otherwise use UTC server time
         # client_time_value comes from the webhook (n8n should return it back)
-        created_at = client_time_value if client_time_value else datetime.utcnow().isoformat()
-        
         if client_time_value:
             print(f"Using client's local time: {client_time_value}")
         else:
-            print(f"Using UTC server time (clientTime not provided): {created_at}")
-        
-        # Create new report
-
-        new_report = {
-
-            "text": report_value,
-
-            "fileName": fileName_value or "unknown",
-
-            "createdAt": created_at,
-
-        }
-
-        
-        
-        # Add to reports list
-
-        reports.append(new_report)
-
-        
-        
-        # Save ONLY report data in analyses (no last_upload, upload_history)
-
-        # analyses should contain only what comes from HTTP Request (reports)
-
-        user.analyses = {
-
-            "reports": reports,
-
-            "last_report": new_report  # Save last report for quick access
-
-        }
-
-        
-        
-        # Add to allanalize - история всех анализов
-
-        # ВАЖНО: в allanalize сохраняем только отдельные отчеты, а не весь объект analyses
-
-        current_allanalize = user.allanalize or {}
-
-        all_analyses_list = []
-
-        
-        
-        # Если allanalize - это список, используем его
-
-        if isinstance(current_allanalize, list):
-
-            all_analyses_list = current_allanalize.copy()
-
-        # Если allanalize - это объект с ключом "analyses" или "history"
-
-        elif isinstance(current_allanalize, dict):
-
-            if "analyses" in current_allanalize and isinstance(current_allanalize["analyses"], list):
-
-                all_analyses_list = current_allanalize["analyses"].copy()
-
-            elif "history" in current_allanalize and isinstance(current_allanalize["history"], list):
-
-                all_analyses_list = current_allanalize["history"].copy()
-
-            else:
-
-                # Если это просто объект, создаем новый список
-
-                all_analyses_list = []
-        
-        
-
-        # ВАЖНО: Добавляем только new_report (отдельный отчет), а не весь объект analyses
-
-        # Проверяем, что не добавляем дубликаты
-
-        # Если последний элемент уже такой же (по fileName и createdAt), не добавляем
-
-        if all_analyses_list:
-
-            last_item = all_analyses_list[-1]
-
-            if isinstance(last_item, dict):
-
-                # Если последний элемент - это весь объект analyses (старый формат), удаляем его
-
-                if "reports" in last_item and "last_report" in last_item:
-
-                    # Это старый формат - удаляем его
-
-                    all_analyses_list.pop()
-
-                # Если это уже такой же отчет, не добавляем дубликат
-
-                elif last_item.get("fileName") == new_report["fileName"] and last_item.get("createdAt") == new_report["createdAt"]:
-
-                    # Дубликат - не добавляем
-
-                    pass
-
-                else:
-
-                    all_analyses_list.append(new_report)
-
-            else:
-
-                all_analyses_list.append(new_report)
-
-        else:
-
-            all_analyses_list.append(new_report)
-        
-        
-
-        # Сохраняем обновленную историю в allanalize
-
-        user.allanalize = all_analyses_list
-
-        
-        
-        # Помечаем JSONB колонки как измененные
-
-        from sqlalchemy.orm.attributes import flag_modified
-
-        flag_modified(user, "analyses")
-
-        flag_modified(user, "allanalize")
-
-        
-        
-        user.updated_at = datetime.utcnow()
-
-        
-        
-        db.flush()
-
-        db.commit()
-
-        db.refresh(user)
-
-        
-        
-        # Детальное логирование после сохранения
-
-        print(f"✅ Report saved successfully for user {tgid_value}")
-
-        print(f"Analyses now contains only reports (no upload data)")
-
-        print(f"Reports count: {len(reports)}")
-
-        print(f"Last report exists: True")
-
-        print(f"✅ All analyses history saved to allanalize")
-
-        print(f"All analyses count: {len(all_analyses_list)}")
-
-        print(f"Allanalize type: {type(user.allanalize)}")
-
+            print(f"Using UTC server time (clientTime not provided)")
         
+        # Один INSERT в analysis_reports вместо перезаписи всей истории
+        # (allanalize и analyses.reports больше не ведутся, analyses хранит только last_report)
+        new_report, saved = await queries.add_analysis_report(db, tgid_value, report_value, fileName_value, client_time_value, file_hash_value)
         
-        # Проверяем, что данные правильно сохранились
-
-        print(f"[DEBUG] After commit and refresh:")
-
-        print(f"[DEBUG] user.analyses type: {type(user.analyses)}")
-
-        print(f"[DEBUG] user.analyses value: {user.analyses}")
-
-        if isinstance(user.analyses, dict):
-
-            print(f"[DEBUG] user.analyses keys: {list(user.analyses.keys())}")
-
-            if "last_report" in user.analyses:
-
-                print(f"[DEBUG] user.analyses['last_report']: {user.analyses['last_report']}")
-
-                if isinstance(user.analyses["last_report"], dict):
-
-                    print(f"[DEBUG] user.analyses['last_report'] keys: {list(user.analyses['last_report'].keys())}")
-
-                    if "text" in user.analyses["last_report"]:
-
-                        text_val = user.analyses["last_report"]["text"]
-
-                        print(f"[DEBUG] user.analyses['last_report']['text'] type: {type(text_val)}")
-
-                        print(f"[DEBUG] user.analyses['last_report']['text'] length: {len(text_val) if isinstance(text_val, str) else 'not a string'}")
-
-                        print(f"[DEBUG] user.analyses['last_report']['text'] first 200 chars: {text_val[:200] if isinstance(text_val, str) else 'not a string'}")
-
-                    else:
-
-                        print(f"[DEBUG] WARNING: 'text' key not found in last_report!")
-
-                else:
-
-                    print(f"[DEBUG] WARNING: last_report is not a dict, type: {type(user.analyses['last_report'])}")
-
-            else:
-
-                print(f"[DEBUG] WARNING: 'last_report' key not found in analyses!")
-
+        if saved:
+            print(f"✅ Report saved successfully for user {tgid_value}")
         else:
-
-            print(f"[DEBUG] WARNING: user.analyses is not a dict, type: {type(user.analyses)}")
+            # Отчет с тем же fileName и createdAt уже есть - история и last_report не изменены
+            print(f"⚠️ Duplicate report ignored for user {tgid_value}: {new_report['fileName']} at {new_report['createdAt']}")
+        print(f"Report createdAt: {new_report['createdAt']}")
         
-        
-
         return {
 
             "success": True,
 
-            "message": "Report saved",
+            "message": "Report saved" if saved else "Report already exists",
+
+            "duplicate": not saved,
 
             "tgid": tgid_value,
 
             "reportLength": len(report_value),
 
-            "analysesKeys": list(user.analyses.keys())
+            "analysesKeys": ["last_report"]
 
         }
 
@@ -1213,10 +996,12 @@ async def receive_analysis_result(
 
 # POST /api/upload-file - Upload file to webhook (proxy)
 
-@router.post("/upload-file")
+@upload_router.post("/upload-file")
 
 async def upload_file_to_webhook(
 
+    raw_request: Request,
+
     file: UploadFile = File(...),
 
     fileName: str = Form(...),
@@ -1227,9 +1012,13 @@ async def upload_file_to_webhook(
 
     clientTime: Optional[str] = Form(None),
 
+    force: Optional[bool] = Form(False),  # отправить в n8n, даже если этот файл уже загружался
+
     x_telegram_initdata: Optional[str] = Header(None),
 
-    db: Session = Depends(get_db)
+    authorization: Optional[str] = Header(None),
+
+    db: AsyncSession = Depends(get_async_db)
 
 ):
 
@@ -1247,13 +1036,13 @@ async def upload_file_to_webhook(
 
     tgid = "unknown"
 
-    if x_telegram_initdata:
+    if x_telegram_initdata or authorization:
 
         try:
 
-            # Call the function directly with the header value
+            # Call the function directly with the header values
 
-            tgid = get_tgid_from_header(x_telegram_initdata)
+            tgid = resolve_tgid(x_telegram_initdata, authorization)
 
             print(f"TGID extracted from header: {tgid}")
 
@@ -1269,7 +1058,7 @@ async def upload_file_to_webhook(
 
     else:
 
-        print("WARNING: No x-telegram-initdata header provided")
+        print("WARNING: No x-telegram-initdata or Authorization header provided")
 
     print(f"Received file: {fileName}")
 
@@ -1280,665 +1069,37 @@ async def upload_file_to_webhook(
     print(f"TGID: {tgid}")
 
     
-    
-    # Get user profile data from database
 
-    profile_data = {}
+    # Заявленный тип - из списка допустимых, и содержимое ему соответствует
 
-    if tgid != "unknown" and tgid != "auth_failed":
+    # (проверяется до БД, пула извлечения PDF и webhook)
 
-        try:
+    allowed_types = getattr(raw_request.state, "upload_allowed_types", None)
 
-            user = queries.get_or_create_user(db, tgid)
+    if not is_mime_type_allowed(mimeType, allowed_types) or not await file_matches_type(file, mimeType):
 
-            profile_data = user.profile or {}
+        print(f"❌ Rejected upload: file type {mimeType} is not allowed or does not match the content")
 
-            print(f"Profile data loaded: {list(profile_data.keys()) if profile_data else 'empty'}")
+        raise HTTPException(
 
-        except Exception as profile_err:
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
 
-            print(f"Warning: Could not load profile data: {profile_err}")
+            detail=f"Unsupported file type: {mimeType}"
 
-            profile_data = {}
-
-    else:
-
-        print("Skipping profile load - invalid tgid")
-    
-    
-
-    webhook_url = settings.ANALYSIS_WEBHOOK_URL
-
-    print(f"Webhook URL from settings: {webhook_url}")
-
-    
-    
-    # If webhook is not configured, we'll just save to database and return success
-    
-
-    try:
-
-        # Update database first (always do this)
-        analyses = {}
-
-        try:
-
-            print("Updating database...")
-
-            user = queries.notify_upload(db, tgid, fileName, mimeType, size)
-
-            print("Database updated successfully")
-
-            analyses = user.analyses or {}
-
-        except Exception as db_err:
-
-            print(f"⚠️ Database update failed (non-critical): {db_err}")
-
-        
-        # Send to webhook only if configured
-        response = None
-        
-        if webhook_url:
-
-            print("Reading file content...")
-
-            # Read file content
-
-            file_content = await file.read()
-
-            print(f"File content read: {len(file_content)} bytes")
-
-            
-            
-            # Extract text from PDF if it's a PDF file
-            extracted_text = None
-            if mimeType == "application/pdf":
-                print("📄 PDF file detected - extracting text...")
-                extracted_text = extract_text_from_pdf(file_content)
-                if extracted_text:
-                    print(f"✅ Extracted {len(extracted_text)} characters from PDF")
-                else:
-                    print("⚠️ Warning: Could not extract text from PDF, will send file as-is")
-            
-            
-            print(f"=== Sending file to webhook ===")
-
-            print(f"Webhook URL: {webhook_url}")
-
-            print(f"File: {fileName}, Size: {size} bytes, Type: {mimeType}, TGID: {tgid}")
-
-            
-            
-            # Encode file to base64
-
-            import base64
-
-            print("Encoding file to base64...")
-
-            file_base64 = base64.b64encode(file_content).decode('utf-8')
-
-            print(f"File encoded to base64: {len(file_base64)} characters")
-
-            
-            
-            # Build JSON payload with base64 file and profile data for n8n
-
-            json_data = {
-
-                'fileName': fileName,
-
-                'mimeType': mimeType,
-
-                'size': size,
-
-                'tgid': tgid,
-
-                'file': file_base64,  # Base64 encoded file (image or PDF)
-
-                'profile': profile_data,  # User profile data from database
-
-                'clientTime': clientTime,  # Client's local time (ISO format with timezone)
-
-            }
-
-            # Add extracted text if PDF
-            if extracted_text:
-                json_data['extractedText'] = extracted_text
-                print(f"✅ Added extracted text to payload ({len(extracted_text)} characters)")
-
-            
-            
-            print(f"Building JSON payload for n8n...")
-
-            print(f"JSON keys: {list(json_data.keys())}")
-
-            print(f"JSON size: {len(str(json_data))} characters")
-
-            print(f"Base64 data length: {len(file_base64)} characters")
-            if extracted_text:
-                print(f"Extracted text length: {len(extracted_text)} characters")
-            print(f"Profile data keys: {list(profile_data.keys()) if profile_data else 'none'}")
-
-            print(f"First 100 chars of base64: {file_base64[:100]}...")
-
-            
-            
-            # Send to n8n webhook
-
-            # IMPORTANT: n8n webhooks should be configured to accept POST, not GET
-
-            # GET requests cannot send file data (URL length limit)
-
-            print(f"Sending POST request with JSON to n8n webhook: {webhook_url}")
-
-            payload_description = "fileName, mimeType, size, tgid, file (base64), profile"
-            if extracted_text:
-                payload_description += ", extractedText"
-            print(f"Payload contains: {payload_description}")
-
-            print(f"Total payload size: {len(str(json_data))} characters")
-            
-            
-            
-            try:
-
-                response = requests.post(
-
-                    webhook_url,
-
-                    json=json_data,
-
-                    headers={
-
-                        'Content-Type': 'application/json',
-
-                    },
-
-                    timeout=60,
-
-                    allow_redirects=True
-
-                )
-
-                
-                
-                print(f"✅ Request sent successfully! Response status: {response.status_code}")
-
-                print(f"Webhook response headers: {dict(response.headers)}")
-
-                response_text = response.text[:500] if response.text else 'No response'
-
-                print(f"Webhook response (first 500 chars): {response_text}")
-
-                
-                
-                # Log response status
-
-                if response.status_code == 404:
-
-                    print(f"⚠️ WARNING: Webhook returned 404. Check n8n webhook settings - it should accept POST requests.")
-
-                elif response.status_code >= 400:
-
-                    print(f"⚠️ WARNING: Webhook returned {response.status_code}. Check n8n webhook configuration.")
-
-                else:
-
-                    print(f"✅ SUCCESS: Webhook accepted request (status {response.status_code})")
-                    
-                    
-
-            except Exception as send_err:
-
-                print(f"❌ ERROR sending to webhook: {send_err}")
-
-                print(traceback.format_exc())
-
-                # Don't fail - we tried to send
-
-                response = type('obj', (object,), {'status_code': 0, 'text': str(send_err)})()
-
-        else:
-
-            print("⚠️ Webhook URL not configured - skipping webhook call, file saved to database only")
-
-            response = type('obj', (object,), {'status_code': None, 'text': 'Webhook not configured'})()
-
-        
-        
-
-        # Always return success from our side
-
-        result = {
-
-            "success": True,
-
-            "message": "File sent to n8n webhook" if webhook_url else "File saved to database",
-
-            "fileName": fileName,
-
-            "mime": mimeType,
-
-            "size": size,
-
-            "webhookStatus": response.status_code if response else None,
-
-            "webhookResponse": response.text[:1000] if response and response.text else None,
-
-            "analyses": analyses
-
-        }
-
-        print(f"✅ Returning success result")
-
-        print("=" * 50)
-
-        print("UPLOAD FILE ENDPOINT - SUCCESS")
-
-        print("=" * 50)
-
-        return result
-
-    except requests.exceptions.Timeout as e:
-
-        print(f"Webhook timeout error: {e}")
-
-        # Update database even on timeout (file was processed)
-
-        user = queries.notify_upload(db, tgid, fileName, mimeType, size)
-
-        # Return success but note the timeout
-
-        return {
-
-            "success": True,
-
-            "message": "File sent to webhook (timeout waiting for response)",
-
-            "fileName": fileName,
-
-            "mime": mimeType,
-
-            "size": size,
-
-            "webhookStatus": "timeout",
-
-            "webhookResponse": None,
-
-            "analyses": user.analyses or {}
-
-        }
-
-    except requests.exceptions.ConnectionError as e:
-
-        print(f"Webhook connection error: {e}")
-
-        # Update database
-
-        user = queries.notify_upload(db, tgid, fileName, mimeType, size)
-
-        # Return success but note the connection error
-
-        return {
-
-            "success": True,
-
-            "message": "File sent to webhook (connection error)",
-
-            "fileName": fileName,
-
-            "mime": mimeType,
-
-            "size": size,
-
-            "webhookStatus": "connection_error",
-
-            "webhookResponse": str(e),
-
-            "analyses": user.analyses or {}
-
-        }
-
-    except requests.exceptions.RequestException as e:
-
-        print(f"Webhook request error: {e}")
-
-        import traceback
-
-        print(traceback.format_exc())
-
-        # Update database
-
-        user = queries.notify_upload(db, tgid, fileName, mimeType, size)
-
-        # Return success but note the error
-
-        return {
-
-            "success": True,
-
-            "message": f"File sent to webhook (error: {str(e)})",
-
-            "fileName": fileName,
-
-            "mime": mimeType,
-
-            "size": size,
-
-            "webhookStatus": "error",
-
-            "webhookResponse": str(e),
-
-            "analyses": user.analyses or {}
-
-        }
-
-    except Exception as e:
-
-        print(f"Upload error: {e}")
-
-        import traceback
-
-        print(traceback.format_exc())
-
-        # Don't fail completely - still try to update database
-
-        try:
-
-            user = queries.notify_upload(db, tgid, fileName, mimeType, size)
-
-            analyses = user.analyses or {}
-
-        except:
-
-            analyses = {}
-        
-        
-
-        # Return error but with details
-
-        raise HTTPException(
-
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-
-            detail=f"Upload error: {str(e)}"
-
-        )
-
-
-
-
-        current_allanalize = user.allanalize or {}
-
-        all_analyses_list = []
-
-        
-
-        # Если allanalize - это список, используем его
-
-        if isinstance(current_allanalize, list):
-
-            all_analyses_list = current_allanalize.copy()
-
-        # Если allanalize - это объект с ключом "analyses" или "history"
-
-        elif isinstance(current_allanalize, dict):
-
-            if "analyses" in current_allanalize and isinstance(current_allanalize["analyses"], list):
-
-                all_analyses_list = current_allanalize["analyses"].copy()
-
-            elif "history" in current_allanalize and isinstance(current_allanalize["history"], list):
-
-                all_analyses_list = current_allanalize["history"].copy()
-
-            else:
-
-                # Если это просто объект, создаем новый список
-
-                all_analyses_list = []
-
-        
-
-        # ВАЖНО: Добавляем только new_report (отдельный отчет), а не весь объект analyses
-
-        # Проверяем, что не добавляем дубликаты
-
-        # Если последний элемент уже такой же (по fileName и createdAt), не добавляем
-
-        if all_analyses_list:
-
-            last_item = all_analyses_list[-1]
-
-            if isinstance(last_item, dict):
-
-                # Если последний элемент - это весь объект analyses (старый формат), удаляем его
-
-                if "reports" in last_item and "last_report" in last_item:
-
-                    # Это старый формат - удаляем его
-
-                    all_analyses_list.pop()
-
-                # Если это уже такой же отчет, не добавляем дубликат
-
-                elif last_item.get("fileName") == new_report["fileName"] and last_item.get("createdAt") == new_report["createdAt"]:
-
-                    # Дубликат - не добавляем
-
-                    pass
-
-                else:
-
-                    all_analyses_list.append(new_report)
-
-            else:
-
-                all_analyses_list.append(new_report)
-
-        else:
-
-            all_analyses_list.append(new_report)
-
-        
-
-        # Сохраняем обновленную историю в allanalize
-
-        user.allanalize = all_analyses_list
-
-        
-
-        # Помечаем JSONB колонки как измененные
-
-        from sqlalchemy.orm.attributes import flag_modified
-
-        flag_modified(user, "analyses")
-
-        flag_modified(user, "allanalize")
-
-        
-
-        user.updated_at = datetime.utcnow()
-
-        
-
-        db.flush()
-
-        db.commit()
-
-        db.refresh(user)
-
-        
-
-        # Детальное логирование после сохранения
-
-        print(f"✅ Report saved successfully for user {tgid_value}")
-
-        print(f"Analyses now contains only reports (no upload data)")
-
-        print(f"Reports count: {len(reports)}")
-
-        print(f"Last report exists: True")
-
-        print(f"✅ All analyses history saved to allanalize")
-
-        print(f"All analyses count: {len(all_analyses_list)}")
-
-        print(f"Allanalize type: {type(user.allanalize)}")
-
-        
-
-        # Проверяем, что данные правильно сохранились
-
-        print(f"[DEBUG] After commit and refresh:")
-
-        print(f"[DEBUG] user.analyses type: {type(user.analyses)}")
-
-        print(f"[DEBUG] user.analyses value: {user.analyses}")
-
-        if isinstance(user.analyses, dict):
-
-            print(f"[DEBUG] user.analyses keys: {list(user.analyses.keys())}")
-
-            if "last_report" in user.analyses:
-
-                print(f"[DEBUG] user.analyses['last_report']: {user.analyses['last_report']}")
-
-                if isinstance(user.analyses["last_report"], dict):
-
-                    print(f"[DEBUG] user.analyses['last_report'] keys: {list(user.analyses['last_report'].keys())}")
-
-                    if "text" in user.analyses["last_report"]:
-
-                        text_val = user.analyses["last_report"]["text"]
-
-                        print(f"[DEBUG] user.analyses['last_report']['text'] type: {type(text_val)}")
-
-                        print(f"[DEBUG] user.analyses['last_report']['text'] length: {len(text_val) if isinstance(text_val, str) else 'not a string'}")
-
-                        print(f"[DEBUG] user.analyses['last_report']['text'] first 200 chars: {text_val[:200] if isinstance(text_val, str) else 'not a string'}")
-
-                    else:
-
-                        print(f"[DEBUG] WARNING: 'text' key not found in last_report!")
-
-                else:
-
-                    print(f"[DEBUG] WARNING: last_report is not a dict, type: {type(user.analyses['last_report'])}")
-
-            else:
-
-                print(f"[DEBUG] WARNING: 'last_report' key not found in analyses!")
-
-        else:
-
-            print(f"[DEBUG] WARNING: user.analyses is not a dict, type: {type(user.analyses)}")
-
-        
-
-        return {
-
-            "success": True,
-
-            "message": "Report saved",
-
-            "tgid": tgid_value,
-
-            "reportLength": len(report_value),
-
-            "analysesKeys": list(user.analyses.keys())
-
-        }
-
-    except Exception as e:
-
-        print(f"❌ Error saving report: {e}")
-
-        print(traceback.format_exc())
-
-        raise HTTPException(
-
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-
-            detail=f"Error saving report: {str(e)}"
-
-        )
-
-
-
-
-
-# POST /api/upload-file - Upload file to webhook (proxy)
-
-@router.post("/upload-file")
-
-async def upload_file_to_webhook(
-
-    file: UploadFile = File(...),
-
-    fileName: str = Form(...),
-
-    mimeType: str = Form(...),
-
-    size: int = Form(...),
-
-    clientTime: Optional[str] = Form(None),
-
-    x_telegram_initdata: Optional[str] = Header(None),
-
-    db: Session = Depends(get_db)
-
-):
-
-    """Proxy file upload to webhook"""
-
-    print("=" * 50)
-
-    print("UPLOAD FILE ENDPOINT CALLED - FUNCTION STARTED")
-
-    print("=" * 50)
+        )
 
     
 
-    # Get tgid from header (optional for now to debug 404)
-
-    tgid = "unknown"
-
-    if x_telegram_initdata:
-
-        try:
-
-            # Call the function directly with the header value
-
-            tgid = get_tgid_from_header(x_telegram_initdata)
-
-            print(f"TGID extracted from header: {tgid}")
-
-        except Exception as auth_err:
-
-            print(f"Auth error (continuing anyway): {auth_err}")
-
-            print(traceback.format_exc())
-
-            # Use a default tgid if auth fails
-
-            tgid = "auth_failed"
-
-    else:
-
-        print("WARNING: No x-telegram-initdata header provided")
-
-    print(f"Received file: {fileName}")
+    # Размер - фактический, а не заявленный клиентом
 
-    print(f"File size: {size}")
+    if file.size is not None and file.size != size:
 
-    print(f"File type: {mimeType}")
+        print(f"⚠️ Declared size {size} differs from actual {file.size} - using actual size")
 
-    print(f"TGID: {tgid}")
+        size = file.size
 
     
-
+    
     # Get user profile data from database
 
     profile_data = {}
@@ -1947,7 +1108,7 @@ async def upload_file_to_webhook(
 
         try:
 
-            user = queries.get_or_create_user(db, tgid)
+            user = await queries.get_user_fields(db, tgid, "profile")
 
             profile_data = user.profile or {}
 
@@ -1962,7 +1123,7 @@ async def upload_file_to_webhook(
     else:
 
         print("Skipping profile load - invalid tgid")
-
+    
     
 
     webhook_url = settings.ANALYSIS_WEBHOOK_URL
@@ -1970,9 +1131,12 @@ async def upload_file_to_webhook(
     print(f"Webhook URL from settings: {webhook_url}")
 
     
-
+    
     # If webhook is not configured, we'll just save to database and return success
     
+    # Нормализованное фото - отдельный открытый файл (закрывается в finally)
+
+    normalized_stream = None
 
     try:
 
@@ -1983,7 +1147,7 @@ async def upload_file_to_webhook(
 
             print("Updating database...")
 
-            user = queries.notify_upload(db, tgid, fileName, mimeType, size)
+            user = await queries.notify_upload(db, tgid, fileName, mimeType, size)
 
             print("Database updated successfully")
 
@@ -1999,27 +1163,104 @@ async def upload_file_to_webhook(
         
         if webhook_url:
 
-            print("Reading file content...")
-
-            # Read file content
-
-            file_content = await file.read()
-
-            print(f"File content read: {len(file_content)} bytes")
-
+            # SHA-256 содержимого считается при чтении файла
+            # (PDF и крупные фото за тот же проход копируются во временный файл для пулов обработки)
+            digest = hashlib.sha256()
+            pdf_path = None
+            image_path = None
+            if mimeType == "application/pdf":
+                pdf_path = await spool_upload_to_temp_file(file, suffix=".pdf", digest=digest)
+            elif mimeType.startswith("image/") and size >= settings.IMAGE_NORMALIZE_MIN_BYTES and image_pool.enabled:
+                image_path = await spool_upload_to_temp_file(file, digest=digest)
+            else:
+                await hash_upload(file, digest)
+            file_hash = digest.hexdigest()
+            print(f"File SHA-256: {file_hash}")
             
+            # Повторная загрузка того же файла: не запускаем обработку в n8n снова
+            upload_claimed = False
+            if tgid != "unknown" and tgid != "auth_failed":
+                try:
+                    upload_claimed = await queries.claim_upload(
+                        db, tgid, file_hash, fileName, mimeType, size, clientTime, force=bool(force)
+                    )
+                    if not upload_claimed:
+                        prior_upload, prior_report = await queries.get_upload(db, tgid, file_hash)
+                        if prior_upload is not None:
+                            for temp_path in (pdf_path, image_path):
+                                if temp_path:
+                                    os.unlink(temp_path)
+                            print(f"♻️ Duplicate upload ({prior_upload.status}), report: {prior_report.id if prior_report else None}")
+                            return {
+                                "success": True,
+                                "duplicate": True,
+                                "status": "ready" if prior_report else "processing",
+                                "message": "File was already uploaded" + ("" if prior_report else " and is being processed"),
+                                "fileName": fileName,
+                                "mime": mimeType,
+                                "size": size,
+                                "fileHash": file_hash,
+                                "report": prior_report.to_dict() if prior_report else None,
+                                "webhookStatus": "duplicate",
+                                "webhookResponse": None,
+                                "analyses": analyses
+                            }
+                except Exception as dedup_err:
+                    print(f"⚠️ Upload deduplication skipped (non-critical): {dedup_err}")
             
             # Extract text from PDF if it's a PDF file
+            # (в пуле процессов: не блокирует event loop, есть лимиты времени, страниц и очереди)
             extracted_text = None
-            if mimeType == "application/pdf":
+            if pdf_path:
                 print("📄 PDF file detected - extracting text...")
-                extracted_text = extract_text_from_pdf(file_content)
+                try:
+                    extraction = await pdf_pool.extract(pdf_path, raw_request.is_disconnected, content_hash=file_hash)
+                    extracted_text = extraction.text
+                    print(f"📊 PDF extraction: {extraction.summary()}")
+                except PdfExtractionCancelled:
+                    print("⚠️ Client disconnected during PDF extraction - upload cancelled")
+                    if upload_claimed:
+                        await queries.finish_upload(db, tgid, file_hash, "failed")
+                    return {
+                        "success": False,
+                        "message": "Upload cancelled: client disconnected",
+                        "fileName": fileName
+                    }
+                except (PdfQueueFull, PdfExtractionTimeout) as pdf_err:
+                    print(f"⚠️ PDF extraction skipped: {pdf_err}")
+                finally:
+                    if os.path.exists(pdf_path):
+                        os.unlink(pdf_path)
                 if extracted_text:
                     print(f"✅ Extracted {len(extracted_text)} characters from PDF")
                 else:
                     print("⚠️ Warning: Could not extract text from PDF, will send file as-is")
             
-
+            # Фото с телефона (12-48 Мп): поворот по EXIF, уменьшение до IMAGE_MAX_SIDE и JPEG
+            # в пуле процессов - тело webhook в разы меньше, n8n быстрее распознает снимок
+            normalized_image = None
+            if image_path:
+                try:
+                    normalized_image = await image_pool.normalize(image_path)
+                except Exception as image_err:
+                    # Очередь переполнена, таймаут - отправляем исходный файл
+                    print(f"⚠️ Image normalization skipped: {image_err}")
+                finally:
+                    os.unlink(image_path)
+                if normalized_image:
+                    print(f"🖼️ Image normalized: {normalized_image.summary()}")
+            
+            
+            # Файл не читается в память целиком: UploadFile уже лежит во временном
+            # файле (SpooledTemporaryFile), из него body кодируется по частям
+            if normalized_image:
+                # Путь удаляется сразу, открытый файл остается читаемым
+                upload_stream = normalized_stream = open(normalized_image.path, "rb")
+                os.unlink(normalized_image.path)
+            else:
+                upload_stream = file.file
+                upload_stream.seek(0)
+            
             print(f"=== Sending file to webhook ===")
 
             print(f"Webhook URL: {webhook_url}")
@@ -2027,22 +1268,11 @@ async def upload_file_to_webhook(
             print(f"File: {fileName}, Size: {size} bytes, Type: {mimeType}, TGID: {tgid}")
 
             
-
-            # Encode file to base64
-
-            import base64
-
-            print("Encoding file to base64...")
-
-            file_base64 = base64.b64encode(file_content).decode('utf-8')
-
-            print(f"File encoded to base64: {len(file_base64)} characters")
-
             
+            # Build payload with the file and profile data for n8n
+            # (ANALYSIS_WEBHOOK_TRANSPORT: "json" - 'file' как base64 в JSON, "multipart" - бинарной частью)
 
-            # Build JSON payload with base64 file and profile data for n8n
-
-            json_data = {
+            json_fields = {
 
                 'fileName': fileName,
 
@@ -2052,33 +1282,119 @@ async def upload_file_to_webhook(
 
                 'tgid': tgid,
 
-                'file': file_base64,  # Base64 encoded file (image or PDF)
-
                 'profile': profile_data,  # User profile data from database
 
                 'clientTime': clientTime,  # Client's local time (ISO format with timezone)
 
+                'fileHash': file_hash,  # SHA-256 of the file; n8n may return it with the report
+
             }
 
             # Add extracted text if PDF
+
             if extracted_text:
-                json_data['extractedText'] = extracted_text
+
+                json_fields['extractedText'] = extracted_text
+
                 print(f"✅ Added extracted text to payload ({len(extracted_text)} characters)")
 
+            # Нормализованное фото уходит как JPEG; исходные тип и размер - для справки
+
+            if normalized_image:
+
+                json_fields['mimeType'] = normalized_image.mime_type
+
+                json_fields['size'] = normalized_image.size
+
+                json_fields['originalMimeType'] = mimeType
+
+                json_fields['originalSize'] = size
+
+            
+
+            # Очередь webhook_jobs: ответ 202 сразу, отправку с повторами делает воркер
+
+            if settings.WEBHOOK_QUEUE_ENABLED:
+
+                try:
+
+                    job_id = await jobs.enqueue_webhook_job(
+
+                        db,
+
+                        "analysis",
+
+                        json_fields,
+
+                        tgid=tgid,
+
+                        fileobj=upload_stream,
+
+                        upload_sha256=file_hash if upload_claimed else None
+
+                    )
+
+                    webhook_dispatcher.wake()
+
+                    print(f"📬 Upload queued for n8n webhook (job {job_id})")
+
+                    return JSONResponse(
+
+                        status_code=status.HTTP_202_ACCEPTED,
+
+                        content={
+
+                            "success": True,
+
+                            "message": "File queued for n8n webhook",
+
+                            "fileName": fileName,
+
+                            "mime": mimeType,
+
+                            "size": size,
+
+                            "fileHash": file_hash,
+
+                            "jobId": job_id,
+
+                            "webhookStatus": "queued",
+
+                            "webhookResponse": None,
+
+                            "analyses": analyses
+
+                        }
+
+                    )
+
+                except Exception as queue_err:
+
+                    # Таблицы нет / БД недоступна - отправляем прямо из запроса, как раньше
+
+                    await db.rollback()
+
+                    print(f"⚠️ Could not queue upload, sending directly: {queue_err}")
+
+            
+
+            body = build_upload_body(json_fields, 'file', upload_stream, settings.ANALYSIS_WEBHOOK_TRANSPORT)
+
             
 
-            print(f"Building JSON payload for n8n...")
+            print(f"Building {settings.ANALYSIS_WEBHOOK_TRANSPORT} payload for n8n...")
 
-            print(f"JSON keys: {list(json_data.keys())}")
+            print(f"Fields: {list(json_fields.keys()) + ['file']}")
 
-            print(f"JSON size: {len(str(json_data))} characters")
+            print(f"File size: {body.file_size} bytes, body size: {len(body)} bytes")
 
-            print(f"Base64 data length: {len(file_base64)} characters")
             if extracted_text:
+
                 print(f"Extracted text length: {len(extracted_text)} characters")
+
             print(f"Profile data keys: {list(profile_data.keys()) if profile_data else 'none'}")
 
-            print(f"First 100 chars of base64: {file_base64[:100]}...")
+            
 
             
 
@@ -2088,39 +1404,48 @@ async def upload_file_to_webhook(
 
             # GET requests cannot send file data (URL length limit)
 
-            print(f"Sending POST request with JSON to n8n webhook: {webhook_url}")
+            print(f"Sending POST request ({body.content_type.split(';')[0]}) to n8n webhook: {webhook_url}")
+
+            payload_description = f"fileName, mimeType, size, tgid, file ({'binary' if settings.ANALYSIS_WEBHOOK_TRANSPORT == 'multipart' else 'base64'}), profile"
 
-            payload_description = "fileName, mimeType, size, tgid, file (base64), profile"
             if extracted_text:
+
                 payload_description += ", extractedText"
+
             print(f"Payload contains: {payload_description}")
 
-            print(f"Total payload size: {len(str(json_data))} characters")
+            print(f"Total payload size: {len(body)} bytes (streamed)")
+
+            
+
+            
 
             
 
             try:
 
-                response = requests.post(
+                # Тело отдается по частям (Content-Length известен заранее)
+
+                response = await post_webhook(
+
+                    "analysis",
 
                     webhook_url,
 
-                    json=json_data,
+                    content=body.aiter_chunks(),
 
                     headers={
 
-                        'Content-Type': 'application/json',
+                        'Content-Type': body.content_type,
 
-                    },
+                        'Content-Length': str(len(body)),
 
-                    timeout=60,
-
-                    allow_redirects=True
+                    }
 
                 )
 
                 
-
+                
                 print(f"✅ Request sent successfully! Response status: {response.status_code}")
 
                 print(f"Webhook response headers: {dict(response.headers)}")
@@ -2130,7 +1455,7 @@ async def upload_file_to_webhook(
                 print(f"Webhook response (first 500 chars): {response_text}")
 
                 
-
+                
                 # Log response status
 
                 if response.status_code == 404:
@@ -2144,7 +1469,7 @@ async def upload_file_to_webhook(
                 else:
 
                     print(f"✅ SUCCESS: Webhook accepted request (status {response.status_code})")
-
+                    
                     
 
             except Exception as send_err:
@@ -2156,6 +1481,14 @@ async def upload_file_to_webhook(
                 # Don't fail - we tried to send
 
                 response = type('obj', (object,), {'status_code': 0, 'text': str(send_err)})()
+            
+            # Неудачная отправка не блокирует повторную загрузку того же файла
+            if upload_claimed:
+                try:
+                    upload_status = "sent" if response.status_code and response.status_code < 400 else "failed"
+                    await queries.finish_upload(db, tgid, file_hash, upload_status)
+                except Exception as dedup_err:
+                    print(f"⚠️ Could not update upload status: {dedup_err}")
 
         else:
 
@@ -2164,6 +1497,7 @@ async def upload_file_to_webhook(
             response = type('obj', (object,), {'status_code': None, 'text': 'Webhook not configured'})()
 
         
+        
 
         # Always return success from our side
 
@@ -2197,13 +1531,13 @@ async def upload_file_to_webhook(
 
         return result
 
-    except requests.exceptions.Timeout as e:
+    except httpx.TimeoutException as e:
 
         print(f"Webhook timeout error: {e}")
 
         # Update database even on timeout (file was processed)
 
-        user = queries.notify_upload(db, tgid, fileName, mimeType, size)
+        user = await queries.notify_upload(db, tgid, fileName, mimeType, size)
 
         # Return success but note the timeout
 
@@ -2227,13 +1561,13 @@ async def upload_file_to_webhook(
 
         }
 
-    except requests.exceptions.ConnectionError as e:
+    except httpx.TransportError as e:
 
         print(f"Webhook connection error: {e}")
 
         # Update database
 
-        user = queries.notify_upload(db, tgid, fileName, mimeType, size)
+        user = await queries.notify_upload(db, tgid, fileName, mimeType, size)
 
         # Return success but note the connection error
 
@@ -2257,7 +1591,7 @@ async def upload_file_to_webhook(
 
         }
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
 
         print(f"Webhook request error: {e}")
 
@@ -2267,7 +1601,7 @@ async def upload_file_to_webhook(
 
         # Update database
 
-        user = queries.notify_upload(db, tgid, fileName, mimeType, size)
+        user = await queries.notify_upload(db, tgid, fileName, mimeType, size)
 
         # Return success but note the error
 
@@ -2303,14 +1637,14 @@ async def upload_file_to_webhook(
 
         try:
 
-            user = queries.notify_upload(db, tgid, fileName, mimeType, size)
+            user = await queries.notify_upload(db, tgid, fileName, mimeType, size)
 
             analyses = user.analyses or {}
 
         except:
 
             analyses = {}
-
+        
         
 
         # Return error but with details
@@ -2323,6 +1657,8 @@ async def upload_file_to_webhook(
 
         )
 
+    finally:
 
+        if normalized_stream is not None:
 
-
+            normalized_stream.close()
@@ -1,5 +1,16 @@
 from fastapi import APIRouter
 
+from app import database
+from app.config import settings
+from app.db import jobs
+from app.db.pool import pool_status
+from app.middleware.auth import init_data_cache
+from app.utils.http_client import http_client_status
+from app.utils.image_pool import image_pool
+from app.utils.pdf_pool import pdf_pool
+from app.utils.text_cache import extracted_text_cache
+from app.worker import webhook_dispatcher
+
 router = APIRouter()
 
 
@@ -7,3 +18,35 @@ router = APIRouter()
 async def health():
     return {"status": "ok"}
 
+
+@router.get("/health/metrics")
+async def health_metrics():
+    """Runtime counters for capacity tuning (pool checkout wait time, etc.)"""
+    metrics = {}
+
+    # Движки создаются лениво - показываем только уже инициализированные
+    if database._async_engine is not None:
+        metrics["db_pool"] = pool_status(database._async_engine)
+    if database._engine is not None:
+        metrics["db_pool_sync"] = pool_status(database._engine)
+    if database._replica_engine is not None:
+        metrics["db_pool_replica"] = pool_status(database._replica_engine)
+
+    metrics["auth_cache"] = init_data_cache.snapshot()
+    metrics["http"] = http_client_status()
+    metrics["pdf_pool"] = pdf_pool.snapshot()
+    metrics["pdf_text_cache"] = extracted_text_cache.snapshot()
+    metrics["image_pool"] = image_pool.snapshot()
+
+    if settings.WEBHOOK_QUEUE_ENABLED:
+        # Очередь общая для всех воркеров; dead - не доставленные после всех попыток
+        webhook_queue = {"dispatcher": webhook_dispatcher.snapshot()}
+        try:
+            async with database.get_async_session_local()() as db:
+                webhook_queue["jobs"] = await jobs.count_webhook_jobs(db)
+        except Exception as e:
+            webhook_queue["jobs"] = None
+            webhook_queue["error"] = str(e)
+        metrics["webhook_queue"] = webhook_queue
+
+    return metrics
@@ -0,0 +1,80 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class InitDataCache:
+    """LRU-кеш проверенных initData -> tgid с TTL
+
+    Mini App присылает одну и ту же строку initData на каждый запрос сессии,
+    поэтому повторная проверка подписи, parse_qs и разбор JSON пользователя
+    не нужны. Ключ - SHA-256 всей строки initData (фиксированный размер,
+    не зависит от длины заголовка); в кеш попадают только строки с верной подписью.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(init_data: str) -> bytes:
+        return hashlib.sha256(init_data.encode()).digest()
+
+    def get(self, init_data: str) -> Optional[str]:
+        """Cached tgid for init_data, None if missing or expired"""
+        if self.max_size <= 0:
+            return None
+        key = self._key(init_data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                tgid, expires_at = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return tgid
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, init_data: str, tgid: str, auth_date: Optional[int] = None, max_age: int = 0) -> None:
+        """Remember verified tgid
+
+        Запись живет не дольше ttl и не дольше окна действия initData
+        (auth_date + max_age), если оно задано.
+        """
+        if self.max_size <= 0:
+            return
+        lifetime = self.ttl
+        if max_age and auth_date:
+            lifetime = min(lifetime, auth_date + max_age - time.time())
+        if lifetime <= 0:
+            return
+
+        key = self._key(init_data)
+        with self._lock:
+            self._entries[key] = (tgid, time.monotonic() + lifetime)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,70 @@
+import hmac
+import hashlib
+import json
+from functools import lru_cache
+from urllib.parse import parse_qsl
+from typing import Optional
+from app.telegram.parse import TelegramUser
+
+
+class InitData:
+    """Verified initData: Telegram user and auth_date (unix time)"""
+
+    __slots__ = ("user", "auth_date")
+
+    def __init__(self, user: Optional[TelegramUser], auth_date: Optional[int]):
+        self.user = user
+        self.auth_date = auth_date
+
+
+@lru_cache(maxsize=4)
+def _secret_key(bot_token: str) -> bytes:
+    """HMAC_SHA256(key="WebAppData", data=BOT_TOKEN) - меняется только вместе с токеном"""
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+def decode_init_data(init_data: str, bot_token: str) -> Optional[InitData]:
+    """
+    Verify and parse Telegram WebApp initData in one pass
+
+    Query string разбирается один раз и используется и для data_check_string,
+    и для полей user/auth_date (раньше verify_init_data и parse_init_data
+    делали parse_qs каждый сам).
+
+    Returns:
+        InitData, or None if the hash is missing or the signature doesn't match.
+        InitData.user is None if the user field is missing or not valid JSON.
+    """
+    params = {}
+    for key, value in parse_qsl(init_data, keep_blank_values=True):
+        # Как parse_qs()[0]: при повторе ключа берется первое значение
+        params.setdefault(key, value)
+
+    hash_value = params.pop("hash", None)
+    if not hash_value:
+        return None
+
+    # Build data_check_string: sort k=v pairs and join with \n
+    data_check_string = "\n".join(f"{key}={params[key]}" for key in sorted(params))
+    calculated_hash = hmac.new(
+        _secret_key(bot_token),
+        data_check_string.encode(),
+        hashlib.sha256
+    ).hexdigest()
+
+    if not hmac.compare_digest(calculated_hash.encode(), hash_value.lower().encode()):
+        return None
+
+    user = None
+    if params.get("user"):
+        try:
+            user = TelegramUser(json.loads(params["user"]))
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"Error parsing user field: {e}")
+
+    try:
+        auth_date = int(params["auth_date"])
+    except (KeyError, ValueError):
+        auth_date = None
+
+    return InitData(user, auth_date)
@@ -4,6 +4,8 @@ from typing import Dict, Optional
 
 
 class TelegramUser:
+    __slots__ = ("id", "first_name", "last_name", "username", "language_code", "is_premium", "photo_url")
+    
     def __init__(self, data: dict):
         self.id = data.get("id")
         self.first_name = data.get("first_name")
@@ -0,0 +1,46 @@
+import base64
+import hmac
+import hashlib
+import time
+from functools import lru_cache
+from typing import Optional
+
+# Первые 16 байт HMAC-SHA256 - достаточно для короткоживущего токена
+_MAC_BYTES = 16
+
+
+@lru_cache(maxsize=4)
+def derive_session_secret(secret: str) -> bytes:
+    """Key for session tokens (SESSION_SECRET or BOT_TOKEN)"""
+    return hmac.new(b"SessionToken", secret.encode(), hashlib.sha256).digest()
+
+
+def _mac(key: bytes, payload: str) -> str:
+    digest = hmac.new(key, payload.encode(), hashlib.sha256).digest()[:_MAC_BYTES]
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def issue_session_token(tgid: str, expires_at: int, key: bytes) -> str:
+    """
+    Signed session token: "<tgid>.<expires_at>.<mac>" (~45 bytes)
+
+    Токен не хранится на сервере: проверка - один HMAC, поэтому он
+    принимается любым воркером/инстансом с тем же секретом.
+    """
+    payload = f"{tgid}.{expires_at}"
+    return f"{payload}.{_mac(key, payload)}"
+
+
+def verify_session_token(token: str, key: bytes) -> Optional[str]:
+    """Return tgid from a valid, not expired token (None otherwise)"""
+    try:
+        tgid, expires_at, mac = token.split(".")
+        expires = int(expires_at)
+    except ValueError:
+        return None
+
+    if not hmac.compare_digest(_mac(key, f"{tgid}.{expires_at}").encode(), mac.encode()):
+        return None
+    if expires <= time.time():
+        return None
+    return tgid
@@ -0,0 +1,115 @@
+import asyncio
+import importlib.util
+import zlib
+from typing import AsyncIterator, Optional
+
+ENCODINGS = ("gzip", "zstd")
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+_warned = set()
+
+
+class UnsupportedEncoding(ValueError):
+    """Content-Encoding is unknown or its library is not installed"""
+
+
+class DecompressedTooLarge(ValueError):
+    """Decompressed body exceeds the allowed size"""
+
+
+def zstd_available() -> bool:
+    """zstd - только если установлен пакет zstandard"""
+    return importlib.util.find_spec("zstandard") is not None
+
+
+def resolve_encoding(name: Optional[str]) -> Optional[str]:
+    """
+    Content-Encoding for outbound bodies from a setting value
+
+    "" / "none" - без сжатия. zstd без пакета zstandard заменяется на gzip
+    (один раз пишется предупреждение).
+    """
+    name = (name or "").strip().lower()
+    if name in ("", "none", "identity"):
+        return None
+    if name not in ENCODINGS:
+        raise ValueError(f"Unknown compression {name!r}, expected one of: none, {', '.join(ENCODINGS)}")
+    if name == "zstd" and not zstd_available():
+        if name not in _warned:
+            _warned.add(name)
+            print("⚠️ zstd compression requested but zstandard is not installed - using gzip")
+        return "gzip"
+    return name
+
+
+def _compressobj(encoding: str):
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    # wbits 31 - формат gzip (заголовок и CRC), а не голый zlib
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    compressor = _compressobj(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+async def compress_stream(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    """Compress an async byte stream chunk by chunk (сжатие - в потоке, не в event loop)"""
+    compressor = _compressobj(encoding)
+    async for chunk in chunks:
+        compressed = await asyncio.to_thread(compressor.compress, chunk)
+        if compressed:
+            yield compressed
+    tail = compressor.flush()
+    if tail:
+        yield tail
+
+
+def decompress_bytes(data: bytes, encoding: str, max_size: int) -> bytes:
+    """
+    Decode a request body by its Content-Encoding (gzip, deflate, zstd)
+
+    Raises:
+        UnsupportedEncoding, DecompressedTooLarge (защита от "zip-бомбы": распакованное
+        тело больше max_size байт), ValueError для поврежденных данных
+    """
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return data
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        # wbits 47 - автоопределение gzip/zlib; "deflate" иногда присылают без zlib-заголовка
+        wbits = zlib.MAX_WBITS | 32
+        if encoding == "deflate" and data[:1] and (data[0] & 0x0F) != 8:
+            wbits = -zlib.MAX_WBITS
+        decompressor = zlib.decompressobj(wbits)
+        try:
+            result = decompressor.decompress(data, max_size + 1)
+        except zlib.error as e:
+            raise ValueError(f"Invalid {encoding} body: {e}") from e
+        if len(result) > max_size or decompressor.unconsumed_tail:
+            raise DecompressedTooLarge(f"Decompressed body exceeds {max_size} bytes")
+        return result
+    if encoding == "zstd":
+        if not zstd_available():
+            raise UnsupportedEncoding("zstd is not supported (zstandard is not installed)")
+        import zstandard
+        try:
+            parts = []
+            total = 0
+            with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+                while total <= max_size:
+                    chunk = reader.read(max_size + 1 - total)
+                    if not chunk:
+                        break
+                    parts.append(chunk)
+                    total += len(chunk)
+            result = b"".join(parts)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Invalid zstd body: {e}") from e
+        if len(result) > max_size:
+            raise DecompressedTooLarge(f"Decompressed body exceeds {max_size} bytes")
+        return result
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}")
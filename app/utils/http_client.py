@@ -0,0 +1,193 @@
+import asyncio
+import importlib.util
+from json import dumps as json_dumps
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from app.config import settings
+from app.utils.compression import compress_bytes, compress_stream, resolve_encoding
+
+
+class WebhookDestination:
+    """Лимиты одного получателя (n8n webhook): таймаут, число одновременных запросов, сжатие тела"""
+
+    def __init__(self, name: str, timeout: float, max_concurrency: int, compression: Optional[str] = None):
+        self.name = name
+        self.timeout = httpx.Timeout(timeout, connect=settings.HTTP_CONNECT_TIMEOUT, pool=settings.HTTP_POOL_TIMEOUT)
+        self.max_concurrency = max_concurrency
+        self.compression = resolve_encoding(compression)
+        self.in_flight = 0
+        self.compressed_requests = 0
+        self.bytes_before_compression = 0
+        self.bytes_after_compression = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+
+    async def __aenter__(self):
+        if self._semaphore is not None:
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), settings.HTTP_POOL_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise httpx.PoolTimeout(f"Too many concurrent requests to {self.name} webhook")
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    async def count_compressed(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            self.bytes_after_compression += len(chunk)
+            yield chunk
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "compression": self.compression,
+            "compressed_requests": self.compressed_requests,
+            "bytes_before_compression": self.bytes_before_compression,
+            "bytes_after_compression": self.bytes_after_compression,
+        }
+
+
+DESTINATIONS = {
+    "analysis": WebhookDestination(
+        "analysis",
+        settings.ANALYSIS_WEBHOOK_TIMEOUT,
+        settings.ANALYSIS_WEBHOOK_MAX_CONCURRENCY,
+        settings.ANALYSIS_WEBHOOK_COMPRESSION,
+    ),
+    "recommendations": WebhookDestination(
+        "recommendations",
+        settings.RECOMMENDATIONS_WEBHOOK_TIMEOUT,
+        settings.RECOMMENDATIONS_WEBHOOK_MAX_CONCURRENCY,
+        settings.RECOMMENDATIONS_WEBHOOK_COMPRESSION,
+    ),
+}
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def http2_available() -> bool:
+    """HTTP/2 включается, только если установлен пакет h2 (httpx[http2])"""
+    return settings.HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared async HTTP client (keep-alive pool) for all outbound webhook calls
+
+    Создается в lifespan приложения (app/main.py); если код выполняется вне
+    приложения (скрипты, воркер) - создается лениво при первом обращении.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=http2_available(),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(settings.ANALYSIS_WEBHOOK_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+            follow_redirects=True,
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def _compress_body(dest: WebhookDestination, json: Any, content: Any, headers: httpx.Headers):
+    """Body and headers with the destination's Content-Encoding (если тело не меньше порога)"""
+    encoding = dest.compression
+    min_bytes = settings.WEBHOOK_COMPRESSION_MIN_BYTES
+    if encoding is None:
+        return json, content
+
+    if json is not None:
+        # Как сериализует сам httpx
+        content = json_dumps(json, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+        json = None
+        headers.setdefault("Content-Type", "application/json")
+
+    if isinstance(content, (bytes, bytearray)):
+        if len(content) < min_bytes:
+            return json, content
+        compressed = await asyncio.to_thread(compress_bytes, bytes(content), encoding)
+        dest.bytes_before_compression += len(content)
+        dest.bytes_after_compression += len(compressed)
+        content = compressed
+    elif content is not None:
+        # Поток (тело загрузки): размер - из Content-Length, сжатый поток уходит chunked
+        size = int(headers.get("Content-Length") or 0)
+        if size < min_bytes:
+            return json, content
+        del headers["Content-Length"]
+        dest.bytes_before_compression += size
+        content = dest.count_compressed(compress_stream(content, encoding))
+    else:
+        return json, content
+
+    dest.compressed_requests += 1
+    headers["Content-Encoding"] = encoding
+    return json, content
+
+
+async def post_webhook(
+    destination: str,
+    url: str,
+    *,
+    json: Any = None,
+    content: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None,
+) -> httpx.Response:
+    """
+    POST to a webhook through the shared client with the destination's limits
+
+    Args:
+        destination: Key in DESTINATIONS ("analysis", "recommendations")
+        url: Webhook URL
+        json: JSON payload
+        content: Raw body (bytes or async iterator of bytes; для сжатия потока
+            нужен заголовок Content-Length)
+        headers: Extra headers
+        timeout: Override of the destination timeout, seconds
+
+    Тело сжимается (Content-Encoding), если для получателя задано
+    *_WEBHOOK_COMPRESSION и тело не меньше WEBHOOK_COMPRESSION_MIN_BYTES.
+
+    Raises:
+        httpx.HTTPError on timeouts and connection errors
+    """
+    dest = DESTINATIONS[destination]
+    request_timeout = dest.timeout
+    if timeout is not None:
+        request_timeout = httpx.Timeout(timeout, connect=settings.HTTP_CONNECT_TIMEOUT, pool=settings.HTTP_POOL_TIMEOUT)
+
+    headers = httpx.Headers(headers)
+    json, content = await _compress_body(dest, json, content, headers)
+
+    async with dest:
+        return await get_http_client().post(
+            url,
+            json=json,
+            content=content,
+            headers=headers,
+            timeout=request_timeout,
+        )
+
+
+def http_client_status() -> Dict[str, Any]:
+    """Outbound HTTP state for /health/metrics"""
+    return {
+        "http2": http2_available(),
+        "destinations": {name: dest.snapshot() for name, dest in DESTINATIONS.items()},
+    }
@@ -0,0 +1,79 @@
+import importlib.util
+import os
+from typing import Optional, Tuple
+
+NORMALIZED_MIME_TYPE = "image/jpeg"
+
+# Тег EXIF Orientation: 1 - снимок уже в правильной ориентации
+EXIF_ORIENTATION = 0x0112
+
+_heif_registered = None
+
+
+def pillow_available() -> bool:
+    """Нормализация фото - только если установлен Pillow"""
+    return importlib.util.find_spec("PIL") is not None
+
+
+def _register_heif_opener() -> bool:
+    # HEIC/HEIF (фото с iPhone) Pillow открывает только с пакетом pillow-heif
+    global _heif_registered
+    if _heif_registered is None:
+        try:
+            from pillow_heif import register_heif_opener
+        except ImportError:
+            _heif_registered = False
+        else:
+            register_heif_opener()
+            _heif_registered = True
+    return _heif_registered
+
+
+def normalize_image(
+    src_path: str,
+    dst_path: str,
+    max_side: int,
+    quality: int
+) -> Optional[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """
+    Decode a photo, apply its EXIF orientation, downscale and re-encode it as JPEG
+
+    Длинная сторона уменьшается до max_side (0 - без уменьшения), прозрачность
+    заменяется белым фоном, метаданные (EXIF, в том числе геопозиция) не сохраняются.
+    Результат пишется в dst_path.
+
+    Returns:
+        ((ширина, высота) исходника, (ширина, высота) результата) или None, если
+        снимок не нужно ни поворачивать, ни уменьшать, а JPEG вышел не меньше
+        исходного файла - тогда отправлять стоит исходник
+
+    Raises:
+        PIL.UnidentifiedImageError и другие ошибки Pillow для битых/неподдерживаемых файлов
+    """
+    from PIL import Image, ImageOps
+
+    _register_heif_opener()
+    with Image.open(src_path) as image:
+        original_size = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        if max_side and image.format == "JPEG":
+            # JPEG декодируется сразу в 1/2-1/8 размера (не меньше max_side):
+            # для 48 Мп снимка в разы меньше памяти и времени
+            image.draft("RGB", (max_side, max_side))
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        if max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        image.save(dst_path, "JPEG", quality=quality, optimize=True)
+
+    resized = image.size != original_size
+    if not resized and orientation == 1 and os.path.getsize(dst_path) >= os.path.getsize(src_path):
+        return None
+    return original_size, image.size
@@ -0,0 +1,183 @@
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+from app.utils.image_normalizer import NORMALIZED_MIME_TYPE, normalize_image, pillow_available
+from app.utils.process_pool import ProcessWorkerPool, WorkerCrashed, WorkerTimeout
+
+
+class ImageQueueFull(Exception):
+    """Too many images are already waiting for normalization"""
+
+
+class ImageNormalizationTimeout(Exception):
+    """Image exceeded IMAGE_TIMEOUT_SECONDS"""
+
+
+class ImageNormalizationResult:
+    """Normalized copy of an uploaded photo (временный файл - удалить вызывающему коду)"""
+
+    __slots__ = ("path", "mime_type", "size", "original_size", "dimensions", "original_dimensions", "elapsed_ms")
+
+    def __init__(
+        self,
+        path: str,
+        size: int,
+        original_size: int,
+        dimensions: Tuple[int, int],
+        original_dimensions: Tuple[int, int],
+        elapsed_ms: float
+    ):
+        self.path = path
+        self.mime_type = NORMALIZED_MIME_TYPE
+        self.size = size
+        self.original_size = original_size
+        self.dimensions = dimensions
+        self.original_dimensions = original_dimensions
+        self.elapsed_ms = elapsed_ms
+
+    def summary(self) -> str:
+        (width, height), (orig_width, orig_height) = self.dimensions, self.original_dimensions
+        return (
+            f"{orig_width}x{orig_height} -> {width}x{height}, "
+            f"{self.original_size} -> {self.size} bytes, {self.elapsed_ms:.0f} ms"
+        )
+
+
+def _normalize_in_worker(
+    src_path: str,
+    dst_path: str,
+    max_side: int,
+    quality: int
+) -> Tuple[Optional[Tuple[Tuple[int, int], Tuple[int, int]]], float]:
+    """Runs in a pool process: normalize_image (по soft timeout пул вернет TimeoutError)
+
+    Returns:
+        (результат normalize_image, секунды)
+    """
+    started = time.perf_counter()
+    return normalize_image(src_path, dst_path, max_side, quality), time.perf_counter() - started
+
+
+class ImageNormalizationPool:
+    """Process pool for photo normalization (decode, auto-orient, downscale, JPEG) with a queue depth limit
+
+    Декодирование и сжатие многомегапиксельных фото - десятки-сотни мс CPU на снимок;
+    в отдельных процессах они не блокируют event loop.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.pending = 0
+        self.normalized = 0
+        self.skipped = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self._workers = ProcessWorkerPool(self.max_workers)
+        self._warned = False
+
+    @property
+    def enabled(self) -> bool:
+        if not settings.IMAGE_NORMALIZE_ENABLED:
+            return False
+        if not pillow_available():
+            if not self._warned:
+                self._warned = True
+                print("⚠️ Image normalization is enabled but Pillow is not installed - photos are sent as is")
+            return False
+        return True
+
+    def shutdown(self) -> None:
+        self._workers.shutdown()
+
+    async def normalize(self, path: str) -> Optional[ImageNormalizationResult]:
+        """
+        Normalize the photo at path in a worker process
+
+        Returns:
+            Результат с путем к временному JPEG или None - отправлять исходный файл
+            (снимок уже подходит или не открывается Pillow)
+
+        Raises:
+            ImageQueueFull, ImageNormalizationTimeout
+        """
+        if self.max_queue and self.pending >= self.max_queue:
+            self.rejected += 1
+            raise ImageQueueFull(f"{self.pending} images are already being processed")
+
+        timeout = settings.IMAGE_TIMEOUT_SECONDS
+        fd, dst_path = tempfile.mkstemp(prefix="normalized_", suffix=".jpg")
+        os.close(fd)
+        keep = False
+        self.pending += 1
+        try:
+            try:
+                result, seconds = await self._workers.run(
+                    _normalize_in_worker,
+                    path,
+                    dst_path,
+                    settings.IMAGE_MAX_SIDE,
+                    settings.IMAGE_JPEG_QUALITY,
+                    soft_timeout=timeout or None,
+                    # Запас сверх таймаута - на срабатывание SIGALRM в самом воркере
+                    hard_timeout=timeout + max(timeout, 5) if timeout else None
+                )
+            except WorkerTimeout as e:
+                # Убит только зависший воркер, остальные фото обрабатываются дальше
+                self.timeouts += 1
+                print(f"❌ Image worker killed: {e}")
+                raise ImageNormalizationTimeout(f"Image normalization timed out after {timeout} s")
+            except TimeoutError:
+                self.timeouts += 1
+                raise ImageNormalizationTimeout(f"Image normalization timed out after {timeout} s: {path}")
+            except WorkerCrashed as e:
+                # Упал только этот воркер - фото уходит как есть
+                self.failed += 1
+                print(f"❌ Image worker crashed: {e}")
+                return None
+            except Exception as e:
+                # Битый или неподдерживаемый файл (HEIC без pillow-heif) - отправляется как есть
+                self.failed += 1
+                print(f"⚠️ Could not normalize image: {type(e).__name__}: {e}")
+                return None
+
+            if result is None:
+                self.skipped += 1
+                return None
+            original_dimensions, dimensions = result
+            original_size = os.path.getsize(path)
+            size = os.path.getsize(dst_path)
+            self.normalized += 1
+            self.bytes_before += original_size
+            self.bytes_after += size
+            keep = True
+            return ImageNormalizationResult(dst_path, size, original_size, dimensions, original_dimensions, seconds * 1000)
+        finally:
+            self.pending -= 1
+            if not keep:
+                os.unlink(dst_path)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "max_queue": self.max_queue,
+            "normalized": self.normalized,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_after,
+            **self._workers.snapshot(),
+        }
+
+
+image_pool = ImageNormalizationPool(settings.IMAGE_WORKERS, settings.IMAGE_MAX_QUEUE)
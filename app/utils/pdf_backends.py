@@ -0,0 +1,163 @@
+import importlib.util
+import io
+from typing import BinaryIO, Dict, Optional, Union
+
+from app.config import settings
+
+
+class PdfDocument:
+    """Opened document: number of pages and text of one page"""
+
+    page_count: int = 0
+
+    def page_text(self, index: int) -> str:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class PdfBackend:
+    """
+    PDF text extraction library behind a common interface
+
+    Библиотеки необязательные: импортируются только при открытии документа,
+    доступность проверяется через is_available() без импорта.
+    """
+
+    name = ""
+    module = ""  # пакет, который должен быть установлен
+
+    def is_available(self) -> bool:
+        return importlib.util.find_spec(self.module) is not None
+
+    def open(self, fileobj: BinaryIO) -> PdfDocument:
+        raise NotImplementedError
+
+
+class _ReaderDocument(PdfDocument):
+    # PdfReader из PyPDF2 и pypdf - одинаковый API
+    def __init__(self, reader):
+        self._reader = reader
+        self.page_count = len(reader.pages)
+
+    def page_text(self, index: int) -> str:
+        return self._reader.pages[index].extract_text() or ""
+
+
+class PyPDF2Backend(PdfBackend):
+    name = "pypdf2"
+    module = "PyPDF2"
+
+    def open(self, fileobj: BinaryIO) -> PdfDocument:
+        import PyPDF2
+        return _ReaderDocument(PyPDF2.PdfReader(fileobj))
+
+
+class PypdfBackend(PdfBackend):
+    name = "pypdf"
+    module = "pypdf"
+
+    def open(self, fileobj: BinaryIO) -> PdfDocument:
+        import pypdf
+        return _ReaderDocument(pypdf.PdfReader(fileobj))
+
+
+class _PdfminerDocument(PdfDocument):
+    def __init__(self, fileobj: BinaryIO):
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfinterp import PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+
+        document = PDFDocument(PDFParser(fileobj))
+        # Дерево страниц разбирается сразу, содержимое страниц - по запросу
+        self._pages = list(PDFPage.create_pages(document))
+        self._resources = PDFResourceManager(caching=True)
+        self._laparams = LAParams()
+        self.page_count = len(self._pages)
+
+    def page_text(self, index: int) -> str:
+        from pdfminer.converter import TextConverter
+        from pdfminer.pdfinterp import PDFPageInterpreter
+
+        output = io.StringIO()
+        device = TextConverter(self._resources, output, laparams=self._laparams)
+        try:
+            PDFPageInterpreter(self._resources, device).process_page(self._pages[index])
+        finally:
+            device.close()
+        # TextConverter завершает страницу символом \f
+        return output.getvalue().replace("\f", "").rstrip()
+
+
+class PdfminerBackend(PdfBackend):
+    name = "pdfminer"
+    module = "pdfminer"
+
+    def open(self, fileobj: BinaryIO) -> PdfDocument:
+        return _PdfminerDocument(fileobj)
+
+
+class _PdfiumDocument(PdfDocument):
+    def __init__(self, fileobj: BinaryIO):
+        import pypdfium2
+
+        self._pdf = pypdfium2.PdfDocument(fileobj)
+        self.page_count = len(self._pdf)
+
+    def page_text(self, index: int) -> str:
+        page = self._pdf[index]
+        try:
+            textpage = page.get_textpage()
+            try:
+                return textpage.get_text_range()
+            finally:
+                textpage.close()
+        finally:
+            page.close()
+
+    def close(self) -> None:
+        self._pdf.close()
+
+
+class Pypdfium2Backend(PdfBackend):
+    name = "pypdfium2"
+    module = "pypdfium2"
+
+    def open(self, fileobj: BinaryIO) -> PdfDocument:
+        return _PdfiumDocument(fileobj)
+
+
+BACKENDS: Dict[str, PdfBackend] = {
+    backend.name: backend
+    for backend in (PyPDF2Backend(), PypdfBackend(), PdfminerBackend(), Pypdfium2Backend())
+}
+DEFAULT_BACKEND = "pypdf2"
+
+_warned = set()
+
+
+def get_pdf_backend(name: Optional[str] = None) -> PdfBackend:
+    """
+    Backend by name (по умолчанию - settings.PDF_BACKEND)
+
+    Если библиотека не установлена, используется PyPDF2 (один раз пишется предупреждение).
+    """
+    name = (name or settings.PDF_BACKEND or DEFAULT_BACKEND).lower()
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown PDF backend {name!r}, expected one of: {', '.join(BACKENDS)}")
+    if not backend.is_available():
+        if name not in _warned:
+            _warned.add(name)
+            print(f"⚠️ PDF backend {name!r} is not installed ({backend.module}) - using {DEFAULT_BACKEND}")
+        backend = BACKENDS[DEFAULT_BACKEND]
+    return backend
+
+
+def open_pdf(pdf_source: Union[bytes, BinaryIO], backend: Optional[str] = None) -> PdfDocument:
+    """Open PDF bytes or a binary file with the configured backend"""
+    pdf_file = io.BytesIO(pdf_source) if isinstance(pdf_source, (bytes, bytearray)) else pdf_source
+    return get_pdf_backend(backend).open(pdf_file)
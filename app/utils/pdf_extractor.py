@@ -1,40 +1,56 @@
-import io
-from typing import Optional
-import PyPDF2
+import time
+from typing import BinaryIO, Callable, List, Optional, Tuple, Union
 
+from app.utils.pdf_backends import open_pdf
 
-def extract_text_from_pdf(pdf_bytes: bytes) -> Optional[str]:
+
+def extract_text_from_pdf(
+    pdf_source: Union[bytes, BinaryIO],
+    max_pages: Optional[int] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    backend: Optional[str] = None
+) -> Optional[str]:
     """
     Извлекает текст из PDF файла.
     
     Args:
-        pdf_bytes: Байты PDF файла
+        pdf_source: Байты PDF файла или открытый бинарный файл (читается
+            по мере надобности, без загрузки целиком в память)
+        max_pages: Обрабатывать не больше N первых страниц (None - все)
+        should_stop: Проверяется перед каждой страницей; True - прервать (вернуть None)
+        backend: Библиотека извлечения (None - settings.PDF_BACKEND)
         
     Returns:
         Извлеченный текст или None в случае ошибки
     """
     try:
-        # Создаем BytesIO объект из байтов
-        pdf_file = io.BytesIO(pdf_bytes)
-        
-        # Создаем PDF reader
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        document = open_pdf(pdf_source, backend)
         
         # Извлекаем текст со всех страниц
         text_parts = []
-        for page_num, page in enumerate(pdf_reader.pages, start=1):
-            try:
-                page_text = page.extract_text()
-                if page_text:
-                    text_parts.append(page_text)
-            except Exception as page_err:
-                print(f"Warning: Could not extract text from page {page_num}: {page_err}")
-                continue
+        total_pages = document.page_count
+        try:
+            for page_num in range(1, total_pages + 1):
+                if max_pages and page_num > max_pages:
+                    print(f"⚠️ Page budget reached: extracted {max_pages} of {total_pages} pages")
+                    break
+                if should_stop is not None and should_stop():
+                    print(f"⚠️ PDF extraction cancelled at page {page_num} of {total_pages}")
+                    return None
+                try:
+                    page_text = document.page_text(page_num - 1)
+                    if page_text:
+                        text_parts.append(page_text)
+                except Exception as page_err:
+                    print(f"Warning: Could not extract text from page {page_num}: {page_err}")
+                    continue
+        finally:
+            document.close()
         
         # Объединяем текст со всех страниц
         full_text = "\n\n".join(text_parts)
         
-        print(f"✅ Successfully extracted {len(full_text)} characters from PDF ({len(pdf_reader.pages)} pages)")
+        print(f"✅ Successfully extracted {len(full_text)} characters from PDF ({total_pages} pages)")
         
         return full_text if full_text.strip() else None
         
@@ -44,3 +60,58 @@ def extract_text_from_pdf(pdf_bytes: bytes) -> Optional[str]:
         print(traceback.format_exc())
         return None
 
+
+
+def extract_page_range(
+    pdf_source: Union[bytes, BinaryIO],
+    start: int = 0,
+    stop: Optional[int] = None,
+    max_chars: Optional[int] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    pages_out: Optional[List[Tuple[int, str, float]]] = None,
+    backend: Optional[str] = None
+) -> Tuple[int, List[Tuple[int, str, float]]]:
+    """
+    Извлекает текст страниц [start, stop) с замером времени каждой страницы.
+    
+    Используется пулом процессов: большой документ делится на диапазоны
+    страниц, которые извлекаются параллельно.
+    
+    Args:
+        pdf_source: Байты PDF файла или открытый бинарный файл
+        start: Первая страница (с 0)
+        stop: Страница, перед которой остановиться (None - до конца)
+        max_chars: Остановиться, когда набрано столько символов (None - без лимита)
+        should_stop: Проверяется перед каждой страницей; True - прервать
+        pages_out: Список, в который добавляются страницы по мере извлечения
+            (после прерывания по таймауту в нем остается уже извлеченное)
+        backend: Библиотека извлечения (None - settings.PDF_BACKEND)
+        
+    Returns:
+        (число страниц в документе, [(номер страницы с 0, текст, секунды)])
+        Ошибки разбора документа не перехватываются.
+    """
+    document = open_pdf(pdf_source, backend)
+    total_pages = document.page_count
+    pages = pages_out if pages_out is not None else []
+    
+    chars = 0
+    try:
+        for page_index in range(start, min(stop, total_pages) if stop is not None else total_pages):
+            if should_stop is not None and should_stop():
+                break
+            page_start = time.perf_counter()
+            try:
+                page_text = document.page_text(page_index) or ""
+            except Exception as page_err:
+                print(f"Warning: Could not extract text from page {page_index + 1}: {page_err}")
+                page_text = ""
+            pages.append((page_index, page_text, time.perf_counter() - page_start))
+            
+            chars += len(page_text)
+            if max_chars and chars >= max_chars:
+                break
+    finally:
+        document.close()
+    
+    return total_pages, pages
@@ -0,0 +1,321 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+from app.utils.pdf_backends import get_pdf_backend
+from app.utils.pdf_extractor import extract_page_range
+from app.utils.process_pool import ProcessWorkerPool, TaskTimeout, WorkerCrashed, WorkerTimeout
+from app.utils.text_cache import extracted_text_cache
+
+
+class PdfQueueFull(Exception):
+    """Too many PDFs are already waiting for extraction"""
+
+
+class PdfExtractionCancelled(Exception):
+    """Client disconnected before extraction finished"""
+
+
+class PdfExtractionTimeout(Exception):
+    """Document exceeded PDF_TIMEOUT_SECONDS"""
+
+
+class PdfExtractionResult:
+    """Extracted text with per-page timing"""
+
+    __slots__ = ("text", "total_pages", "page_timings", "truncated", "timed_out", "from_cache")
+
+    def __init__(
+        self,
+        text: Optional[str],
+        total_pages: Optional[int] = None,
+        page_timings: Optional[List[Tuple[int, float]]] = None,
+        truncated: bool = False,
+        timed_out: bool = False,
+        from_cache: bool = False
+    ):
+        self.text = text
+        self.total_pages = total_pages
+        self.page_timings = page_timings or []  # [(номер страницы с 1, мс)]
+        self.truncated = truncated  # остановлено по лимиту символов/страниц/времени
+        self.timed_out = timed_out  # часть страниц не успела за PDF_TIMEOUT_SECONDS
+        self.from_cache = from_cache
+
+    def summary(self) -> str:
+        if self.from_cache:
+            return f"{len(self.text or '')} characters from cache"
+        total_ms = sum(ms for _, ms in self.page_timings)
+        slowest = max(self.page_timings, key=lambda item: item[1], default=None)
+        line = f"{len(self.text or '')} characters, {len(self.page_timings)}/{self.total_pages} pages, {total_ms:.0f} ms CPU"
+        if slowest:
+            line += f", slowest page {slowest[0]}: {slowest[1]:.0f} ms"
+        if self.timed_out:
+            line += " (truncated by timeout)"
+        elif self.truncated:
+            line += " (truncated by budget)"
+        return line
+
+
+def _extract_in_worker(
+    path: str,
+    start: int,
+    stop: Optional[int],
+    max_chars: Optional[int],
+    backend: Optional[str] = None
+) -> Tuple[Optional[int], List[Tuple[int, str, float]], bool]:
+    """Runs in a pool process: pages [start, stop) with a character budget
+
+    По таймауту (TaskTimeout от SIGALRM в воркере) уже извлеченные страницы
+    возвращаются. Отмена - удаление файла по path (открытый дескриптор остается
+    рабочим), проверяется перед каждой страницей.
+
+    Returns:
+        (число страниц в документе или None, [(страница, текст, секунды)], timed_out)
+    """
+    pages: List[Tuple[int, str, float]] = []
+    total_pages = None
+    try:
+        with open(path, "rb") as pdf_file:
+            total_pages, _ = extract_page_range(
+                pdf_file,
+                start,
+                stop,
+                max_chars=max_chars,
+                should_stop=lambda: not os.path.exists(path),
+                pages_out=pages,
+                backend=backend
+            )
+        return total_pages, pages, False
+    except TaskTimeout:
+        print(f"❌ PDF extraction timed out on pages {start}-{stop}: {path}")
+        return total_pages, pages, True
+
+
+class PdfExtractionPool:
+    """Process pool for PDF text extraction with a queue depth limit
+
+    Разбор PDF (PyPDF2, pypdf, pdfminer - чистый Python) держит GIL: в отдельных
+    процессах извлечение не блокирует event loop и использует все ядра. Большие документы делятся
+    на диапазоны по PDF_PAGE_BATCH_SIZE страниц, которые извлекаются параллельно.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.pending = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.failed = 0
+        self._workers = ProcessWorkerPool(self.max_workers)
+
+    def shutdown(self) -> None:
+        self._workers.shutdown()
+
+    async def extract(
+        self,
+        path: str,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        poll_interval: float = 0.5,
+        content_hash: Optional[str] = None
+    ) -> PdfExtractionResult:
+        """
+        Extract text of the PDF at path in worker processes
+
+        Args:
+            path: Path to a temporary copy of the PDF (воркеру передается путь,
+                а не байты файла). При отмене файл удаляется.
+            is_disconnected: e.g. Request.is_disconnected - извлечение отменяется,
+                если клиент ушел
+            content_hash: SHA-256 of the document - результат берется из кеша
+                извлеченного текста и сохраняется в него
+
+        Raises:
+            PdfQueueFull, PdfExtractionTimeout, PdfExtractionCancelled
+        """
+        max_pages = settings.PDF_MAX_PAGES or None
+        max_chars = settings.PDF_MAX_CHARS or None
+
+        # Текст зависит и от документа, и от библиотеки, и от лимитов
+        backend = get_pdf_backend().name
+        cache_key = f"{content_hash}-{backend}-p{max_pages or 0}-c{max_chars or 0}" if content_hash else None
+        if cache_key and extracted_text_cache.enabled:
+            cached_text = await asyncio.to_thread(extracted_text_cache.get, cache_key)
+            if cached_text is not None:
+                return PdfExtractionResult(cached_text or None, from_cache=True)
+
+        if self.max_queue and self.pending >= self.max_queue:
+            self.rejected += 1
+            raise PdfQueueFull(f"{self.pending} PDFs are already being processed")
+
+        self.pending += 1
+        try:
+            result = await self._extract_pages(path, backend, max_pages, max_chars, is_disconnected, poll_interval)
+        finally:
+            self.pending -= 1
+
+        self.completed += 1
+        # Результат, обрезанный по времени, не детерминирован - его не кешируем;
+        # документ без текста кешируется пустой строкой
+        if cache_key and extracted_text_cache.enabled and not result.timed_out:
+            await asyncio.to_thread(extracted_text_cache.put, cache_key, result.text or "")
+        return result
+
+    async def _extract_pages(
+        self,
+        path: str,
+        backend: str,
+        max_pages: Optional[int],
+        max_chars: Optional[int],
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+        poll_interval: float
+    ) -> PdfExtractionResult:
+        timeout = settings.PDF_TIMEOUT_SECONDS
+        # Запас сверх таймаута - на срабатывание SIGALRM в самом воркере; не успевший
+        # воркер убивается (только он - остальные диапазоны и документы продолжают работу)
+        hard_timeout = timeout + max(timeout, 5) if timeout else None
+        batch_size = settings.PDF_PAGE_BATCH_SIZE if self.max_workers > 1 else 0
+        loop = asyncio.get_running_loop()
+
+        running: Set[asyncio.Future] = set()
+        started_at = None
+
+        def mark_started() -> None:
+            # Отсчет с момента, когда работа ушла воркеру (ожидание в очереди не считается)
+            nonlocal started_at
+            if started_at is None:
+                started_at = loop.time()
+
+        def submit(start: int, stop: Optional[int]) -> None:
+            running.add(asyncio.ensure_future(self._workers.run(
+                _extract_in_worker,
+                path,
+                start,
+                stop,
+                max_chars,
+                backend,
+                soft_timeout=timeout,
+                hard_timeout=hard_timeout,
+                on_start=mark_started
+            )))
+
+        # Первый диапазон заодно сообщает число страниц; без параллельного режима - весь документ
+        first_stop = batch_size if batch_size else max_pages
+        if batch_size and max_pages:
+            first_stop = min(batch_size, max_pages)
+        submit(0, first_stop)
+        next_start = batch_size if batch_size else None
+
+        total_pages = None
+        page_limit = None
+        pages: Dict[int, Tuple[str, float]] = {}
+        prefix_end = 0  # страницы [0, prefix_end) уже учтены в prefix_chars
+        prefix_chars = 0
+        timed_out = False
+        budget_reached = False
+
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    running.discard(future)
+                    try:
+                        batch_total, batch_pages, batch_timed_out = future.result()
+                    except WorkerTimeout as e:
+                        # Воркер завис в C-коде и убит - страниц этого диапазона не будет
+                        print(f"❌ PDF worker killed: {e}")
+                        timed_out = True
+                        continue
+                    except WorkerCrashed as e:
+                        # Упал только этот воркер; документ уходит без текста
+                        self.failed += 1
+                        print(f"❌ PDF worker crashed: {e}")
+                        return PdfExtractionResult(None, total_pages)
+                    except Exception as e:
+                        # Битый PDF: дальше разбирать нечего, как и раньше - без текста
+                        print(f"❌ Error extracting text from PDF: {e}")
+                        return PdfExtractionResult(None, total_pages)
+                    if batch_total is not None:
+                        total_pages = batch_total
+                        page_limit = min(total_pages, max_pages) if max_pages else total_pages
+                    for page_index, page_text, seconds in batch_pages:
+                        pages[page_index] = (page_text, seconds)
+                    timed_out = timed_out or batch_timed_out
+
+                # Лимит символов считается по непрерывному началу документа
+                # (страницы сверх PDF_MAX_PAGES в текст не попадают)
+                while prefix_end in pages and (page_limit is None or prefix_end < page_limit):
+                    prefix_chars += len(pages[prefix_end][0])
+                    prefix_end += 1
+                    if max_chars and prefix_chars >= max_chars:
+                        budget_reached = True
+                        break
+
+                if budget_reached or timed_out:
+                    break
+
+                # Оставшиеся диапазоны - не больше, чем воркеров, чтобы после
+                # достижения лимита не оставалось лишней работы в очереди
+                if next_start is not None and page_limit is not None:
+                    while len(running) < self.max_workers and next_start < page_limit:
+                        submit(next_start, min(next_start + batch_size, page_limit))
+                        next_start += batch_size
+
+                if is_disconnected is not None and await is_disconnected():
+                    self.cancelled += 1
+                    # Уже запущенные задачи увидят это перед следующей страницей
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                    raise PdfExtractionCancelled("Client disconnected")
+
+                if timeout and started_at is not None:
+                    elapsed = loop.time() - started_at
+                    if elapsed > timeout and prefix_end > 0:
+                        # Начало документа уже есть - отдаем его, чем ждать хвост
+                        timed_out = True
+                        break
+                    if elapsed > hard_timeout:
+                        # Диапазоны, запущенные позже первого, не продлевают документ сверх
+                        # hard timeout; их воркеры пул дождется или убьет сам
+                        self.timeouts += 1
+                        raise PdfExtractionTimeout(f"PDF extraction timed out after {timeout} s")
+        finally:
+            # Незапущенные диапазоны снимаются с очереди, запущенные дорабатывают в фоне
+            for future in running:
+                future.cancel()
+
+        if timed_out:
+            self.timeouts += 1
+            if prefix_end == 0:
+                raise PdfExtractionTimeout(f"PDF extraction timed out after {timeout} s")
+
+        used_pages = range(prefix_end)
+        text = "\n\n".join(pages[i][0] for i in used_pages if pages[i][0])
+        truncated = budget_reached or timed_out or (page_limit is not None and page_limit < (total_pages or 0))
+        return PdfExtractionResult(
+            text if text.strip() else None,
+            total_pages,
+            [(i + 1, pages[i][1] * 1000) for i in used_pages],
+            truncated=truncated,
+            timed_out=timed_out
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            **self._workers.snapshot(),
+        }
+
+
+pdf_pool = PdfExtractionPool(settings.PDF_WORKERS, settings.PDF_MAX_QUEUE)
@@ -0,0 +1,258 @@
+"""
+Process pool for CPU-bound work (PDF text extraction, photo normalization)
+
+В отличие от ProcessPoolExecutor, зависшая задача завершается вместе только со своим
+процессом: ProcessPoolExecutor после гибели одного воркера объявляет сломанным весь
+пул (BrokenProcessPool во всех задачах, в том числе чужих загрузок). Здесь каждый
+воркер - отдельный процесс со своим каналом; убитый или упавший воркер заменяется
+новым при следующей задаче.
+"""
+import asyncio
+import multiprocessing
+import signal
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+
+class TaskTimeout(BaseException):
+    """Raised inside the worker when a task exceeds its soft timeout (SIGALRM)
+
+    BaseException: не перехватывается "except Exception" в коде задачи. Задача может
+    перехватить его сама, чтобы вернуть частичный результат; иначе вызывающий код
+    получит TimeoutError.
+    """
+
+
+class WorkerTimeout(Exception):
+    """Task did not finish within its hard timeout - its worker process was killed"""
+
+
+class WorkerCrashed(Exception):
+    """Worker process died while running the task"""
+
+
+def _raise_task_timeout(signum, frame):
+    raise TaskTimeout()
+
+
+def _worker_main(conn) -> None:
+    # Ctrl+C/остановку обрабатывает родительский процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    use_alarm = hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_task_timeout)
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        fn, args, soft_timeout = message
+        alarm = bool(soft_timeout and use_alarm)
+        # Таймаут - SIGALRM в самом воркере (задача выполняется в его главном потоке),
+        # так что зависший на битом файле разбор прерывается
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, soft_timeout)
+        try:
+            result = (True, fn(*args))
+        except TaskTimeout:
+            result = (False, TimeoutError(f"Task timed out after {soft_timeout} s"))
+        except Exception as e:
+            result = (False, e)
+        finally:
+            if alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # Результат или исключение не сериализуются
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class _Worker:
+    __slots__ = ("process", "conn")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+
+class ProcessWorkerPool:
+    """Up to max_workers spawned worker processes, each running one task at a time"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        # spawn: воркеры не наследуют соединения с БД, пулы и потоки родителя
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: Set[_Worker] = set()
+        self._idle: List[_Worker] = []
+        self._busy = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._draining: Set[asyncio.Task] = set()
+        self.killed = 0
+        self.crashed = 0
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        self._workers.add(worker)
+        return worker
+
+    def _kill(self, worker: _Worker) -> None:
+        self._workers.discard(worker)
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join(1)
+        worker.conn.close()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    async def _acquire(self) -> _Worker:
+        while not self._idle and self._busy >= self.max_workers:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self._busy += 1
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.process.is_alive():
+                return worker
+            # Процесс умер, пока простаивал (например, OOM killer)
+            self._kill(worker)
+        try:
+            return self._spawn()
+        except BaseException:
+            self._release(None)
+            raise
+
+    def _release(self, worker: Optional[_Worker]) -> None:
+        """Return a worker to the pool (None - воркер убит, слот освобождается)"""
+        self._busy -= 1
+        if worker is not None:
+            self._idle.append(worker)
+        self._wake()
+
+    async def _wait_result(self, worker: _Worker, timeout: Optional[float]) -> bool:
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = worker.conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(True))
+        try:
+            return await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(fd)
+
+    async def _drain(self, worker: _Worker, timeout: Optional[float]) -> None:
+        # Вызывающий код отменил задачу, а воркер еще работает: дожидаемся его в фоне
+        # (результат отбрасывается), не дольше hard timeout - иначе процесс убивается
+        try:
+            finished = await self._wait_result(worker, timeout)
+        except asyncio.CancelledError:
+            finished = False
+        if finished:
+            try:
+                worker.conn.recv()
+            except (EOFError, OSError):
+                pass
+            else:
+                self._release(worker)
+                return
+        self._kill(worker)
+        self._release(None)
+
+    async def run(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        soft_timeout: Optional[float] = None,
+        hard_timeout: Optional[float] = None,
+        on_start: Optional[Callable[[], None]] = None
+    ) -> Any:
+        """
+        Run fn(*args) in a worker process
+
+        Args:
+            fn: Module-level function (передается в воркер по имени через pickle)
+            soft_timeout: SIGALRM в воркере - TaskTimeout внутри задачи
+            hard_timeout: Если задача не вернулась (завис C-код), ее процесс убивается,
+                остальные воркеры продолжают работу
+            on_start: Called when the task is handed to a worker (ожидание свободного
+                воркера не входит в таймауты)
+
+        Raises:
+            WorkerTimeout, WorkerCrashed, TimeoutError (soft timeout),
+            исключение из fn
+        """
+        worker = await self._acquire()
+        try:
+            worker.conn.send((fn, args, soft_timeout))
+        except BaseException:
+            self.crashed += 1
+            self._kill(worker)
+            self._release(None)
+            raise
+        if on_start is not None:
+            on_start()
+
+        try:
+            finished = await self._wait_result(worker, hard_timeout)
+        except asyncio.CancelledError:
+            task = asyncio.ensure_future(self._drain(worker, hard_timeout))
+            self._draining.add(task)
+            task.add_done_callback(self._draining.discard)
+            raise
+
+        if not finished:
+            self.killed += 1
+            self._kill(worker)
+            self._release(None)
+            raise WorkerTimeout(f"Worker did not finish within {hard_timeout} s and was killed")
+        try:
+            ok, value = worker.conn.recv()
+        except (EOFError, OSError):
+            self.crashed += 1
+            self._kill(worker)
+            self._release(None)
+            raise WorkerCrashed(f"Worker process exited with code {worker.process.exitcode}")
+
+        self._release(worker)
+        if ok:
+            return value
+        raise value
+
+    def shutdown(self) -> None:
+        """Stop idle workers and kill busy ones"""
+        for worker in list(self._workers):
+            if worker in self._idle:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.process.join(1)
+            self._kill(worker)
+        self._idle.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "processes": len(self._workers),
+            "busy": self._busy,
+            "waiting": len(self._waiters),
+            "killed": self.killed,
+            "crashed": self.crashed,
+        }
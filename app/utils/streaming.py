@@ -0,0 +1,195 @@
+import asyncio
+import base64
+import json
+import os
+import secrets
+import tempfile
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterator, Optional
+
+from fastapi import UploadFile
+
+# Кратно 3: base64 отдельных кусков склеивается в корректный base64 всего файла
+BASE64_CHUNK_SIZE = 3 * 16 * 1024
+
+UPLOAD_TRANSPORTS = ("json", "multipart")
+
+
+class Base64JSONBody:
+    """
+    JSON request body {**fields, file_key: base64(file)} produced chunk by chunk
+
+    Файл читается из fileobj кусками и кодируется по мере отправки, поэтому
+    память на загрузку не зависит от размера файла (раньше в памяти были
+    байты файла, строка base64 и JSON целиком). Длина тела известна заранее
+    (__len__), так что запрос уходит с Content-Length, а не chunked.
+    """
+
+    content_type = "application/json"
+
+    def __init__(self, fields: Dict[str, Any], file_key: str, fileobj: BinaryIO, chunk_size: int = BASE64_CHUNK_SIZE):
+        if chunk_size % 3:
+            raise ValueError("chunk_size must be a multiple of 3")
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+
+        # Поле с файлом - последним: '{..., "file": "' + base64 + '"}'
+        head = json.dumps(fields)[:-1]
+        if fields:
+            head += ", "
+        self._head = f'{head}{json.dumps(file_key)}: "'.encode()
+        self._tail = b'"}'
+
+        self.file_size = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(0)
+        self.base64_size = 4 * ((self.file_size + 2) // 3)
+
+    def __len__(self) -> int:
+        return len(self._head) + self.base64_size + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.fileobj.seek(0)
+        yield self._head
+        while True:
+            chunk = self.fileobj.read(self.chunk_size)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
+        yield self._tail
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        """Same chunks for an async HTTP client (content=body.aiter_chunks(), Content-Length=len(body))"""
+        # Чтение временного файла - блокирующий I/O, поэтому в потоке
+        await asyncio.to_thread(self.fileobj.seek, 0)
+        yield self._head
+        while True:
+            chunk = await asyncio.to_thread(self.fileobj.read, self.chunk_size)
+            if not chunk:
+                break
+            yield base64.b64encode(chunk)
+        yield self._tail
+
+
+def _quote_disposition(value: str) -> str:
+    # Как браузеры: кавычки и переводы строк в имени поля/файла экранируются
+    return value.replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class MultipartBody:
+    """
+    multipart/form-data request body: fields as text parts, the file as a raw binary part
+
+    В отличие от Base64JSONBody файл уходит как есть - тело на треть меньше,
+    и получателю (n8n: поля - в body, файл - в binary) не нужно декодировать base64.
+    Строки отправляются как есть, остальные значения - в JSON (profile - объект,
+    size - число), None пропускается. Файл читается кусками, длина тела известна заранее.
+    """
+
+    def __init__(
+        self,
+        fields: Dict[str, Any],
+        file_key: str,
+        fileobj: BinaryIO,
+        filename: Optional[str] = None,
+        file_content_type: Optional[str] = None,
+        chunk_size: int = BASE64_CHUNK_SIZE
+    ):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        boundary = f"----upload{secrets.token_hex(16)}"
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+        parts = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote_disposition(name)}"\r\n\r\n{text}\r\n'
+            )
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote_disposition(file_key)}"; '
+            f'filename="{_quote_disposition(filename or file_key)}"\r\n'
+            f'Content-Type: {file_content_type or "application/octet-stream"}\r\n\r\n'
+        )
+        self._head = "".join(parts).encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+
+        self.file_size = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(0)
+
+    def __len__(self) -> int:
+        return len(self._head) + self.file_size + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.fileobj.seek(0)
+        yield self._head
+        while True:
+            chunk = self.fileobj.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield self._tail
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        """Same chunks for an async HTTP client (content=body.aiter_chunks(), Content-Length=len(body))"""
+        await asyncio.to_thread(self.fileobj.seek, 0)
+        yield self._head
+        while True:
+            chunk = await asyncio.to_thread(self.fileobj.read, self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield self._tail
+
+
+def build_upload_body(fields: Dict[str, Any], file_key: str, fileobj: BinaryIO, transport: str):
+    """
+    Request body for the analysis webhook in the configured transport
+
+    Args:
+        transport: "json" - файл в поле file_key как base64 (Base64JSONBody),
+            "multipart" - файл отдельной бинарной частью (MultipartBody);
+            имя и тип файла берутся из fields["fileName"] и fields["mimeType"]
+    """
+    if transport == "multipart":
+        return MultipartBody(fields, file_key, fileobj, fields.get("fileName"), fields.get("mimeType"))
+    if transport == "json":
+        return Base64JSONBody(fields, file_key, fileobj)
+    raise ValueError(f"Unknown upload transport {transport!r}, expected one of: {', '.join(UPLOAD_TRANSPORTS)}")
+
+
+async def spool_upload_to_temp_file(upload: UploadFile, suffix: str = "", chunk_size: int = BASE64_CHUNK_SIZE, digest=None) -> str:
+    """
+    Copy an upload to a named temporary file chunk by chunk and return its path
+
+    Нужен, когда файл обрабатывает другой процесс (пул извлечения PDF): ему
+    передается путь, а не байты. Удалить файл - забота вызывающего кода.
+    digest (например, hashlib.sha256()) обновляется теми же кусками.
+    """
+    await upload.seek(0)
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                if digest is not None:
+                    digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    await upload.seek(0)
+    return path
+
+
+async def hash_upload(upload: UploadFile, digest, chunk_size: int = BASE64_CHUNK_SIZE) -> None:
+    """Feed the whole upload into digest chunk by chunk (без загрузки файла в память)"""
+    await upload.seek(0)
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    await upload.seek(0)
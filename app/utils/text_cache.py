@@ -0,0 +1,123 @@
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.config import settings
+
+_SUFFIX = ".txt.z"
+
+
+class ExtractedTextCache:
+    """
+    Disk cache of extracted PDF text keyed by document content hash (zlib-compressed)
+
+    Повторное извлечение того же документа (повторы, переанализ) - чтение
+    одного файла вместо разбора PDF. Размер на диске ограничен max_bytes,
+    вытесняются давно не использованные записи (LRU по mtime: чтение обновляет mtime).
+    Каталог может быть общим для нескольких воркеров uvicorn - запись атомарная
+    (os.replace), чужое удаление файла считается промахом.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: Optional["OrderedDict[str, int]"] = None  # key -> размер файла, от старых к новым
+        self._total_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{_SUFFIX}")
+
+    def _load_index(self) -> None:
+        # Вызывается под self._lock; индекс строится один раз по содержимому каталога
+        if self._entries is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(_SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(_SUFFIX)], stat.st_size))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(files))
+        self._total_bytes = sum(self._entries.values())
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached text ("" - документ без текста), None on miss"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            text = zlib.decompress(data).decode("utf-8")
+        except (OSError, zlib.error, UnicodeDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            if self._entries is not None and key in self._entries:
+                self._entries.move_to_end(key)
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        if not self.enabled:
+            return
+        data = zlib.compress(text.encode("utf-8"), 6)
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._load_index()
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                print(f"⚠️ Could not write extracted text cache: {e}")
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                return
+
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        # Вызывается под self._lock
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries) if self._entries is not None else None,
+                "bytes": self._total_bytes if self._entries is not None else None,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+extracted_text_cache = ExtractedTextCache(
+    settings.PDF_TEXT_CACHE_DIR or os.path.join(tempfile.gettempdir(), "pdf_text_cache"),
+    settings.PDF_TEXT_CACHE_MAX_BYTES,
+)
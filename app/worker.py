@@ -0,0 +1,228 @@
+"""
+Webhook dispatcher: sends queued n8n webhook calls (таблица webhook_jobs)
+
+    python -m app.worker
+
+Воркеров может быть сколько угодно (задачи забираются через FOR UPDATE SKIP LOCKED).
+При WEBHOOK_WORKER_IN_PROCESS=true такой же диспетчер работает и в процессе API.
+"""
+import asyncio
+import signal
+from typing import Any, Dict, Optional, Set
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.config import settings  # noqa: E402
+from app.database import WebhookJob, get_async_session_local  # noqa: E402
+from app.db import jobs, queries  # noqa: E402
+from app.utils.http_client import close_http_client, post_webhook  # noqa: E402
+from app.utils.streaming import build_upload_body  # noqa: E402
+
+
+def _webhook_url(destination: str) -> Optional[str]:
+    if destination == "analysis":
+        return settings.ANALYSIS_WEBHOOK_URL
+    if destination == "recommendations":
+        return settings.RECOMMENDATIONS_WEBHOOK_URL
+    return None
+
+
+def _is_retryable_status(status_code: int) -> bool:
+    # 4xx (кроме таймаута и rate limit) - ошибка в самом запросе, повтор не поможет
+    return status_code >= 500 or status_code in (408, 429)
+
+
+class WebhookDispatcher:
+    """Claims due jobs and sends them with retries, backoff and dead-lettering"""
+
+    def __init__(self, concurrency: int, poll_interval: float):
+        self.concurrency = max(concurrency, 1)
+        self.poll_interval = poll_interval
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._next_sweep = 0.0
+
+    def wake(self) -> None:
+        """New job queued in this process - check the queue without waiting for poll_interval"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        """Run in the background of the current event loop (API process)"""
+        if self._runner is None:
+            self._stopping = False
+            self._runner = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Stop claiming jobs and give in-flight sends up to timeout seconds
+
+        Прерванные задачи остаются "running" и после WEBHOOK_JOB_LEASE_SECONDS
+        забираются снова.
+        """
+        self._stopping = True
+        self.wake()
+        if self._runner is not None:
+            await self._runner
+            self._runner = None
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+
+    async def run(self) -> None:
+        self._wakeup = asyncio.Event()
+        print(f"🚚 Webhook dispatcher started (concurrency {self.concurrency})")
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            self._wakeup.clear()
+            if loop.time() >= self._next_sweep:
+                self._next_sweep = loop.time() + settings.WEBHOOK_JOB_SWEEP_INTERVAL_SECONDS
+                await self._sweep()
+            free = self.concurrency - len(self._tasks)
+            claimed = []
+            if free > 0:
+                try:
+                    SessionLocal = get_async_session_local()
+                    async with SessionLocal() as db:
+                        claimed = await jobs.claim_webhook_jobs(db, free)
+                except Exception as e:
+                    print(f"⚠️ Could not claim webhook jobs: {e}")
+
+            for job in claimed:
+                task = asyncio.create_task(self._process(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._on_task_done)
+
+            if claimed and len(claimed) == free:
+                # Очередь, возможно, не пуста - дальше ждем только освобождения слота
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        print("🚚 Webhook dispatcher stopped")
+
+    async def _sweep(self) -> None:
+        """Dead-letter jobs abandoned on their last attempt and prune old done/dead jobs with their files"""
+        try:
+            SessionLocal = get_async_session_local()
+            async with SessionLocal() as db:
+                for job in await jobs.dead_letter_lost_webhook_jobs(db):
+                    self.dead += 1
+                    print(f"❌ Webhook job {job.id} ({job.destination}) dead after {job.attempts} attempts: {job.last_error}")
+                    if job.upload_sha256 and job.tgid:
+                        await queries.finish_upload(db, job.tgid, job.upload_sha256, "failed")
+                # Задачи dead хранятся (с файлами) WEBHOOK_JOB_RETENTION_HOURS - чтобы их можно было повторить
+                file_paths = await jobs.prune_webhook_jobs(db)
+            for file_path in file_paths:
+                jobs.remove_webhook_job_file(file_path)
+        except Exception as e:
+            print(f"⚠️ Could not sweep webhook jobs: {e}")
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _send(self, job: WebhookJob) -> httpx.Response:
+        url = _webhook_url(job.destination)
+        if not url:
+            raise RuntimeError(f"{job.destination} webhook URL is not configured")
+        if job.file_size is None:
+            return await post_webhook(job.destination, url, json=job.payload, headers={"Content-Type": "application/json"})
+        # Соединение с БД нужно только на время чтения файла, не на время отправки
+        SessionLocal = get_async_session_local()
+        async with SessionLocal() as db:
+            fileobj = await jobs.open_webhook_job_file(db, job)
+        try:
+            # Формат тела (base64 в JSON или multipart) - по настройке на момент отправки
+            body = build_upload_body(job.payload, "file", fileobj, settings.ANALYSIS_WEBHOOK_TRANSPORT)
+            return await post_webhook(
+                job.destination,
+                url,
+                content=body.aiter_chunks(),
+                headers={"Content-Type": body.content_type, "Content-Length": str(len(body))}
+            )
+        finally:
+            fileobj.close()
+
+    async def _process(self, job: WebhookJob) -> None:
+        response_status = None
+        error = None
+        retryable = True
+        try:
+            response = await self._send(job)
+            response_status = response.status_code
+            if response.status_code >= 400:
+                error = f"HTTP {response.status_code}: {response.text[:500]}"
+                retryable = _is_retryable_status(response.status_code)
+        except jobs.WebhookJobFileMissing as e:
+            error = str(e)
+            retryable = False
+        except Exception as e:
+            # Таймауты и ошибки соединения (httpx.HTTPError), не заданный URL - повторяем
+            error = f"{type(e).__name__}: {e}"
+
+        try:
+            SessionLocal = get_async_session_local()
+            async with SessionLocal() as db:
+                if error is None:
+                    await jobs.complete_webhook_job(db, job.id, response_status)
+                    jobs.remove_webhook_job_file(job.file_path)
+                    self.sent += 1
+                    print(f"✅ Webhook job {job.id} ({job.destination}) sent, status {response_status}")
+                    final_status = "sent"
+                else:
+                    new_status = await jobs.fail_webhook_job(db, job.id, job.attempts, error, response_status, retryable)
+                    if new_status == "dead":
+                        self.dead += 1
+                        print(f"❌ Webhook job {job.id} ({job.destination}) dead after {job.attempts} attempts: {error}")
+                        final_status = "failed"
+                    else:
+                        self.retried += 1
+                        print(f"⚠️ Webhook job {job.id} ({job.destination}) attempt {job.attempts} failed, will retry: {error}")
+                        final_status = None
+
+                # Статус загрузки (дедупликация по SHA-256) - по окончательному итогу
+                if final_status and job.upload_sha256 and job.tgid:
+                    await queries.finish_upload(db, job.tgid, job.upload_sha256, final_status)
+        except Exception as e:
+            # Задача останется "running" и будет забрана снова по истечении аренды
+            print(f"⚠️ Could not update webhook job {job.id}: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "running": self._runner is not None,
+            "concurrency": self.concurrency,
+            "in_flight": len(self._tasks),
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead": self.dead,
+        }
+
+
+webhook_dispatcher = WebhookDispatcher(settings.WEBHOOK_WORKER_CONCURRENCY, settings.WEBHOOK_WORKER_POLL_INTERVAL)
+
+
+async def main() -> None:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    webhook_dispatcher.start()
+    await stop.wait()
+    await webhook_dispatcher.stop(timeout=settings.ANALYSIS_WEBHOOK_TIMEOUT)
+    await close_http_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
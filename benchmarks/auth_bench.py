@@ -0,0 +1,94 @@
+"""
+Microbenchmark: cost of authenticating one request by x-telegram-initdata
+
+    python -m benchmarks.auth_bench [-n 20000]
+
+before  - verify_init_data + parse_init_data (два parse_qs, secret на каждый вызов)
+decode  - decode_init_data (один проход, secret из кеша)
+cached  - get_tgid_from_header при попадании в кеш initData
+token   - get_tgid_from_header с сессионным токеном (Authorization: Bearer)
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import time
+import timeit
+from urllib.parse import urlencode
+
+BOT_TOKEN = "1234567890:benchmark-token"
+os.environ.setdefault("BOT_TOKEN", BOT_TOKEN)
+
+from app.config import settings  # noqa: E402
+from app.middleware.auth import create_session_token, get_tgid_from_header  # noqa: E402
+from app.telegram.decode import decode_init_data  # noqa: E402
+from app.telegram.parse import parse_init_data  # noqa: E402
+from app.telegram.verify import verify_init_data  # noqa: E402
+
+
+def make_init_data(bot_token: str) -> str:
+    """Signed initData of typical Mini App size (~500 bytes)"""
+    user = {
+        "id": 123456789,
+        "first_name": "Benchmark",
+        "last_name": "User",
+        "username": "benchmark_user",
+        "language_code": "ru",
+        "is_premium": True,
+        "allows_write_to_pm": True,
+        "photo_url": "https://t.me/i/userpic/320/abcdefghijklmnopqrstuvwxyz0123456789.svg",
+    }
+    params = {
+        "query_id": "AAHdF6IQAAAAAN0XohDhrOrc",
+        "user": json.dumps(user, separators=(",", ":")),
+        "auth_date": str(int(time.time())),
+        "signature": "a" * 86,
+    }
+    data_check_string = "\n".join(f"{k}={params[k]}" for k in sorted(params))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    params["hash"] = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(params)
+
+
+def before(init_data: str) -> str:
+    if not verify_init_data(init_data, settings.BOT_TOKEN):
+        raise RuntimeError("signature mismatch")
+    return str(parse_init_data(init_data)["parsed_user"].id)
+
+
+def after(init_data: str) -> str:
+    decoded = decode_init_data(init_data, settings.BOT_TOKEN)
+    if decoded is None:
+        raise RuntimeError("signature mismatch")
+    return str(decoded.user.id)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    init_data = make_init_data(settings.BOT_TOKEN)
+    assert before(init_data) == after(init_data) == get_tgid_from_header(init_data, None)
+    print(f"initData: {len(init_data)} bytes, {args.number} iterations")
+
+    authorization = f"Bearer {create_session_token(init_data)[0]}"
+    cases = (
+        ("before", lambda: before(init_data)),
+        ("decode", lambda: after(init_data)),
+        ("cached", lambda: get_tgid_from_header(init_data, None)),
+        ("token", lambda: get_tgid_from_header(None, authorization)),
+    )
+
+    results = {}
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=args.number, repeat=5))
+        results[name] = best / args.number * 1e6
+        print(f"{name:>8}: {results[name]:8.2f} us/request")
+
+    print(f"decode speedup: {results['before'] / results['decode']:.1f}x, cached: {results['before'] / results['cached']:.1f}x, token: {results['before'] / results['token']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark: PDF text extraction backends on a local corpus of sample PDFs
+
+    python -m benchmarks.pdf_backends path/to/pdfs [-r 3] [--backends pypdf2,pypdfium2] [--reference pypdfium2]
+
+Для каждого установленного backend (PDF_BACKEND) в отдельном процессе:
+    pages/s  - пропускная способность (лучший из -r проходов по всему корпусу)
+    peak MB  - прирост пикового RSS процесса (включает память C-библиотек)
+    chars    - сколько символов извлечено
+    quality  - сходство текста (по словам, 0..1) с эталоном: file.txt рядом с
+               file.pdf, если есть, иначе вывод --reference backend
+    failed   - документы, которые backend не смог открыть
+
+Корпус (реальные анализы) в репозиторий не входит - это данные пользователей.
+"""
+import argparse
+import difflib
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.pdf_backends import BACKENDS
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_backend(name: str, paths: List[str], repeat: int) -> Tuple[Dict[str, str], float, int, float, int]:
+    """Runs in a fresh process: (texts by path, best seconds, pages, peak RSS growth MB, failed)"""
+    from app.utils.pdf_backends import get_pdf_backend
+
+    backend = get_pdf_backend(name)
+    baseline = _peak_rss_mb()
+    texts: Dict[str, str] = {}
+    best = None
+    pages = 0
+    failed = 0
+    for _ in range(repeat):
+        pages = failed = 0
+        started = time.perf_counter()
+        for path in paths:
+            try:
+                with open(path, "rb") as pdf_file:
+                    document = backend.open(pdf_file)
+                    try:
+                        parts = []
+                        for index in range(document.page_count):
+                            try:
+                                parts.append(document.page_text(index))
+                            except Exception:
+                                parts.append("")
+                        pages += document.page_count
+                    finally:
+                        document.close()
+                texts[path] = "\n\n".join(part for part in parts if part)
+            except Exception:
+                failed += 1
+                texts[path] = ""
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return texts, best, pages, _peak_rss_mb() - baseline, failed
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+(?:[.,]\d+)?", text.lower())
+
+
+def similarity(text: str, reference: str) -> float:
+    """Word-level similarity 0..1 (числа с дробной частью - одно слово)"""
+    a, b = _words(text), _words(reference)
+    if not a and not b:
+        return 1.0
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus", help="Directory with sample PDFs (optionally file.txt with expected text next to file.pdf)")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backend names")
+    parser.add_argument("--reference", default=None, help="Backend whose output is the quality reference when there is no .txt")
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.corpus, name) for name in os.listdir(args.corpus) if name.lower().endswith(".pdf")
+    )
+    if not paths:
+        parser.error(f"no PDF files in {args.corpus}")
+
+    names = [name.strip().lower() for name in args.backends.split(",") if name.strip()]
+    unknown = [name for name in names if name not in BACKENDS]
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(unknown)}")
+    missing = [name for name in names if not BACKENDS[name].is_available()]
+    names = [name for name in names if name not in missing]
+    if missing:
+        print(f"not installed, skipped: {', '.join(missing)}")
+    if not names:
+        parser.error("none of the requested backends is installed")
+
+    size_mb = sum(os.path.getsize(path) for path in paths) / (1024 * 1024)
+    print(f"corpus: {len(paths)} PDFs, {size_mb:.1f} MB, {args.repeat} passes")
+
+    # Каждый backend - в новом процессе: замер памяти не смешивается с другими библиотеками
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[name] = executor.submit(_run_backend, name, paths, args.repeat).result()
+
+    reference_name: Optional[str] = args.reference or ("pypdfium2" if "pypdfium2" in results else names[0])
+    if reference_name not in results:
+        parser.error(f"reference backend {reference_name!r} was not benchmarked")
+    references = {}
+    for path in paths:
+        expected_path = os.path.splitext(path)[0] + ".txt"
+        if os.path.exists(expected_path):
+            with open(expected_path, encoding="utf-8") as f:
+                references[path] = f.read()
+        else:
+            references[path] = results[reference_name][0][path]
+
+    print(f"quality reference: .txt files where present, otherwise {reference_name}")
+    print(f"{'backend':>10} {'pages/s':>9} {'seconds':>8} {'peak MB':>8} {'chars':>9} {'quality':>8} {'failed':>7}")
+    for name, (texts, seconds, pages, peak_mb, failed) in results.items():
+        chars = sum(len(text) for text in texts.values())
+        quality = sum(similarity(texts[path], references[path]) for path in paths) / len(paths)
+        print(
+            f"{name:>10} {pages / seconds if seconds else 0:9.1f} {seconds:8.3f} {peak_mb:8.1f} "
+            f"{chars:9d} {quality:8.3f} {failed:7d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+-- Рекомендации ИИ по одной строке на (tgid, analysis_id) вместо JSONB-словаря health_app.rekom.
+-- Поиск, сохранение и сброс (force_new) затрагивают одну строку по первичному ключу.
+CREATE TABLE IF NOT EXISTS analysis_recommendations (
+  tgid TEXT NOT NULL REFERENCES health_app(tgid) ON DELETE CASCADE,
+  analysis_id TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'processing',  -- processing | ready
+  text TEXT,  -- NULL, пока рекомендация не пришла от ИИ
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (tgid, analysis_id)
+);
+
+-- GET /api/recommendations/last
+CREATE INDEX IF NOT EXISTS idx_analysis_recommendations_tgid_updated_at
+  ON analysis_recommendations (tgid, updated_at);
+
+-- Перенос готовых рекомендаций из rekom ({analysis_id: текст})
+INSERT INTO analysis_recommendations (tgid, analysis_id, status, text, created_at, updated_at)
+SELECT
+    h.tgid,
+    r.key,
+    'ready',
+    CASE WHEN jsonb_typeof(r.value) = 'string' THEN r.value #>> '{}' ELSE r.value::text END,
+    COALESCE(h.created_at, now()),
+    COALESCE(h.created_at, now())
+FROM health_app h
+CROSS JOIN LATERAL jsonb_each(
+    CASE WHEN jsonb_typeof(h.rekom) = 'object' THEN h.rekom ELSE '{}'::jsonb END
+) AS r
+ON CONFLICT (tgid, analysis_id) DO NOTHING;
+
+-- recommendations.last_recommendation задает, какая рекомендация последняя
+-- (try_cast_timestamptz - из add_analysis_reports.sql)
+INSERT INTO analysis_recommendations (tgid, analysis_id, status, text, created_at, updated_at)
+SELECT
+    h.tgid,
+    h.recommendations -> 'last_recommendation' ->> 'analysis_id',
+    'ready',
+    h.recommendations -> 'last_recommendation' ->> 'text',
+    COALESCE(try_cast_timestamptz(h.recommendations -> 'last_recommendation' ->> 'created_at'), h.updated_at, now()),
+    COALESCE(try_cast_timestamptz(h.recommendations -> 'last_recommendation' ->> 'created_at'), h.updated_at, now())
+FROM health_app h
+WHERE jsonb_typeof(h.recommendations -> 'last_recommendation') = 'object'
+  AND h.recommendations -> 'last_recommendation' ->> 'analysis_id' IS NOT NULL
+ON CONFLICT (tgid, analysis_id) DO UPDATE SET updated_at = EXCLUDED.updated_at;
+
+-- Колонка rekom больше не используется и оставлена для отката
@@ -0,0 +1,142 @@
+-- Отдельная таблица отчетов ИИ вместо JSONB-массива health_app.allanalize
+-- (и дублирующего его analyses.reports). Новый отчет - один INSERT,
+-- история читается диапазоном по индексу (tgid, created_at).
+CREATE TABLE IF NOT EXISTS analysis_reports (
+  id BIGSERIAL PRIMARY KEY,
+  tgid TEXT NOT NULL REFERENCES health_app(tgid) ON DELETE CASCADE,
+  file_name TEXT NOT NULL DEFAULT 'unknown',
+  text TEXT NOT NULL,
+  client_created_at TEXT NOT NULL,  -- createdAt в том виде, в котором его видит клиент
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()  -- для сортировки
+);
+
+CREATE INDEX IF NOT EXISTS idx_analysis_reports_tgid_created_at
+  ON analysis_reports (tgid, created_at);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_analysis_reports_tgid_file_created
+  ON analysis_reports (tgid, file_name, client_created_at);
+
+-- Безопасное приведение строки к timestamptz (NULL, если строка не парсится)
+CREATE OR REPLACE FUNCTION try_cast_timestamptz(value TEXT)
+RETURNS TIMESTAMPTZ
+LANGUAGE plpgsql
+STABLE
+AS $$
+BEGIN
+    RETURN value::timestamptz;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$;
+
+-- Перенос существующей истории: allanalize бывает списком или объектом
+-- с ключом "analyses"/"history"; отчеты из analyses.reports добавляются,
+-- если их нет в allanalize. Повторный запуск ничего не дублирует.
+WITH items AS (
+    SELECT h.tgid, h.created_at AS user_created_at, item, 1 AS source, ordinality
+    FROM health_app h
+    CROSS JOIN LATERAL jsonb_array_elements(
+        CASE
+            WHEN jsonb_typeof(h.allanalize) = 'array' THEN h.allanalize
+            WHEN jsonb_typeof(h.allanalize -> 'analyses') = 'array' THEN h.allanalize -> 'analyses'
+            WHEN jsonb_typeof(h.allanalize -> 'history') = 'array' THEN h.allanalize -> 'history'
+            ELSE '[]'::jsonb
+        END
+    ) WITH ORDINALITY AS t(item, ordinality)
+    UNION ALL
+    SELECT h.tgid, h.created_at, item, 2, ordinality
+    FROM health_app h
+    CROSS JOIN LATERAL jsonb_array_elements(
+        CASE
+            WHEN jsonb_typeof(h.analyses -> 'reports') = 'array' THEN h.analyses -> 'reports'
+            ELSE '[]'::jsonb
+        END
+    ) WITH ORDINALITY AS t(item, ordinality)
+),
+parsed AS (
+    SELECT
+        tgid,
+        user_created_at,
+        source,
+        ordinality,
+        COALESCE(item ->> 'fileName', item ->> 'file_name', 'unknown') AS file_name,
+        COALESCE(item ->> 'text', item ->> 'report', '') AS text,
+        NULLIF(COALESCE(item ->> 'createdAt', item ->> 'created_at'), '') AS client_created_at
+    FROM items
+    WHERE jsonb_typeof(item) = 'object'
+      -- старый формат: в allanalize попадал целиком объект analyses
+      AND NOT (item ? 'reports' AND item ? 'last_report')
+),
+-- Отчет без даты, который есть и в allanalize, и в analyses.reports, переносится один раз
+undated AS (
+    SELECT DISTINCT ON (tgid, file_name, text) tgid, user_created_at, source, ordinality, file_name, text
+    FROM parsed
+    WHERE client_created_at IS NULL
+    ORDER BY tgid, file_name, text, source, ordinality
+),
+-- Без даты: своя метка времени у каждого отчета (иначе все "unknown" без даты
+-- слились бы в одну строку по уникальному индексу), в исходном порядке и раньше
+-- датированных отчетов. Отчеты из allanalize нумеруются первыми - при повторном
+-- запуске (analyses.reports уже удален) метки те же.
+undated_labeled AS (
+    SELECT
+        tgid,
+        file_name,
+        text,
+        COALESCE(user_created_at, timestamptz '2000-01-01 00:00:00+00')
+            + (row_number() OVER (PARTITION BY tgid ORDER BY source, ordinality)) * interval '1 microsecond' AS created_at
+    FROM undated
+),
+reports AS (
+    SELECT
+        tgid,
+        file_name,
+        text,
+        client_created_at,
+        COALESCE(
+            try_cast_timestamptz(client_created_at),
+            COALESCE(user_created_at, timestamptz '2000-01-01 00:00:00+00') + ordinality * interval '1 microsecond'
+        ) AS created_at
+    FROM parsed
+    WHERE client_created_at IS NOT NULL
+    UNION ALL
+    SELECT tgid, file_name, text, to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US'), created_at
+    FROM undated_labeled
+)
+INSERT INTO analysis_reports (tgid, file_name, text, client_created_at, created_at)
+SELECT tgid, file_name, text, client_created_at, created_at
+FROM reports
+ON CONFLICT (tgid, file_name, client_created_at) DO NOTHING;
+
+-- analyses.reports больше не ведется: analyses хранит только last_report.
+-- Удаляется только у пользователей, все отчеты которых есть в analysis_reports
+-- (при расхождении - например, два разных отчета с тем же fileName и createdAt -
+-- analyses.reports остается для ручного разбора).
+-- Колонка allanalize оставлена для отката и может быть удалена позже.
+DO $$
+DECLARE
+    kept INTEGER;
+BEGIN
+    UPDATE health_app h SET analyses = h.analyses - 'reports'
+    WHERE h.analyses ? 'reports'
+      AND NOT EXISTS (
+          SELECT 1
+          FROM jsonb_array_elements(
+              CASE WHEN jsonb_typeof(h.analyses -> 'reports') = 'array' THEN h.analyses -> 'reports' ELSE '[]'::jsonb END
+          ) AS t(item)
+          WHERE jsonb_typeof(item) = 'object'
+            AND NOT (item ? 'reports' AND item ? 'last_report')
+            AND NOT EXISTS (
+                SELECT 1 FROM analysis_reports r
+                WHERE r.tgid = h.tgid
+                  AND r.file_name = COALESCE(item ->> 'fileName', item ->> 'file_name', 'unknown')
+                  AND r.text = COALESCE(item ->> 'text', item ->> 'report', '')
+            )
+      );
+
+    SELECT count(*) INTO kept FROM health_app WHERE analyses ? 'reports';
+    IF kept > 0 THEN
+        RAISE WARNING 'analyses.reports kept for % users: some reports were not copied to analysis_reports', kept;
+    END IF;
+END
+$$;
@@ -0,0 +1,7 @@
+-- Индекс под keyset-пагинацию GET /api/analyses/history:
+-- WHERE tgid = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?
+CREATE INDEX IF NOT EXISTS idx_analysis_reports_tgid_created_at_id
+  ON analysis_reports (tgid, created_at, id);
+
+-- Старый индекс (tgid, created_at) покрывается новым
+DROP INDEX IF EXISTS idx_analysis_reports_tgid_created_at;
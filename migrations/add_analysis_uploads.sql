@@ -0,0 +1,20 @@
+-- Загруженные файлы по SHA-256 содержимого: повторная загрузка того же файла
+-- (двойное нажатие, повтор после таймаута) не запускает обработку в n8n снова.
+CREATE TABLE IF NOT EXISTS analysis_uploads (
+  tgid TEXT NOT NULL REFERENCES health_app(tgid) ON DELETE CASCADE,
+  sha256 TEXT NOT NULL,
+  file_name TEXT NOT NULL,
+  mime_type TEXT,
+  size BIGINT,
+  client_time TEXT,  -- clientTime, отправленный в n8n (по нему связывается отчет)
+  status TEXT NOT NULL DEFAULT 'processing',  -- processing | sent | failed
+  report_id BIGINT REFERENCES analysis_reports(id) ON DELETE SET NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (tgid, sha256)
+);
+
+-- Привязка отчета из /api/analyses/result без fileHash - по имени файла и clientTime
+CREATE INDEX IF NOT EXISTS idx_analysis_uploads_tgid_file_client_time
+  ON analysis_uploads (tgid, file_name, client_time)
+  WHERE report_id IS NULL;
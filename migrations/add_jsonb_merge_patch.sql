@@ -0,0 +1,33 @@
+-- JSON Merge Patch (RFC 7396) для JSONB: используется в POST /api/me и POST /api/opros/anemia
+-- при merge_patch=true. Вложенные объекты сливаются рекурсивно, ключ со значением null удаляется,
+-- любое значение-не-объект в patch заменяет target целиком.
+CREATE OR REPLACE FUNCTION jsonb_merge_patch(target JSONB, patch JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+IMMUTABLE
+AS $$
+BEGIN
+    IF jsonb_typeof(patch) IS DISTINCT FROM 'object' THEN
+        RETURN patch;
+    END IF;
+
+    IF jsonb_typeof(target) IS DISTINCT FROM 'object' THEN
+        target := '{}'::jsonb;
+    END IF;
+
+    RETURN (
+        SELECT COALESCE(jsonb_object_agg(merged.key, merged.value), '{}'::jsonb)
+        FROM (
+            SELECT
+                COALESCE(t.key, p.key) AS key,
+                CASE
+                    WHEN p.key IS NULL THEN t.value
+                    ELSE jsonb_merge_patch(t.value, p.value)
+                END AS value
+            FROM jsonb_each(target) AS t
+            FULL OUTER JOIN jsonb_each(patch) AS p ON t.key = p.key
+            WHERE p.key IS NULL OR jsonb_typeof(p.value) <> 'null'
+        ) AS merged
+    );
+END;
+$$;
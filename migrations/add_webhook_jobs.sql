@@ -0,0 +1,33 @@
+-- Очередь вызовов webhook n8n: API ставит задачу и отвечает 202,
+-- воркеры (python -m app.worker) забирают задачи через FOR UPDATE SKIP LOCKED.
+CREATE TABLE IF NOT EXISTS webhook_jobs (
+  id BIGSERIAL PRIMARY KEY,
+  destination TEXT NOT NULL,  -- analysis | recommendations
+  tgid TEXT,
+  payload JSONB NOT NULL,
+  file_size BIGINT,  -- размер файла загрузки (NULL - задача без файла)
+  file_path TEXT,  -- файл в WEBHOOK_FILE_DIR; NULL - файл в webhook_job_chunks
+  upload_sha256 TEXT,  -- запись analysis_uploads, статус которой обновляется по итогу
+  status TEXT NOT NULL DEFAULT 'pending',  -- pending | running | done | dead
+  attempts INTEGER NOT NULL DEFAULT 0,
+  run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_at TIMESTAMPTZ,
+  last_error TEXT,
+  response_status INTEGER,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Выборка готовых к отправке задач (и зависших у упавшего воркера)
+CREATE INDEX IF NOT EXISTS idx_webhook_jobs_run_at
+  ON webhook_jobs (run_at)
+  WHERE status IN ('pending', 'running');
+
+-- Файл загрузки (уходит в теле как "file") - по куску WEBHOOK_FILE_CHUNK_BYTES в строке:
+-- выборка задач его не читает, запись и чтение идут без всего файла в памяти
+CREATE TABLE IF NOT EXISTS webhook_job_chunks (
+  job_id BIGINT NOT NULL REFERENCES webhook_jobs(id) ON DELETE CASCADE,
+  seq INTEGER NOT NULL,  -- порядковый номер куска с 0
+  data BYTEA NOT NULL,
+  PRIMARY KEY (job_id, seq)
+);
@@ -0,0 +1,93 @@
+"""Webhook body compression and callback body decompression (app/utils/compression.py)"""
+import asyncio
+import os
+import zlib
+
+import pytest
+
+from app.utils.compression import (
+    DecompressedTooLarge,
+    UnsupportedEncoding,
+    compress_bytes,
+    compress_stream,
+    decompress_bytes,
+    resolve_encoding,
+    zstd_available,
+)
+
+DATA = b'{"report": "' + b"Hb 120 g/L; " * 500 + b'"}'
+
+
+@pytest.mark.parametrize("name", [None, "", "none", "identity", " None "])
+def test_resolve_no_compression(name):
+    assert resolve_encoding(name) is None
+
+
+def test_resolve_gzip_and_zstd():
+    assert resolve_encoding("GZIP") == "gzip"
+    # Без пакета zstandard - gzip
+    assert resolve_encoding("zstd") == ("zstd" if zstd_available() else "gzip")
+
+
+def test_resolve_unknown_encoding():
+    with pytest.raises(ValueError):
+        resolve_encoding("brotli")
+
+
+def test_gzip_round_trip():
+    compressed = compress_bytes(DATA, "gzip")
+
+    assert len(compressed) < len(DATA)
+    assert decompress_bytes(compressed, "gzip", len(DATA)) == DATA
+    assert decompress_bytes(compressed, "x-gzip", len(DATA)) == DATA
+
+
+def test_compress_stream_matches_whole_body():
+    async def chunks():
+        for i in range(0, len(DATA), 1000):
+            yield DATA[i:i + 1000]
+
+    async def collect():
+        return b"".join([part async for part in compress_stream(chunks(), "gzip")])
+
+    assert decompress_bytes(asyncio.run(collect()), "gzip", len(DATA)) == DATA
+
+
+def test_deflate_with_and_without_zlib_header():
+    raw = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    raw_deflate = raw.compress(DATA) + raw.flush()
+
+    assert decompress_bytes(zlib.compress(DATA), "deflate", len(DATA)) == DATA
+    assert decompress_bytes(raw_deflate, "deflate", len(DATA)) == DATA
+
+
+def test_identity_is_returned_as_is():
+    assert decompress_bytes(DATA, "identity", 1) == DATA
+
+
+def test_decompressed_size_limit():
+    bomb = compress_bytes(b"\0" * 1_000_000, "gzip")
+
+    with pytest.raises(DecompressedTooLarge):
+        decompress_bytes(bomb, "gzip", 10_000)
+
+
+def test_corrupted_body():
+    with pytest.raises(ValueError):
+        decompress_bytes(os.urandom(64), "gzip", 1000)
+
+
+def test_unsupported_encoding():
+    with pytest.raises(UnsupportedEncoding):
+        decompress_bytes(DATA, "br", len(DATA))
+
+
+@pytest.mark.skipif(not zstd_available(), reason="zstandard is not installed")
+def test_zstd_round_trip():
+    assert decompress_bytes(compress_bytes(DATA, "zstd"), "zstd", len(DATA)) == DATA
+
+
+@pytest.mark.skipif(zstd_available(), reason="zstandard is installed")
+def test_zstd_without_package():
+    with pytest.raises(UnsupportedEncoding):
+        decompress_bytes(b"", "zstd", 10)
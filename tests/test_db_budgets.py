@@ -0,0 +1,117 @@
+"""
+SQL statement budgets (DB_ROUTE_BUDGETS) of the main routes
+
+Нужна отдельная тестовая база PostgreSQL (таблицы создаются тестом):
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/health_test python -m pytest tests
+
+Без TEST_DATABASE_URL тесты пропускаются. Если маршрут стал делать больше запросов
+к БД, чем указано в DB_ROUTE_BUDGETS, middleware в строгом режиме отвечает 500 -
+тест падает. Новый бюджет в DB_ROUTE_BUDGETS требует нового запроса в ROUTE_CASES.
+"""
+import os
+from pathlib import Path
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if not TEST_DATABASE_URL:
+    pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from app import database  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.main import app  # noqa: E402
+from app.telegram.session_token import derive_session_secret, issue_session_token  # noqa: E402
+
+TGID = "900000001"
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+
+# "METHOD /path" из DB_ROUTE_BUDGETS -> (метод, URL, JSON-тело)
+ROUTE_CASES = {
+    "GET /api/me": ("GET", "/api/me", None),
+    "POST /api/me": ("POST", "/api/me", {"profile": {"height": 170}, "merge_patch": True}),
+    "GET /api/analyses/history": ("GET", "/api/analyses/history", None),
+    "GET /api/opros/history": ("GET", "/api/opros/history", None),
+    "POST /api/opros/anemia": ("POST", "/api/opros/anemia", {"opros_anemia": {"q1": "yes"}, "merge_patch": True}),
+    "POST /api/analyses/summary": (
+        "POST",
+        "/api/analyses/summary",
+        {"analyses": {"last_report": {"text": "Hb 120 g/L (edited)", "fileName": "a.pdf", "createdAt": "2025-01-01T10:00:00+03:00"}}},
+    ),
+    "POST /api/analyses/result": (
+        "POST",
+        "/api/analyses/result",
+        {"tgid": TGID, "report": "Hb 120 g/L", "fileName": "a.pdf", "clientTime": "2025-01-01T10:00:00+03:00"},
+    ),
+    "POST /api/recommendations/get": (
+        "POST",
+        "/api/recommendations/get",
+        {"analysis_text": "Hb 120 g/L", "analysis_id": "budget-test"},
+    ),
+    "POST /api/recommendations/result": (
+        "POST",
+        "/api/recommendations/result",
+        {"tgid": TGID, "analysis_id": "budget-test", "recommendation": "Iron"},
+    ),
+    "GET /api/recommendations/last": ("GET", "/api/recommendations/last", None),
+    "GET /api/recommendations/{analysis_id}": ("GET", "/api/recommendations/budget-test", None),
+}
+
+
+async def _create_schema() -> None:
+    engine = database.get_async_engine()
+    async with engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+        await conn.exec_driver_sql((MIGRATIONS_DIR / "add_jsonb_merge_patch.sql").read_text())
+        for table in ("webhook_jobs", "analysis_uploads", "analysis_recommendations", "analysis_reports"):
+            await conn.execute(text(f"DELETE FROM {table} WHERE tgid = :tgid"), {"tgid": TGID})
+        await conn.execute(text("DELETE FROM health_app WHERE tgid = :tgid"), {"tgid": TGID})
+
+
+@pytest.fixture(scope="module")
+def client():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(settings, "DATABASE_URL", TEST_DATABASE_URL)
+        mp.setattr(settings, "DATABASE_REPLICA_URL", None)
+        mp.setattr(settings, "DB_BUDGET_STRICT", True)
+        mp.setattr(settings, "SESSION_SECRET", "test-session-secret")
+        mp.setattr(settings, "RECOMMENDATIONS_WEBHOOK_URL", "http://127.0.0.1:9/recommendations")
+        mp.setattr(settings, "WEBHOOK_QUEUE_ENABLED", True)
+        # Задачи из очереди в тесте не отправляются
+        mp.setattr(settings, "WEBHOOK_WORKER_IN_PROCESS", False)
+
+        # Один event loop на все запросы: соединения asyncpg в пуле привязаны к нему
+        with TestClient(app) as test_client:
+            test_client.portal.call(_create_schema)
+            token = issue_session_token(TGID, 2**31 - 1, derive_session_secret(settings.SESSION_SECRET))
+            test_client.headers["Authorization"] = f"Bearer {token}"
+            # Пользователь уже существует - бюджеты заданы для обычного (не первого) запроса
+            test_client.get("/api/me")
+            yield test_client
+
+
+def test_every_budget_has_a_case():
+    assert set(ROUTE_CASES) == set(settings.DB_ROUTE_BUDGETS)
+
+
+@pytest.mark.parametrize("route_key", list(ROUTE_CASES))
+def test_route_within_statement_budget(client, route_key):
+    method, url, body = ROUTE_CASES[route_key]
+    response = client.request(method, url, json=body)
+
+    assert response.status_code < 500, response.text
+    statements = int(response.headers.get("X-DB-Statements", 0))
+    assert 0 < statements <= settings.DB_ROUTE_BUDGETS[route_key]
+
+
+def test_exceeded_budget_fails_in_strict_mode(client, monkeypatch):
+    monkeypatch.setitem(settings.DB_ROUTE_BUDGETS, "POST /api/analyses/result", 1)
+    method, url, body = ROUTE_CASES["POST /api/analyses/result"]
+
+    response = client.request(method, url, json=body)
+
+    assert response.status_code == 500
+    assert "SQL statement budget exceeded" in response.json()["detail"]
@@ -0,0 +1,54 @@
+"""Cursor of /api/analyses/history (encode_history_cursor / decode_history_cursor)"""
+import base64
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.db.queries import decode_history_cursor, encode_history_cursor
+
+
+def _raw_cursor(raw: str) -> str:
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def test_round_trip():
+    created_at = datetime(2025, 1, 1, 10, 30, 15, 123456, tzinfo=timezone.utc)
+
+    assert decode_history_cursor(encode_history_cursor(created_at, 42)) == (created_at, 42)
+
+
+def test_offset_is_normalized_to_utc():
+    created_at = datetime(2025, 1, 1, 13, 0, tzinfo=timezone(timedelta(hours=3)))
+
+    decoded, report_id = decode_history_cursor(encode_history_cursor(created_at, 7))
+
+    assert decoded == created_at
+    assert decoded.tzinfo == timezone.utc
+    assert report_id == 7
+
+
+def test_largest_bigint_id_is_accepted():
+    cursor = _raw_cursor(f"2025-01-01T00:00:00+00:00|{2**63 - 1}")
+
+    assert decode_history_cursor(cursor)[1] == 2**63 - 1
+
+
+@pytest.mark.parametrize("raw", [
+    "2025-01-01T00:00:00+00:00|0",
+    "2025-01-01T00:00:00+00:00|-5",
+    f"2025-01-01T00:00:00+00:00|{2**63}",
+    "2025-01-01T00:00:00|5",
+    "0001-01-01T00:00:00+05:00|5",
+    "not a date|5",
+    "2025-01-01T00:00:00+00:00|abc",
+    "2025-01-01T00:00:00+00:00",
+])
+def test_invalid_values_are_rejected(raw):
+    with pytest.raises(ValueError):
+        decode_history_cursor(_raw_cursor(raw))
+
+
+@pytest.mark.parametrize("cursor", ["", "%%%", "//8"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_history_cursor(cursor)
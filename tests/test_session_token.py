@@ -0,0 +1,36 @@
+"""Signed session tokens (app/telegram/session_token.py)"""
+import time
+
+from app.telegram.session_token import derive_session_secret, issue_session_token, verify_session_token
+
+KEY = derive_session_secret("test-secret")
+
+
+def test_valid_token_returns_tgid():
+    token = issue_session_token("12345", int(time.time()) + 60, KEY)
+
+    assert verify_session_token(token, KEY) == "12345"
+
+
+def test_expired_token_is_rejected():
+    token = issue_session_token("12345", int(time.time()) - 1, KEY)
+
+    assert verify_session_token(token, KEY) is None
+
+
+def test_token_signed_with_another_secret_is_rejected():
+    token = issue_session_token("12345", int(time.time()) + 60, derive_session_secret("other-secret"))
+
+    assert verify_session_token(token, KEY) is None
+
+
+def test_tampered_token_is_rejected():
+    tgid, expires_at, mac = issue_session_token("12345", int(time.time()) + 60, KEY).split(".")
+
+    assert verify_session_token(f"99999.{expires_at}.{mac}", KEY) is None
+    assert verify_session_token(f"{tgid}.{int(expires_at) + 3600}.{mac}", KEY) is None
+
+
+def test_malformed_token_is_rejected():
+    for token in ("", "abc", "1.2", "1.2.3.4", "12345.soon.mac"):
+        assert verify_session_token(token, KEY) is None
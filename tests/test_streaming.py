@@ -0,0 +1,80 @@
+"""Streamed webhook bodies: declared length equals the produced bytes"""
+import asyncio
+import base64
+import io
+import json
+import os
+
+import pytest
+from starlette.datastructures import Headers
+from starlette.formparsers import MultiPartParser
+
+from app.utils.streaming import BASE64_CHUNK_SIZE, Base64JSONBody, MultipartBody, build_upload_body
+
+FIELDS = {"fileName": "анализ \"1\".pdf", "mimeType": "application/pdf", "size": 10, "profile": {"age": 30}, "note": None}
+# Пустой файл, размеры вокруг кратности 3 и границы куска
+SIZES = [0, 1, 2, 3, 4, BASE64_CHUNK_SIZE - 1, BASE64_CHUNK_SIZE, BASE64_CHUNK_SIZE + 1, 3 * BASE64_CHUNK_SIZE + 2]
+
+
+async def _aread(body) -> bytes:
+    return b"".join([chunk async for chunk in body.aiter_chunks()])
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_base64_json_body(size):
+    data = os.urandom(size)
+    body = Base64JSONBody(FIELDS, "file", io.BytesIO(data))
+
+    produced = b"".join(body)
+
+    assert len(produced) == len(body)
+    assert asyncio.run(_aread(body)) == produced
+    decoded = json.loads(produced)
+    assert base64.b64decode(decoded.pop("file")) == data
+    assert decoded == FIELDS
+
+
+def test_base64_json_body_without_fields():
+    body = Base64JSONBody({}, "file", io.BytesIO(b"abc"))
+
+    assert json.loads(b"".join(body)) == {"file": "YWJj"}
+
+
+def test_base64_chunk_size_must_be_multiple_of_3():
+    with pytest.raises(ValueError):
+        Base64JSONBody({}, "file", io.BytesIO(b""), chunk_size=1000)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_multipart_body(size):
+    data = os.urandom(size)
+    body = MultipartBody(FIELDS, "file", io.BytesIO(data), FIELDS["fileName"], FIELDS["mimeType"])
+
+    produced = b"".join(body)
+
+    assert len(produced) == len(body)
+    assert asyncio.run(_aread(body)) == produced
+
+    async def parse():
+        async def stream():
+            yield produced
+
+        form = await MultiPartParser(Headers({"content-type": body.content_type}), stream()).parse()
+        upload = form["file"]
+        return dict(form), upload.filename, upload.content_type, await upload.read()
+
+    form, filename, content_type, file_data = asyncio.run(parse())
+    assert file_data == data
+    assert filename == FIELDS["fileName"].replace('"', "%22")
+    assert content_type == "application/pdf"
+    assert form["fileName"] == FIELDS["fileName"]
+    assert form["size"] == "10"
+    assert json.loads(form["profile"]) == {"age": 30}
+    assert "note" not in form
+
+
+def test_build_upload_body():
+    assert isinstance(build_upload_body(FIELDS, "file", io.BytesIO(b"x"), "json"), Base64JSONBody)
+    assert isinstance(build_upload_body(FIELDS, "file", io.BytesIO(b"x"), "multipart"), MultipartBody)
+    with pytest.raises(ValueError):
+        build_upload_body(FIELDS, "file", io.BytesIO(b"x"), "xml")
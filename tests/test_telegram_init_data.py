@@ -0,0 +1,63 @@
+"""decode_init_data (один разбор initData) against the reference verify_init_data"""
+import hashlib
+import hmac
+import json
+from urllib.parse import urlencode
+
+import pytest
+
+from app.telegram.decode import decode_init_data
+from app.telegram.verify import verify_init_data
+
+BOT_TOKEN = "123456:TEST-TOKEN"
+USER = {"id": 42, "first_name": "Ann", "username": "ann", "language_code": "ru"}
+
+
+def _sign(params, bot_token=BOT_TOKEN) -> str:
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    data_check_string = "\n".join(f"{key}={params[key]}" for key in sorted(params))
+    return hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+
+
+def _init_data(**params) -> str:
+    return urlencode({**params, "hash": _sign(params)})
+
+
+VALID = _init_data(user=json.dumps(USER), auth_date="1700000000", query_id="AAE")
+
+CASES = {
+    "valid": VALID,
+    "uppercase hash": VALID.replace(VALID.rsplit("hash=", 1)[1], VALID.rsplit("hash=", 1)[1].upper()),
+    "blank value": _init_data(user=json.dumps(USER), auth_date="1700000000", start_param=""),
+    "without user": _init_data(auth_date="1700000000"),
+    "user is not json": _init_data(user="{not json", auth_date="1700000000"),
+    "tampered user": VALID.replace("Ann", "Bob"),
+    "tampered auth_date": VALID.replace("1700000000", "1800000000"),
+    "missing hash": urlencode({"user": json.dumps(USER), "auth_date": "1700000000"}),
+    "empty hash": urlencode({"user": json.dumps(USER), "auth_date": "1700000000", "hash": ""}),
+    "other bot": urlencode({"auth_date": "1", "hash": _sign({"auth_date": "1"}, "654321:OTHER")}),
+    "duplicate key": VALID + "&auth_date=1800000000",
+    "empty": "",
+}
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_decode_matches_verify(name):
+    init_data = CASES[name]
+
+    assert (decode_init_data(init_data, BOT_TOKEN) is not None) == verify_init_data(init_data, BOT_TOKEN)
+
+
+def test_decoded_fields():
+    decoded = decode_init_data(VALID, BOT_TOKEN)
+
+    assert decoded.auth_date == 1700000000
+    assert decoded.user.to_dict()["id"] == 42
+    assert decoded.user.username == "ann"
+
+
+def test_invalid_user_json_keeps_signature_result():
+    decoded = decode_init_data(CASES["user is not json"], BOT_TOKEN)
+
+    assert decoded is not None
+    assert decoded.user is None
@@ -0,0 +1,50 @@
+"""Upload type checks (app/middleware/upload_limits.py)"""
+import asyncio
+import io
+
+import pytest
+from fastapi import UploadFile
+
+from app.middleware.upload_limits import file_matches_type, is_mime_type_allowed
+
+
+def _matches(data: bytes, mime_type: str) -> bool:
+    upload = UploadFile(file=io.BytesIO(data))
+    result = asyncio.run(file_matches_type(upload, mime_type))
+    # Позиция возвращается в начало - файл дальше читается целиком
+    assert upload.file.tell() == 0
+    return result
+
+
+@pytest.mark.parametrize("data, mime_type", [
+    (b"%PDF-1.7\n...", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n\0\0\0\rIHDR", "image/png"),
+    (b"\xff\xd8\xff\xe0\0\x10JFIF", "image/jpeg"),
+    (b"GIF89a\x01\0", "image/gif"),
+    (b"GIF87a\x01\0", "Image/GIF; charset=binary"),
+    # Типы без сигнатуры не проверяются
+    (b"\0\0\0\x18ftypheic", "image/heic"),
+])
+def test_matching_signature(data, mime_type):
+    assert _matches(data, mime_type)
+
+
+@pytest.mark.parametrize("data, mime_type", [
+    (b"<html>%PDF-", "application/pdf"),
+    (b"\x89PNG", "image/png"),
+    (b"", "image/jpeg"),
+    (b"%PDF-1.7", "image/gif"),
+])
+def test_mismatching_signature(data, mime_type):
+    assert not _matches(data, mime_type)
+
+
+def test_mime_type_allowlist():
+    allowed = ["application/pdf", "image/*"]
+
+    assert is_mime_type_allowed("application/pdf", allowed)
+    assert is_mime_type_allowed("IMAGE/PNG; name=x", allowed)
+    assert not is_mime_type_allowed("text/html", allowed)
+    assert not is_mime_type_allowed(None, allowed)
+    assert not is_mime_type_allowed("imagex/png", allowed)
+    assert is_mime_type_allowed("text/html", None)
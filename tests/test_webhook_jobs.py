@@ -0,0 +1,20 @@
+"""Retry backoff of the webhook job queue (app/db/jobs.py)"""
+import pytest
+
+from app.config import settings
+from app.db.jobs import retry_delay
+
+
+@pytest.fixture(autouse=True)
+def backoff(monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_JOB_BACKOFF_SECONDS", 5)
+    monkeypatch.setattr(settings, "WEBHOOK_JOB_BACKOFF_MAX_SECONDS", 600)
+
+
+@pytest.mark.parametrize("attempts, base", [(0, 5), (1, 5), (2, 10), (3, 20), (7, 320), (8, 600), (50, 600)])
+def test_exponential_delay_with_jitter(attempts, base):
+    delays = [retry_delay(attempts) for _ in range(200)]
+
+    assert all(base * 0.8 <= delay <= base * 1.2 for delay in delays)
+    # Разброс есть - задачи, упавшие вместе, не повторяются одновременно
+    assert len(set(delays)) > 1